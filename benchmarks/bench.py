@@ -0,0 +1,317 @@
+"""
+Benchmarks unishox2 against zlib on the bundled corpora.
+
+Every string is compressed and decompressed on its own, which is how short-string compressors
+are used, and both are timed as calls per second and as MB/s of original (UTF-8) data.
+
+    python benchmarks/bench.py --json results.json
+    python benchmarks/bench.py --compare results.json
+
+With --compare, the run fails (exiting with status 1) if unishox2 compresses any corpus worse
+than the baseline did, or its throughput drops by more than --tolerance. CI runs it against
+the committed baseline.json with --ratios-only, since throughput is only comparable between
+runs on the same machine:
+
+    python benchmarks/bench.py --codec unishox2 --compare benchmarks/baseline.json --ratios-only
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import zlib
+
+import unishox2
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPORA_DIR = os.path.join(BENCHMARKS_DIR, "corpora")
+BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+CORPORA = ("titles", "urls", "bodies", "multilingual", "emoji")
+FORMAT_VERSION = 1
+
+
+def load_corpus(name):
+    """
+    Loads a bundled corpus, one JSON string per line.
+
+    Args:
+        name: The name of the corpus, see CORPORA.
+    Returns:
+        list: The strings in the corpus.
+    """
+    path = os.path.join(CORPORA_DIR, name + ".jsonl")
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def _unishox2_codec():
+    def compress(strings):
+        return [unishox2.compress(string) for string in strings]
+
+    def decompress(items):
+        return [unishox2.decompress(data, size) for data, size in items]
+
+    return compress, decompress, lambda item: len(item[0])
+
+
+def _zlib_codec(level):
+    def compress(strings):
+        return [zlib.compress(string.encode("utf-8"), level) for string in strings]
+
+    def decompress(items):
+        return [zlib.decompress(data).decode("utf-8") for data in items]
+
+    return compress, decompress, len
+
+
+CODECS = {
+    "unishox2": _unishox2_codec,
+    "zlib-1": lambda: _zlib_codec(1),
+    "zlib-9": lambda: _zlib_codec(9),
+}
+
+
+def _best_time(function, argument, min_time, repeat):
+    """
+    Returns the fastest of `repeat` timings of function(argument), each of which calls it in
+    a loop for at least `min_time` seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        loops = 0
+        start = time.perf_counter()
+        while True:
+            result = function(argument)
+            loops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        per_loop = elapsed / loops
+        if best is None or per_loop < best:
+            best = per_loop
+    return best, result
+
+
+def _throughput(seconds, calls, original_bytes):
+    return {
+        "calls_per_second": calls / seconds,
+        "mb_per_second": original_bytes / seconds / 1e6,
+    }
+
+
+def benchmark(corpus, codec, min_time=0.2, repeat=3):
+    """
+    Benchmarks one codec on one corpus.
+
+    Args:
+        corpus: The name of a bundled corpus.
+        codec: The name of a codec, see CODECS.
+        min_time: The least number of seconds to spend on each timing.
+        repeat: How many timings to take the best of.
+    Returns:
+        dict: The ratio and throughput of compress and decompress.
+    Raises:
+        AssertionError: If any string does not survive the round trip.
+    """
+    strings = load_corpus(corpus)
+    compress, decompress, compressed_size = CODECS[codec]()
+    original_bytes = sum(len(string.encode("utf-8")) for string in strings)
+
+    compress_time, compressed = _best_time(compress, strings, min_time, repeat)
+    decompress_time, decompressed = _best_time(decompress, compressed, min_time, repeat)
+    assert decompressed == strings, "%s did not round-trip %s" % (codec, corpus)
+
+    compressed_bytes = sum(compressed_size(item) for item in compressed)
+    return {
+        "corpus": corpus,
+        "codec": codec,
+        "strings": len(strings),
+        "original_bytes": original_bytes,
+        "compressed_bytes": compressed_bytes,
+        "ratio": compressed_bytes / original_bytes,
+        "compress": _throughput(compress_time, len(strings), original_bytes),
+        "decompress": _throughput(decompress_time, len(strings), original_bytes),
+    }
+
+
+def run(corpora=CORPORA, codecs=tuple(CODECS), min_time=0.2, repeat=3):
+    """
+    Benchmarks every codec on every corpus.
+
+    Returns:
+        dict: The results, along with the environment they were measured in.
+    """
+    return {
+        "format": FORMAT_VERSION,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "results": [
+            benchmark(corpus, codec, min_time, repeat)
+            for corpus in corpora
+            for codec in codecs
+        ],
+    }
+
+
+def compare(report, baseline, tolerance=0.1, codec="unishox2"):
+    """
+    Finds regressions of one codec against a baseline report.
+
+    Compression ratios are deterministic, so any increase is a regression. Throughput is
+    noisy, so it only counts as one if it drops by more than `tolerance`. A corpus missing
+    from the baseline is reported too, since it cannot be checked.
+
+    Args:
+        report: The results of run().
+        baseline: Earlier results of run(), as loaded from --json.
+        tolerance: The fraction throughput may drop by (default 0.1, or 10%), or None to
+            only compare ratios.
+        codec: The codec to check.
+    Returns:
+        list: A message describing each regression found.
+    """
+    if baseline.get("format") != FORMAT_VERSION:
+        raise ValueError(
+            "unsupported benchmark results format: %r" % baseline.get("format")
+        )
+    previous = {
+        result["corpus"]: result
+        for result in baseline["results"]
+        if result["codec"] == codec
+    }
+    regressions = []
+    for result in report["results"]:
+        if result["codec"] != codec:
+            continue
+        old = previous.get(result["corpus"])
+        if old is None:
+            regressions.append("%s: missing from the baseline" % result["corpus"])
+            continue
+        if result["ratio"] > old["ratio"] + 1e-9:
+            regressions.append(
+                "%s: ratio %.4f is worse than %.4f"
+                % (result["corpus"], result["ratio"], old["ratio"])
+            )
+        if tolerance is None:
+            continue
+        for operation in ("compress", "decompress"):
+            new_speed = result[operation]["mb_per_second"]
+            old_speed = old[operation]["mb_per_second"]
+            if new_speed < old_speed * (1 - tolerance):
+                regressions.append(
+                    "%s: %s is %.1f%% slower (%.2f MB/s, was %.2f MB/s)"
+                    % (
+                        result["corpus"],
+                        operation,
+                        (1 - new_speed / old_speed) * 100,
+                        new_speed,
+                        old_speed,
+                    )
+                )
+    return regressions
+
+
+def format_table(report):
+    lines = [
+        "%-13s %-9s %8s %8s %12s %10s %12s %10s"
+        % (
+            "corpus",
+            "codec",
+            "bytes",
+            "ratio",
+            "comp call/s",
+            "comp MB/s",
+            "decomp call/s",
+            "decomp MB/s",
+        )
+    ]
+    for result in report["results"]:
+        lines.append(
+            "%-13s %-9s %8d %8.3f %12.0f %10.2f %12.0f %10.2f"
+            % (
+                result["corpus"],
+                result["codec"],
+                result["original_bytes"],
+                result["ratio"],
+                result["compress"]["calls_per_second"],
+                result["compress"]["mb_per_second"],
+                result["decompress"]["calls_per_second"],
+                result["decompress"]["mb_per_second"],
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks unishox2 against zlib on the bundled corpora."
+    )
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=CORPORA,
+        help="A corpus to run, may be repeated (default: all of them).",
+    )
+    parser.add_argument(
+        "--codec",
+        action="append",
+        choices=sorted(CODECS),
+        help="A codec to run, may be repeated (default: all of them).",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="The least number of seconds to spend on each timing (default 0.2).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="How many timings to take the best of (default 3).",
+    )
+    parser.add_argument("--json", help="Write the results to this file as JSON.")
+    parser.add_argument(
+        "--compare", help="Fail if unishox2 regressed against these JSON results."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="The fraction throughput may drop by before --compare fails (default 0.1).",
+    )
+    parser.add_argument(
+        "--ratios-only",
+        action="store_true",
+        help="Only compare compression ratios, for baselines from another machine.",
+    )
+    args = parser.parse_args(argv)
+
+    codecs = tuple(args.codec or CODECS)
+    report = run(tuple(args.corpus or CORPORA), codecs, args.min_time, args.repeat)
+    print(format_table(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        tolerance = None if args.ratios_only else args.tolerance
+        regressions = compare(report, baseline, tolerance)
+        if regressions:
+            print("\nRegressions against %s:" % args.compare)
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print("\nNo regressions against %s." % args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
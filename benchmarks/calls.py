@@ -0,0 +1,125 @@
+"""
+Measures the per-call overhead of unishox2.compress() and unishox2.decompress() on short
+strings, where argument parsing and result construction cost more than the coding itself.
+
+Each case times one call on one string, over many loops, and reports nanoseconds per call.
+
+    python benchmarks/calls.py --json calls.json
+    python benchmarks/calls.py --compare calls.json
+
+With --compare, the table also shows the change against an earlier run, so the effect of a
+change to the calling convention can be read off directly.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import unishox2
+
+FORMAT_VERSION = 1
+
+# Short strings, the case the call path matters most for, both pure ASCII and not. The empty
+# string costs next to nothing to code, so it measures the call path alone.
+CASES = {
+    "empty": "",
+    "ascii-8": "user1234",
+    "ascii-16": "GET /index.html",
+    "ascii-32": "Hello World, this is a message.",
+    "ascii-64": "https://example.com/articles/2024/05/how-to-compress-short-text",
+    "utf8-16": "café crème brûlée",
+    "utf8-64": "Привет, мир! Это короткая строка.",
+}
+
+
+def _best_time(function, argument, loops, repeat):
+    """
+    Returns the fastest of `repeat` timings of `loops` calls, in nanoseconds per call.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function(*argument)
+        per_call = (time.perf_counter() - start) / loops * 1e9
+        if best is None or per_call < best:
+            best = per_call
+    return best
+
+
+def run(loops=200000, repeat=5):
+    """
+    Times compress() and decompress() on every case.
+
+    Returns:
+        dict: Nanoseconds per call, keyed by "<operation> <case>".
+    """
+    codec = unishox2.Codec()
+    results = {}
+    for name, string in CASES.items():
+        compressed = unishox2.compress(string)
+        results["compress " + name] = _best_time(
+            unishox2.compress, (string,), loops, repeat
+        )
+        results["decompress " + name] = _best_time(
+            unishox2.decompress, compressed, loops, repeat
+        )
+        results["Codec.decompress " + name] = _best_time(
+            codec.decompress, compressed, loops, repeat
+        )
+    # The cost of calling any C function at all, for reference.
+    results["len() reference"] = _best_time(len, ("",), loops, repeat)
+    return {"format": FORMAT_VERSION, "results": results}
+
+
+def format_table(report, baseline=None):
+    lines = []
+    for name, nanoseconds in report["results"].items():
+        line = "%-28s %8.1f ns" % (name, nanoseconds)
+        old = None if baseline is None else baseline["results"].get(name)
+        if old:
+            line += "   was %8.1f ns, %+6.1f%%" % (old, (nanoseconds / old - 1) * 100)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measures the per-call overhead of unishox2 on short strings."
+    )
+    parser.add_argument(
+        "--loops",
+        type=int,
+        default=200000,
+        help="How many calls each timing makes (default 200000).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="How many timings to take the best of (default 5).",
+    )
+    parser.add_argument("--json", help="Write the results to this file as JSON.")
+    parser.add_argument("--compare", help="Show the change against these JSON results.")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                "unsupported call benchmark format: %r" % baseline.get("format")
+            )
+    report = run(args.loops, args.repeat)
+    print(format_table(report, baseline))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
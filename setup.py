@@ -9,11 +9,13 @@ if __name__ == "__main__":
     setup(
         ext_modules=[
             Extension(
-                "unishox2",
+                "unishox2._unishox2",
                 [
                     path.join(here, "unishox2_module.c"),
                     path.join(here, "Unishox2", "unishox2.c"),
                 ],
+                # always pass output buffer sizes to unishox2, see unishox2_module.c
+                define_macros=[("UNISHOX_API_WITH_OUTPUT_LEN", "1")],
             )
         ]
     )
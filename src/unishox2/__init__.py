@@ -0,0 +1,57 @@
+"""
+String compression library using Unishox2
+"""
+
+from ._unishox2 import (
+    PRESETS,
+    Codec,
+    DecompressCache,
+    LineContext,
+    compress,
+    compress_bound,
+    compress_into,
+    compress_many,
+    decompress,
+    decompress_into,
+    decompress_many,
+    get_decompress_cache,
+    reset_stats,
+    set_decompress_cache,
+    set_slow_call_hook,
+    set_stats_enabled,
+    stats,
+)
+from ._compressed_str import CompressedStr
+from ._dictionary import Dictionary, train
+from ._store import StringStore
+from ._stream import UnishoxFile, open
+from . import archive, columnar, sqlite
+
+__all__ = [
+    "PRESETS",
+    "Codec",
+    "CompressedStr",
+    "DecompressCache",
+    "Dictionary",
+    "LineContext",
+    "StringStore",
+    "UnishoxFile",
+    "archive",
+    "columnar",
+    "compress",
+    "compress_bound",
+    "compress_into",
+    "compress_many",
+    "decompress",
+    "decompress_into",
+    "decompress_many",
+    "get_decompress_cache",
+    "open",
+    "reset_stats",
+    "set_decompress_cache",
+    "set_slow_call_hook",
+    "set_stats_enabled",
+    "sqlite",
+    "stats",
+    "train",
+]
@@ -0,0 +1,349 @@
+"""
+Bulk compression of CSV and JSONL columns, as `python -m unishox2`.
+
+Input is read in chunks of rows, and each chunk is (de)compressed by a pool of worker
+processes. At most a few chunks per worker are in flight at once, and they are written out
+in their original order, so memory use stays flat however large the input is.
+
+Compressed values are written as text, as the original size in UTF-8 bytes, a colon, and
+the compressed bytes in base64: "44:h6c9..." for example.
+"""
+
+import argparse
+import base64
+import binascii
+import csv
+import io
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from ._dictionary import Dictionary
+from ._unishox2 import PRESETS, Codec
+
+_codecs = {}
+
+
+def _codec(spec):
+    """
+    Returns the codec for a (preset, dictionary bytes) spec, building it once per process.
+    """
+    codec = _codecs.get(spec)
+    if codec is None:
+        preset, dictionary = spec
+        codec = (
+            Codec(preset) if dictionary is None else Dictionary.from_bytes(dictionary)
+        )
+        _codecs[spec] = codec
+    return codec
+
+
+def encode_value(data, original_size):
+    """
+    Formats a compressed value as text, see decode_value().
+    """
+    return "%d:%s" % (original_size, base64.b64encode(data).decode("ascii"))
+
+
+def decode_value(text):
+    """
+    Parses a value written by encode_value().
+
+    Returns:
+        tuple: The compressed bytes and the original size.
+    Raises:
+        ValueError: If the text is not a compressed value.
+    """
+    size, separator, data = text.partition(":")
+    if not separator or not size.isdigit():
+        raise ValueError("not a unishox2-compressed value: %r" % text[:40])
+    try:
+        return base64.b64decode(data, validate=True), int(size)
+    except binascii.Error:
+        raise ValueError("not a unishox2-compressed value: %r" % text[:40]) from None
+
+
+def _transform(operation, codec, values):
+    """
+    Compresses or decompresses a list of strings in one batch.
+
+    Returns:
+        tuple: The resulting strings, the total original size and the total compressed size.
+    """
+    if operation == "compress":
+        compressed = codec.compress_many(values)
+        results = [encode_value(data, size) for data, size in compressed]
+        original = sum(size for _, size in compressed)
+        return results, original, sum(len(data) for data, _ in compressed)
+    items = [decode_value(value) for value in values]
+    results = codec.decompress_many(items)
+    original = sum(len(result.encode("utf-8")) for result in results)
+    return results, original, sum(len(data) for data, _ in items)
+
+
+def _process_csv(operation, codec, columns, rows):
+    # Short rows are written back as they were, so only columns they actually have count.
+    selected = [
+        (i, column)
+        for i, row in enumerate(rows)
+        for column in columns
+        if column < len(row)
+    ]
+    values = [rows[i][column] for i, column in selected]
+    results, original, compressed = _transform(operation, codec, values)
+    for (i, column), result in zip(selected, results):
+        rows[i][column] = result
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue(), len(rows), len(values), original, compressed
+
+
+def _process_jsonl(operation, codec, fields, lines):
+    records = []
+    selected = []
+    for line in lines:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError(
+                "JSONL records must be objects, not %s" % type(record).__name__
+            )
+        keys = record if fields is None else fields
+        selected += [
+            (len(records), key) for key in keys if isinstance(record.get(key), str)
+        ]
+        records.append(record)
+    values = [records[i][key] for i, key in selected]
+    results, original, compressed = _transform(operation, codec, values)
+    for (i, key), result in zip(selected, results):
+        records[i][key] = result
+    text = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    return text, len(records), len(values), original, compressed
+
+
+def _process_chunk(task):
+    """
+    Processes one chunk in a worker. Everything it needs comes in `task`, so it pickles.
+
+    Returns:
+        tuple: The output text, and the number of rows, values, original and compressed bytes.
+    """
+    operation, input_format, spec, selection, rows = task
+    process = _process_csv if input_format == "csv" else _process_jsonl
+    return process(operation, _codec(spec), selection, rows)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _ordered_map(function, tasks, jobs):
+    """
+    Yields function(task) for every task in order, running up to 2 * jobs of them at once on
+    a pool of `jobs` processes, or all of them inline if `jobs` is 1.
+    """
+    if jobs == 1:
+        for task in tasks:
+            yield function(task)
+        return
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(function, task))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _csv_tasks(args, spec, input_file, output_file):
+    reader = csv.reader(input_file)
+    header = next(reader, None)
+    if header is None:
+        return
+    if args.columns is None:
+        columns = list(range(len(header)))
+    else:
+        missing = [column for column in args.columns if column not in header]
+        if missing:
+            raise ValueError("no such column: %s" % ", ".join(missing))
+        columns = [header.index(column) for column in args.columns]
+    csv.writer(output_file).writerow(header)
+    for chunk in _chunks(reader, args.chunk_size):
+        yield (args.operation, "csv", spec, columns, chunk)
+
+
+def _jsonl_tasks(args, spec, input_file):
+    lines = (line for line in input_file if line.strip())
+    for chunk in _chunks(lines, args.chunk_size):
+        yield (args.operation, "jsonl", spec, args.columns, chunk)
+
+
+@contextmanager
+def _open_text(path, mode):
+    """
+    Opens a file as UTF-8 text for the csv module, or stdin or stdout for "-".
+    """
+    if path != "-":
+        with open(path, mode, encoding="utf-8", newline="") as file:
+            yield file
+        return
+    stream = sys.stdin if mode == "r" else sys.stdout
+    if mode == "w":
+        stream.flush()
+    file = io.TextIOWrapper(stream.buffer, encoding="utf-8", newline="")
+    try:
+        yield file
+    finally:
+        file.flush()
+        # Leave the underlying stdin or stdout open for the rest of the process.
+        file.detach()
+
+
+def _format_stats(rows, values, original, compressed, seconds):
+    """
+    Summarizes a run. Throughput is measured in original (uncompressed) bytes either way.
+    """
+    return "\n".join(
+        [
+            "rows:        %d" % rows,
+            "values:      %d" % values,
+            "original:    %d bytes" % original,
+            "compressed:  %d bytes" % compressed,
+            "ratio:       %.4f" % (compressed / original if original else 0),
+            "time:        %.3f s" % seconds,
+            "throughput:  %.2f MB/s, %.0f rows/s"
+            % (original / seconds / 1e6, rows / seconds),
+        ]
+    )
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m unishox2",
+        description=(
+            "Compresses or decompresses selected columns of a CSV or JSONL file. "
+            "Compressed values are written as '<original size>:<base64>'."
+        ),
+    )
+    parser.add_argument("operation", choices=("compress", "decompress"))
+    parser.add_argument(
+        "input", nargs="?", default="-", help="The input file (default: stdin)."
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="The output file (default: stdout)."
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("csv", "jsonl"),
+        help="The input format (default: guessed from the input's file extension).",
+    )
+    parser.add_argument(
+        "-c",
+        "--columns",
+        type=lambda value: value.split(","),
+        help=(
+            "A comma-separated list of the columns (CSV) or top-level fields (JSONL) to "
+            "process (default: all of them, or every string field)."
+        ),
+    )
+    codec = parser.add_mutually_exclusive_group()
+    codec.add_argument(
+        "--preset",
+        choices=PRESETS,
+        default="default",
+        help="The Unishox2 preset to use (default: default).",
+    )
+    codec.add_argument(
+        "--dictionary", help="A dictionary saved with unishox2.Dictionary.to_bytes()."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of worker processes (default 1, which runs in this process).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=2000,
+        help="How many rows each worker processes at a time (default 2000).",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the ratio and throughput to stderr when done.",
+    )
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs the command line tool.
+
+    Args:
+        argv: The arguments, without the program name (default: sys.argv[1:]).
+    Returns:
+        int: The exit status.
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    input_format = args.format
+    if input_format is None:
+        for extension in ("csv", "jsonl"):
+            if args.input.lower().endswith("." + extension):
+                input_format = extension
+        if args.input.lower().endswith(".ndjson"):
+            input_format = "jsonl"
+        if input_format is None:
+            parser.error("--format is needed unless the input is a .csv or .jsonl file")
+
+    dictionary = None
+    if args.dictionary is not None:
+        with open(args.dictionary, "rb") as file:
+            dictionary = file.read()
+    spec = (args.preset, dictionary)
+
+    start = time.perf_counter()
+    rows = values = original = compressed = 0
+    try:
+        _codec(spec)
+        with _open_text(args.input, "r") as input_file, _open_text(
+            args.output, "w"
+        ) as output_file:
+            if input_format == "csv":
+                tasks = _csv_tasks(args, spec, input_file, output_file)
+            else:
+                tasks = _jsonl_tasks(args, spec, input_file)
+            for result in _ordered_map(_process_chunk, tasks, args.jobs):
+                output_file.write(result[0])
+                rows += result[1]
+                values += result[2]
+                original += result[3]
+                compressed += result[4]
+    except (OSError, ValueError) as error:
+        print("%s: error: %s" % (parser.prog, error), file=sys.stderr)
+        return 1
+
+    if args.stats:
+        seconds = max(time.perf_counter() - start, 1e-9)
+        print(
+            _format_stats(rows, values, original, compressed, seconds),
+            file=sys.stderr,
+        )
+    return 0
@@ -0,0 +1,135 @@
+"""
+A lazily decompressed string value, for text which is kept for long but rarely read.
+"""
+
+from ._unishox2 import compress, decompress
+
+__all__ = ["CompressedStr"]
+
+
+class CompressedStr:
+    """
+    An immutable string, held only as its compressed bytes and original size.
+
+    The text is decompressed whenever str(), ordering or hashing needs it, and never kept.
+    Equality between two CompressedStr values compares the compressed bytes directly, which
+    is exact since Unishox2 always compresses equal strings to equal bytes. Pickling one
+    pickles the compressed form.
+
+    Args:
+        string: The string to compress, with the default preset.
+    """
+
+    __slots__ = ("_data", "_original_size")
+
+    def __init__(self, string):
+        if not isinstance(string, str):
+            raise TypeError(
+                "CompressedStr() argument must be str, not %s" % type(string).__name__
+            )
+        data, original_size = compress(string)
+        object.__setattr__(self, "_data", data)
+        object.__setattr__(self, "_original_size", original_size)
+
+    @classmethod
+    def from_compressed(cls, data, original_size):
+        """
+        Wraps a string compressed earlier, without decompressing it. It has to have been
+        compressed by unishox2.compress(), with the default preset, for equality to hold.
+
+        Args:
+            data: The bytes returned by unishox2.compress().
+            original_size: The original size returned alongside them.
+        Returns:
+            CompressedStr: The lazy string.
+        """
+        if not isinstance(data, bytes):
+            raise TypeError("data must be bytes, not %s" % type(data).__name__)
+        if not isinstance(original_size, int) or original_size < 0:
+            raise ValueError("original_size must be a non-negative int")
+        self = cls.__new__(cls)
+        object.__setattr__(self, "_data", data)
+        object.__setattr__(self, "_original_size", original_size)
+        return self
+
+    @property
+    def compressed(self):
+        """
+        The compressed bytes.
+        """
+        return self._data
+
+    @property
+    def original_size(self):
+        """
+        The size of the string in UTF-8 bytes.
+        """
+        return self._original_size
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompressedStr is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompressedStr is immutable")
+
+    def __str__(self):
+        return decompress(self._data, self._original_size)
+
+    def __repr__(self):
+        return "CompressedStr(%r)" % str(self)
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    def __bool__(self):
+        return self._original_size != 0
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedStr):
+            return (
+                self._original_size == other._original_size
+                and self._data == other._data
+            )
+        if isinstance(other, str):
+            return str(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        # Equal to the str it holds, so it has to hash like it too.
+        return hash(str(self))
+
+    def _text(self, other):
+        if isinstance(other, CompressedStr):
+            return str(other)
+        if isinstance(other, str):
+            return other
+        return None
+
+    def __lt__(self, other):
+        text = self._text(other)
+        return NotImplemented if text is None else str(self) < text
+
+    def __le__(self, other):
+        text = self._text(other)
+        return NotImplemented if text is None else str(self) <= text
+
+    def __gt__(self, other):
+        text = self._text(other)
+        return NotImplemented if text is None else str(self) > text
+
+    def __ge__(self, other):
+        text = self._text(other)
+        return NotImplemented if text is None else str(self) >= text
+
+    def __reduce__(self):
+        return (type(self).from_compressed, (self._data, self._original_size))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
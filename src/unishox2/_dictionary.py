@@ -0,0 +1,344 @@
+"""
+Trained Unishox2 dictionaries.
+
+Unishox2 has six slots for frequently occurring sequences and five for templates, which it
+codes far more cheaply than the characters they stand for. Its presets fill those with
+sequences that are common in generic English, URLs, JSON and so on. train() picks them from
+a sample of your own data instead, much like a zstd trained dictionary.
+"""
+
+import re
+import struct
+from collections import Counter
+
+from ._unishox2 import Codec
+
+_MAGIC = b"USX2DICT"
+_VERSION = 1
+_HEADER = struct.Struct("<8sB5s5s")
+_LENGTH = struct.Struct("<H")
+_MAX_STRING_SIZE = 0xFFFF
+
+_FREQ_SEQ_COUNT = 6
+_TEMPLATE_COUNT = 5
+
+# Layouts of horizontal codes which can still code any input, taken from Unishox2's presets.
+# The others (such as "alpha_num_only") silently drop characters they have no code for.
+_LOSSLESS_HCODE_PRESETS = (
+    "default",
+    "favor_alpha",
+    "favor_dict",
+    "favor_sym",
+    "favor_umlaut",
+    "no_dict",
+)
+
+_MIN_SEQUENCE_LEN = 2
+_MAX_SEQUENCE_LEN = 16
+_SEQUENCE_CANDIDATES = 24
+_TEMPLATE_CANDIDATES = 12
+_MAX_SAMPLES = 2000
+_MAX_EVALUATION_SAMPLES = 500
+
+# Runs of digits and the punctuation which usually separates them, as in dates, times,
+# phone numbers and version strings. These become template candidates.
+_NUMERIC_RUN = re.compile(r"[0-9(][0-9 ()+\-./:TZ]{3,31}")
+
+# Template characters which Unishox2 reads as a nibble rather than a literal.
+_TEMPLATE_PATTERN_CHARS = frozenset("fFrto")
+
+
+def _tables_to_bytes(codec):
+    """
+    Serializes the tables of any Codec, in the format Dictionary.from_bytes() loads.
+    """
+    parts = [
+        _HEADER.pack(_MAGIC, _VERSION, bytes(codec.hcodes), bytes(codec.hcode_lens))
+    ]
+    for string in codec.freq_seq + codec.templates:
+        encoded = b"" if string is None else string.encode("utf-8")
+        if len(encoded) > _MAX_STRING_SIZE:
+            raise ValueError(
+                "cannot serialize a table string of %d bytes, the limit is %d"
+                % (len(encoded), _MAX_STRING_SIZE)
+            )
+        parts.append(_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+class Dictionary(Codec):
+    """
+    A Codec whose tables were trained by train(), and which can be saved and loaded again.
+
+    Dictionaries compress and decompress exactly like any other Codec, and data has to be
+    decompressed with the same dictionary it was compressed with.
+    """
+
+    __slots__ = ()
+
+    def to_bytes(self):
+        """
+        Serializes the dictionary's tables.
+
+        Returns:
+            bytes: The dictionary, which Dictionary.from_bytes() can load back.
+        Raises:
+            ValueError: If a frequent sequence or template is over 65535 bytes in UTF-8.
+        """
+        return _tables_to_bytes(self)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Loads a dictionary saved by Dictionary.to_bytes().
+
+        Args:
+            data: A bytes-like object.
+        Returns:
+            Dictionary: The loaded dictionary.
+        Raises:
+            ValueError: If the data is not a valid dictionary.
+        """
+        data = memoryview(data).cast("B")
+        if len(data) < _HEADER.size:
+            raise ValueError("data is too short to be a unishox2 dictionary")
+        magic, version, hcodes, hcode_lens = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("data is not a unishox2 dictionary")
+        if version != _VERSION:
+            raise ValueError("unsupported unishox2 dictionary version: %d" % version)
+
+        strings = []
+        offset = _HEADER.size
+        for _ in range(_FREQ_SEQ_COUNT + _TEMPLATE_COUNT):
+            if offset + _LENGTH.size > len(data):
+                raise ValueError("unishox2 dictionary is truncated")
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            if offset + length > len(data):
+                raise ValueError("unishox2 dictionary is truncated")
+            strings.append(bytes(data[offset : offset + length]).decode("utf-8"))
+            offset += length
+        if offset != len(data):
+            raise ValueError("unishox2 dictionary has trailing data")
+
+        return cls(
+            hcodes=list(hcodes),
+            hcode_lens=list(hcode_lens),
+            freq_seq=strings[:_FREQ_SEQ_COUNT],
+            templates=[template or None for template in strings[_FREQ_SEQ_COUNT:]],
+        )
+
+    def __reduce__(self):
+        return (type(self).from_bytes, (self.to_bytes(),))
+
+    def __repr__(self):
+        return "<unishox2.Dictionary freq_seq=%r templates=%r>" % (
+            self.freq_seq,
+            self.templates,
+        )
+
+
+def _subsample(samples, limit):
+    """
+    Picks at most `limit` samples, spread evenly over the whole corpus.
+    """
+    if len(samples) <= limit:
+        return samples
+    step = len(samples) / limit
+    return [samples[int(i * step)] for i in range(limit)]
+
+
+def _is_lossless(codec):
+    layout = (list(codec.hcodes), list(codec.hcode_lens))
+    return any(
+        layout == (list(lossless.hcodes), list(lossless.hcode_lens))
+        for lossless in map(Codec, _LOSSLESS_HCODE_PRESETS)
+    )
+
+
+def _compressed_size(samples, preset, freq_seq, templates):
+    codec = Codec(preset, freq_seq=freq_seq, templates=templates)
+    return sum(len(compressed) for compressed, _ in codec.compress_many(samples))
+
+
+def _sequence_candidates(samples):
+    """
+    Finds the substrings which would save the most, if each was coded as a single symbol.
+    """
+    counts = Counter()
+    for sample in samples:
+        for length in range(_MIN_SEQUENCE_LEN, _MAX_SEQUENCE_LEN + 1):
+            counts.update(
+                sample[i : i + length] for i in range(len(sample) - length + 1)
+            )
+
+    # Roughly 5 bits per character saved, against roughly 12 bits to code the sequence.
+    scored = sorted(
+        (
+            ((len(sequence.encode("utf-8")) * 5 - 12) * occurrences, sequence)
+            for sequence, occurrences in counts.items()
+            if occurrences > 1 and "\x00" not in sequence
+        ),
+        reverse=True,
+    )
+
+    candidates = []
+    for score, sequence in scored:
+        if score <= 0 or len(candidates) == _SEQUENCE_CANDIDATES:
+            break
+        # A substring of a sequence already picked only helps where it occurs on its own.
+        if any(
+            sequence in picked and counts[sequence] * 2 < counts[picked] * 3
+            for picked in candidates
+        ):
+            continue
+        candidates.append(sequence)
+    return candidates
+
+
+def _template_candidates(samples):
+    """
+    Finds frequent shapes of numeric runs, such as "tfff-of-tf" for ISO dates.
+
+    Each digit becomes an "f" (any nibble), or a narrower "r" (0-7), "t" (0-3) or "o" (0-1)
+    if no sample ever had a larger digit in that position.
+    """
+    shapes = Counter()
+    largest_digits = {}
+    for sample in samples:
+        for match in _NUMERIC_RUN.finditer(sample):
+            run = match.group().rstrip(" ")
+            shape = "".join("f" if char.isdigit() else char for char in run)
+            if shape.count("f") < 3:
+                continue
+            shapes[shape] += 1
+            largest = largest_digits.setdefault(shape, [0] * len(shape))
+            for i, char in enumerate(run):
+                if char.isdigit():
+                    largest[i] = max(largest[i], int(char))
+
+    candidates = []
+    for shape, occurrences in shapes.most_common():
+        if occurrences < 2 or len(candidates) == _TEMPLATE_CANDIDATES:
+            break
+        if any(char in _TEMPLATE_PATTERN_CHARS for char in shape if char != "f"):
+            continue
+        narrowed = "".join(
+            (
+                (
+                    "o"
+                    if largest <= 1
+                    else "t" if largest <= 3 else "r" if largest <= 7 else "f"
+                )
+                if char == "f"
+                else char
+            )
+            for char, largest in zip(shape, largest_digits[shape])
+        )
+        candidates.append(narrowed)
+    return candidates
+
+
+def _fill_freq_seq(chosen, fallback):
+    """
+    Longest sequences go first, since Unishox2 uses the first one which matches.
+    """
+    freq_seq = sorted(chosen, key=len, reverse=True)
+    for sequence in fallback:
+        if len(freq_seq) == _FREQ_SEQ_COUNT:
+            break
+        if sequence not in freq_seq:
+            freq_seq.append(sequence)
+    return freq_seq
+
+
+def train(samples, max_sequences=6, max_templates=5, preset="default"):
+    """
+    Trains a Unishox2 dictionary on a sample of the data it will be used for.
+
+    Frequently occurring sequences and templates are picked greedily, keeping each one only
+    if it makes the sample compress smaller, and then the best lossless layout of horizontal
+    codes is picked for them.
+
+    Args:
+        samples: An iterable of sample strings.
+        max_sequences: How many of the six frequent sequences to train (default 6).
+        max_templates: How many of the five templates to train (default 5).
+        preset: The preset to start from, and to keep any untrained tables of. It must be
+            able to code any input, so presets such as "alpha_num_only" are rejected.
+    Returns:
+        Dictionary: The trained dictionary.
+    """
+    if not 0 <= max_sequences <= _FREQ_SEQ_COUNT:
+        raise ValueError("max_sequences must be between 0 and %d" % _FREQ_SEQ_COUNT)
+    if not 0 <= max_templates <= _TEMPLATE_COUNT:
+        raise ValueError("max_templates must be between 0 and %d" % _TEMPLATE_COUNT)
+    samples = [sample for sample in samples if sample]
+    if not samples:
+        raise ValueError("train() needs at least one non-empty sample")
+
+    base = Codec(preset)
+    if not _is_lossless(base):
+        raise ValueError(
+            "cannot train from the %r preset, which drops characters it has no code for"
+            % preset
+        )
+    samples = _subsample(samples, _MAX_SAMPLES)
+    evaluation = _subsample(samples, _MAX_EVALUATION_SAMPLES)
+
+    freq_seq = list(base.freq_seq)
+    templates = list(base.templates)
+    best_size = _compressed_size(evaluation, preset, freq_seq, templates)
+
+    chosen = []
+    candidates = _sequence_candidates(samples)
+    for _ in range(max_sequences):
+        best_candidate = None
+        for candidate in candidates:
+            if candidate in chosen:
+                continue
+            trial = _fill_freq_seq(chosen + [candidate], base.freq_seq)
+            size = _compressed_size(evaluation, preset, trial, templates)
+            if size < best_size:
+                best_size, best_candidate = size, candidate
+        if best_candidate is None:
+            break
+        chosen.append(best_candidate)
+        freq_seq = _fill_freq_seq(chosen, base.freq_seq)
+
+    if max_templates:
+        candidates = [template for template in base.templates if template]
+        candidates += _template_candidates(samples)
+        chosen = []
+        size = _compressed_size(evaluation, preset, freq_seq, [])
+        if size < best_size:
+            best_size, templates = size, []
+        for _ in range(max_templates):
+            best_candidate = None
+            for candidate in candidates:
+                if candidate in chosen:
+                    continue
+                trial = sorted(chosen + [candidate], key=len, reverse=True)
+                size = _compressed_size(evaluation, preset, freq_seq, trial)
+                if size < best_size:
+                    best_size, best_candidate = size, candidate
+            if best_candidate is None:
+                break
+            chosen.append(best_candidate)
+            templates = sorted(chosen, key=len, reverse=True)
+
+    best_preset = preset
+    for hcode_preset in _LOSSLESS_HCODE_PRESETS:
+        size = _compressed_size(evaluation, hcode_preset, freq_seq, templates)
+        if size < best_size:
+            best_size, best_preset = size, hcode_preset
+
+    hcodes = Codec(best_preset)
+    return Dictionary(
+        hcodes=hcodes.hcodes,
+        hcode_lens=hcodes.hcode_lens,
+        freq_seq=freq_seq,
+        templates=templates,
+    )
@@ -0,0 +1,312 @@
+"""
+A compact in-memory store for many compressed strings.
+
+A Python str costs around 50 bytes of object overhead, and so does the bytes object compress()
+returns, which is more than most short strings save by being compressed. A StringStore keeps
+every compressed string back to back in one bytearray, with their offsets and original sizes
+in typed arrays, so each string costs its compressed size plus 12 bytes.
+
+Compression is deterministic, so equal strings compress to equal bytes. The optional index
+is an open-addressing hash table of compressed strings, which finds a string by compressing
+it, without decompressing anything.
+"""
+
+import struct
+import sys
+import zlib
+from array import array
+
+from ._dictionary import Dictionary, _tables_to_bytes
+from ._unishox2 import Codec, _compress_strings
+from .archive import _read_varint, _write_varint
+
+__all__ = ["StringStore"]
+
+_MAGIC = b"USX2STO\x00"
+_VERSION = 1
+_COUNTS = struct.Struct("<QQ")
+
+# Strings are decompressed this many at a time while iterating.
+_ITER_BATCH = 1024
+
+_MIN_INDEX_SLOTS = 8
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _check_str(string, method):
+    # Codecs compress bytes as they are, but a store only ever holds and finds str.
+    if not isinstance(string, str):
+        raise TypeError(
+            "StringStore.%s() needs a str, not %s" % (method, type(string).__name__)
+        )
+
+
+class StringStore:
+    """
+    A list-like store of strings, kept compressed in one growable arena.
+
+    Args:
+        codec: The unishox2.Codec (or Dictionary) to compress with, None for the default
+            preset.
+        index: Whether to keep a hash index, which makes `in` and index() take constant
+            rather than linear time, for 8 to 16 more bytes per string.
+    """
+
+    def __init__(self, codec=None, index=False):
+        self.codec = Codec() if codec is None else codec
+        self._arena = bytearray()
+        self._offsets = array("q", [0])
+        self._sizes = array("I")
+        self._slots = None
+        if index:
+            self._build_index()
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes used by the arena, the offsets, the sizes and the index.
+        """
+        nbytes = len(self._arena)
+        nbytes += len(self._offsets) * self._offsets.itemsize
+        nbytes += len(self._sizes) * self._sizes.itemsize
+        if self._slots is not None:
+            nbytes += len(self._slots) * self._slots.itemsize
+        return nbytes
+
+    @property
+    def indexed(self):
+        """
+        Whether the store keeps a hash index.
+        """
+        return self._slots is not None
+
+    def _compressed(self, position):
+        return bytes(self._arena[self._offsets[position] : self._offsets[position + 1]])
+
+    def _build_index(self):
+        slots = _MIN_INDEX_SLOTS
+        while slots < len(self) * 2:
+            slots *= 2
+        self._slots = array("I", bytes(slots * 4))
+        for position in range(len(self)):
+            self._place(position)
+
+    def _find(self, data):
+        """
+        Returns the slot holding compressed `data`, or the empty slot where it would go.
+        """
+        slots = self._slots
+        mask = len(slots) - 1
+        slot = zlib.crc32(data) & mask
+        while True:
+            stored = slots[slot]
+            if stored == 0 or self._compressed(stored - 1) == data:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _place(self, position):
+        """
+        Indexes the string at `position`, unless an equal one was indexed before it.
+        """
+        slot = self._find(self._compressed(position))
+        if self._slots[slot] == 0:
+            self._slots[slot] = position + 1
+
+    def _insert(self, position):
+        """
+        Indexes a newly appended string, growing the index to stay at most half full.
+        """
+        if len(self) * 2 > len(self._slots):
+            self._build_index()
+        else:
+            self._place(position)
+
+    def _append_compressed(self, data, offsets, sizes):
+        base = len(self._arena)
+        start = len(self)
+        self._arena += data
+        self._offsets.extend(
+            base + offset for offset in memoryview(offsets).cast("q")[1:]
+        )
+        self._sizes.extend(memoryview(sizes).cast("q"))
+        if self._slots is None:
+            return
+        if len(self) * 2 > len(self._slots):
+            self._build_index()
+        else:
+            for position in range(start, len(self)):
+                self._place(position)
+
+    def append(self, string):
+        """
+        Compresses a string and appends it to the store.
+
+        Args:
+            string: An input string.
+        Returns:
+            int: The position of the new string.
+        """
+        _check_str(string, "append")
+        data, original_size = self.codec.compress(string)
+        self._arena += data
+        self._offsets.append(len(self._arena))
+        self._sizes.append(original_size)
+        if self._slots is not None:
+            self._insert(len(self) - 1)
+        return len(self) - 1
+
+    def extend(self, strings, threads=1):
+        """
+        Compresses a sequence of strings in one batch and appends them in order.
+
+        Args:
+            strings: A sequence of strings.
+            threads: The number of native threads to compress with (default 1).
+        """
+        strings = tuple(strings)
+        for string in strings:
+            _check_str(string, "extend")
+        self._append_compressed(*_compress_strings(strings, self.codec, threads))
+
+    def __getitem__(self, position):
+        """
+        Decompresses the string at `position`, which may be negative to count from the end.
+        """
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("StringStore index out of range")
+        return self.codec.decompress(self._compressed(position), self._sizes[position])
+
+    def __iter__(self):
+        for start in range(0, len(self), _ITER_BATCH):
+            stop = min(start + _ITER_BATCH, len(self))
+            yield from self.codec.decompress_many(
+                [
+                    (self._compressed(position), self._sizes[position])
+                    for position in range(start, stop)
+                ]
+            )
+
+    def index(self, string):
+        """
+        Finds the first position of a string, by comparing compressed bytes.
+
+        Args:
+            string: The string to look for.
+        Returns:
+            int: Its position.
+        Raises:
+            ValueError: If the string is not in the store.
+            TypeError: If it is not a str.
+        """
+        _check_str(string, "index")
+        data, original_size = self.codec.compress(string)
+        if self._slots is not None:
+            stored = self._slots[self._find(data)]
+            if stored:
+                return stored - 1
+        else:
+            for position in range(len(self)):
+                if (
+                    self._sizes[position] == original_size
+                    and self._compressed(position) == data
+                ):
+                    return position
+        raise ValueError("%r is not in the StringStore" % (string,))
+
+    def __contains__(self, string):
+        if not isinstance(string, str):
+            return False
+        try:
+            self.index(string)
+        except ValueError:
+            return False
+        return True
+
+    def to_bytes(self):
+        """
+        Serializes the store, along with its codec's tables.
+
+        Returns:
+            bytes: The store, which StringStore.from_bytes() can load back.
+        """
+        header = bytearray(_MAGIC)
+        header.append(_VERSION)
+        tables = _tables_to_bytes(self.codec)
+        _write_varint(len(tables), header)
+        header += tables
+        header += _COUNTS.pack(len(self), len(self._arena))
+        return b"".join(
+            [
+                header,
+                self._arena,
+                _little_endian(self._offsets),
+                _little_endian(self._sizes),
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, data, index=False):
+        """
+        Loads a store saved by StringStore.to_bytes().
+
+        Args:
+            data: A bytes-like object.
+            index: Whether to build a hash index for the loaded store.
+        Returns:
+            StringStore: The loaded store, which can be appended to. Its codec is a
+            Dictionary with the saved tables.
+        Raises:
+            ValueError: If the data is not a valid store.
+        """
+        data = memoryview(data).cast("B")
+        if bytes(data[: len(_MAGIC)]) != _MAGIC:
+            raise ValueError("data is not a unishox2 string store")
+        if len(data) <= len(_MAGIC) or data[len(_MAGIC)] != _VERSION:
+            raise ValueError("unsupported unishox2 string store version")
+        tables_size, position = _read_varint(data, len(_MAGIC) + 1)
+        if position + tables_size + _COUNTS.size > len(data):
+            raise ValueError("unishox2 string store is truncated")
+        codec = Dictionary.from_bytes(data[position : position + tables_size])
+        position += tables_size
+        count, arena_size = _COUNTS.unpack_from(data, position)
+        position += _COUNTS.size
+        if len(data) - position != arena_size + (count + 1) * 8 + count * 4:
+            raise ValueError("unishox2 string store is truncated or has trailing data")
+
+        store = cls(codec)
+        store._arena = bytearray(data[position : position + arena_size])
+        position += arena_size
+        store._offsets = array("q", bytes(data[position : position + (count + 1) * 8]))
+        position += (count + 1) * 8
+        store._sizes = array("I", bytes(data[position:]))
+        if sys.byteorder != "little":
+            store._offsets.byteswap()
+            store._sizes.byteswap()
+        offsets = store._offsets
+        if offsets[0] != 0 or offsets[-1] != arena_size:
+            raise ValueError("unishox2 string store has invalid offsets")
+        if any(offsets[i] > offsets[i + 1] for i in range(count)):
+            raise ValueError("unishox2 string store has invalid offsets")
+        if index:
+            store._build_index()
+        return store
+
+    def __reduce__(self):
+        return (type(self).from_bytes, (self.to_bytes(), self.indexed))
+
+    def __repr__(self):
+        return "<unishox2.StringStore of %d strings, %d bytes>" % (
+            len(self),
+            self.nbytes,
+        )
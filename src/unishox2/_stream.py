@@ -0,0 +1,284 @@
+"""
+Streaming, line-oriented text files compressed with Unishox2.
+
+A stream is written as:
+
+    header  magic, version, then a varint length and the codec's tables
+    blocks  a varint record count and a varint size in bytes, then each record as a varint
+            original size, a varint compressed size and the compressed bytes
+    end     a block with a record count of zero
+
+Every line (with its newline) is one record. Lines are batched into blocks of roughly
+block_size characters, so each block is (de)compressed with one compress_many() or
+decompress_many() call, and only one block is ever held in memory.
+"""
+
+import builtins
+import io
+
+from ._dictionary import Dictionary, _tables_to_bytes
+from ._unishox2 import Codec
+from .archive import _read_varint, _write_varint
+
+__all__ = ["UnishoxFile", "open"]
+
+_MAGIC = b"USX2STR\x00"
+_VERSION = 1
+
+_READ_MODES = ("r", "rt")
+_WRITE_MODES = ("w", "wt", "x", "xt")
+
+
+class UnishoxFile(io.TextIOBase):
+    """
+    A text file whose lines are compressed with Unishox2, much like gzip.GzipFile.
+
+    Args:
+        filename: A path to open, or None to use fileobj.
+        mode: "r" or "rt" to read, "w" or "wt" to write, "x" or "xt" to create exclusively.
+        codec: The unishox2.Codec (or Dictionary) to compress with, when writing. Its tables
+            are saved in the stream, so readers always use the stream's own.
+        fileobj: A binary file object to use instead of opening filename. It is not
+            closed when the UnishoxFile is.
+        block_size: Roughly how many characters of lines to batch into each block.
+        threads: The number of native threads to (de)compress each block with.
+    """
+
+    def __init__(
+        self,
+        filename=None,
+        mode="r",
+        codec=None,
+        fileobj=None,
+        block_size=65536,
+        threads=1,
+    ):
+        # close() also runs when a failed __init__ is garbage collected, and needs these.
+        self._writing = False
+        self._owns_file = False
+        self._finished = True
+        if mode not in _READ_MODES + _WRITE_MODES:
+            raise ValueError("invalid mode: %r" % mode)
+        if (filename is None) == (fileobj is None):
+            raise ValueError("exactly one of filename and fileobj must be given")
+        if block_size < 1:
+            raise ValueError("block_size must be positive")
+        self._writing = mode in _WRITE_MODES
+        if codec is not None and not self._writing:
+            raise ValueError("codec can only be given when writing")
+
+        if fileobj is None:
+            self._file = builtins.open(filename, mode[0] + "b")
+            self._owns_file = True
+        else:
+            self._file = fileobj
+            self._owns_file = False
+        self._block_size = block_size
+        self._threads = threads
+        self._finished = False
+        try:
+            if self._writing:
+                self.codec = Codec() if codec is None else codec
+                self._pending = []
+                self._pending_size = 0
+                self._partial = []
+                self._write_header()
+            else:
+                self._read_header()
+                self._lines = self._read_lines()
+                self._line = ""
+        except BaseException:
+            if self._owns_file:
+                self._file.close()
+            raise
+
+    def _write_header(self):
+        header = bytearray(_MAGIC)
+        header.append(_VERSION)
+        tables = _tables_to_bytes(self.codec)
+        _write_varint(len(tables), header)
+        header += tables
+        self._file.write(header)
+
+    def _read_exactly(self, size):
+        data = self._file.read(size)
+        if len(data) != size:
+            raise ValueError("unishox2 stream is truncated")
+        return data
+
+    def _read_file_varint(self):
+        data = bytearray()
+        while True:
+            data += self._read_exactly(1)
+            if data[-1] < 0x80:
+                return _read_varint(data, 0)[0]
+            if len(data) > 9:
+                raise ValueError("unishox2 stream has an invalid varint")
+
+    def _read_header(self):
+        header = self._file.read(len(_MAGIC) + 1)
+        if len(header) != len(_MAGIC) + 1 or header[: len(_MAGIC)] != _MAGIC:
+            raise ValueError("file is not a unishox2 stream")
+        if header[len(_MAGIC)] != _VERSION:
+            raise ValueError(
+                "unsupported unishox2 stream version: %d" % header[len(_MAGIC)]
+            )
+        self.codec = Dictionary.from_bytes(self._read_exactly(self._read_file_varint()))
+
+    def _read_lines(self):
+        """
+        Yields the decompressed lines, reading and decompressing one block at a time.
+        """
+        while True:
+            count = self._read_file_varint()
+            if count == 0:
+                return
+            data = self._read_exactly(self._read_file_varint())
+            items = []
+            position = 0
+            for _ in range(count):
+                original_size, position = _read_varint(data, position)
+                compressed_size, position = _read_varint(data, position)
+                items.append(
+                    (data[position : position + compressed_size], original_size)
+                )
+                position += compressed_size
+            if position != len(data):
+                raise ValueError("unishox2 stream has a corrupt block")
+            yield from self.codec.decompress_many(items, threads=self._threads)
+
+    def _write_block(self):
+        if not self._pending:
+            return
+        records = bytearray()
+        for data, original_size in self.codec.compress_many(
+            self._pending, threads=self._threads
+        ):
+            _write_varint(original_size, records)
+            _write_varint(len(data), records)
+            records += data
+        header = bytearray()
+        _write_varint(len(self._pending), header)
+        _write_varint(len(records), header)
+        self._file.write(header)
+        self._file.write(records)
+        self._pending = []
+        self._pending_size = 0
+
+    def _check_open(self, writing):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if writing != self._writing:
+            raise io.UnsupportedOperation("not writable" if writing else "not readable")
+
+    def readable(self):
+        return not self._writing
+
+    def writable(self):
+        return self._writing
+
+    def write(self, s):
+        """
+        Writes a string. Each complete line becomes one record once its block is full.
+
+        Returns:
+            int: The number of characters written.
+        """
+        self._check_open(True)
+        if not isinstance(s, str):
+            raise TypeError("write() argument must be str, not %s" % type(s).__name__)
+        parts = s.split("\n")
+        if len(parts) > 1:
+            self._partial.append(parts[0])
+            parts[0] = "".join(self._partial)
+            self._partial = []
+            lines = [part + "\n" for part in parts[:-1]]
+            self._pending += lines
+            self._pending_size += sum(map(len, lines))
+            if self._pending_size >= self._block_size:
+                self._write_block()
+        if parts[-1]:
+            self._partial.append(parts[-1])
+        return len(s)
+
+    def readline(self, size=-1):
+        """
+        Reads the next line, or at most `size` characters of it.
+
+        Returns:
+            str: The line with its newline, or "" at the end of the stream.
+        """
+        self._check_open(False)
+        if not self._line:
+            self._line = next(self._lines, "")
+        if size is None or size < 0 or size >= len(self._line):
+            line, self._line = self._line, ""
+        else:
+            line, self._line = self._line[:size], self._line[size:]
+        return line
+
+    def read(self, size=-1):
+        """
+        Reads the rest of the stream, or at most `size` characters of it.
+        """
+        self._check_open(False)
+        if size is None or size < 0:
+            text = self._line + "".join(self._lines)
+            self._line = ""
+            return text
+        chunks = []
+        while size > 0:
+            line = self.readline(size)
+            if not line:
+                break
+            chunks.append(line)
+            size -= len(line)
+        return "".join(chunks)
+
+    def flush(self):
+        """
+        Writes out the lines pending in the current block, even though it is not full.
+        """
+        if self._writing and not self._finished and not self.closed:
+            self._write_block()
+            self._file.flush()
+
+    def close(self):
+        """
+        Writes out any pending lines and the end of the stream, then closes the file.
+        """
+        if self.closed:
+            return
+        try:
+            if self._writing and not self._finished:
+                if self._partial:
+                    self._pending.append("".join(self._partial))
+                    self._partial = []
+                self._write_block()
+                self._file.write(b"\x00")
+                self._file.flush()
+        finally:
+            self._finished = True
+            try:
+                if self._owns_file:
+                    self._file.close()
+            finally:
+                super().close()
+
+
+def open(filename, mode="rt", codec=None, block_size=65536, threads=1):
+    """
+    Opens a Unishox2-compressed text file, much like gzip.open().
+
+    Args:
+        filename: A path, or a binary file object to read from or write to.
+        mode: "rt" to read, "wt" to write or "xt" to create exclusively ("t" is optional).
+        codec: The codec to compress with, when writing. Readers use the stream's own.
+        block_size: Roughly how many characters of lines to batch into each block.
+        threads: The number of native threads to (de)compress each block with.
+    Returns:
+        UnishoxFile: The open file.
+    """
+    if hasattr(filename, "read") or hasattr(filename, "write"):
+        return UnishoxFile(None, mode, codec, filename, block_size, threads)
+    return UnishoxFile(filename, mode, codec, None, block_size, threads)
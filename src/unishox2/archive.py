@@ -0,0 +1,254 @@
+"""
+A seekable container for many Unishox2-compressed strings.
+
+An archive file is laid out as:
+
+    header   magic, version, then a varint length and the codec's tables
+    records  for each string, a varint original size, a varint compressed size and the
+             compressed bytes
+    index    the file offset of every record, as little-endian uint64s
+    trailer  the offset of the index, the number of records and an end magic, 24 bytes
+
+Readers map the file into memory and find record N through the index, so opening an archive
+and reading any one record costs the same no matter how large the archive is.
+"""
+
+import builtins
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from ._dictionary import Dictionary, _tables_to_bytes
+from ._unishox2 import Codec
+
+__all__ = ["ArchiveReader", "ArchiveWriter", "open"]
+
+_MAGIC = b"USX2ARC\x00"
+_END_MAGIC = b"USX2IDX\x00"
+_VERSION = 1
+_TRAILER = struct.Struct("<QQ8s")
+_OFFSET = struct.Struct("<Q")
+
+
+def _write_varint(value, out):
+    while value > 0x7F:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    """
+    Returns the unsigned LEB128 varint at `position`, and the position just past it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[position]
+        except IndexError:
+            raise ValueError("unishox2 archive is truncated") from None
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+        if shift > 63:
+            raise ValueError("unishox2 archive has an invalid varint")
+
+
+class ArchiveWriter:
+    """
+    Writes strings to a new archive, one record each.
+
+    Args:
+        path: The path of the archive to create, which is replaced if it exists.
+        codec: The unishox2.Codec (or Dictionary) to compress with, None for the default
+            preset. Its tables are saved in the archive, so readers do not need it.
+    """
+
+    def __init__(self, path, codec=None):
+        self.codec = Codec() if codec is None else codec
+        self._offsets = array("Q")
+        self._file = builtins.open(path, "wb")
+        header = bytearray(_MAGIC)
+        header.append(_VERSION)
+        tables = _tables_to_bytes(self.codec)
+        _write_varint(len(tables), header)
+        header += tables
+        self._file.write(header)
+        self._position = len(header)
+
+    def _write_records(self, compressed):
+        records = bytearray()
+        for data, original_size in compressed:
+            self._offsets.append(self._position + len(records))
+            _write_varint(original_size, records)
+            _write_varint(len(data), records)
+            records += data
+        self._file.write(records)
+        self._position += len(records)
+
+    def write(self, string):
+        """
+        Compresses a string and appends it to the archive.
+
+        Args:
+            string: An input string.
+        Returns:
+            int: The index of the new record.
+        """
+        self._write_records([self.codec.compress(string)])
+        return len(self._offsets) - 1
+
+    def write_many(self, strings, threads=1):
+        """
+        Compresses a sequence of strings with compress_many() and appends them in order.
+
+        Args:
+            strings: A sequence of strings.
+            threads: The number of native threads to compress with (default 1).
+        """
+        self._write_records(self.codec.compress_many(strings, threads=threads))
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        """
+        Writes the index and trailer, and closes the file. Does nothing if already closed.
+        """
+        if self._file.closed:
+            return
+        try:
+            offsets = self._offsets
+            if sys.byteorder != "little":
+                offsets = array("Q", offsets)
+                offsets.byteswap()
+            self._file.write(offsets.tobytes())
+            self._file.write(
+                _TRAILER.pack(self._position, len(self._offsets), _END_MAGIC)
+            )
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveReader:
+    """
+    Reads records from an archive by index, through a read-only memory map of the file.
+
+    Args:
+        path: The path of the archive to open.
+    Raises:
+        ValueError: If the file is not a valid archive.
+    """
+
+    def __init__(self, path):
+        with builtins.open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < len(_MAGIC) + 1 + _TRAILER.size:
+                raise ValueError("file is too short to be a unishox2 archive")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open(size)
+        except BaseException:
+            self._map.close()
+            raise
+
+    def _open(self, size):
+        data = self._map
+        if data[: len(_MAGIC)] != _MAGIC:
+            raise ValueError("file is not a unishox2 archive")
+        if data[len(_MAGIC)] != _VERSION:
+            raise ValueError(
+                "unsupported unishox2 archive version: %d" % data[len(_MAGIC)]
+            )
+        index_offset, count, end_magic = _TRAILER.unpack_from(
+            data, size - _TRAILER.size
+        )
+        if end_magic != _END_MAGIC:
+            raise ValueError("unishox2 archive is truncated or was not closed")
+        if index_offset + count * _OFFSET.size != size - _TRAILER.size:
+            raise ValueError("unishox2 archive has an invalid index")
+
+        tables_size, position = _read_varint(data, len(_MAGIC) + 1)
+        if position + tables_size > index_offset:
+            raise ValueError("unishox2 archive is truncated")
+        self.codec = Dictionary.from_bytes(data[position : position + tables_size])
+        self._index_offset = index_offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """
+        Decompresses record `index`, which may be negative to count from the end.
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("archive record index out of range")
+        data = self._map
+        (position,) = _OFFSET.unpack_from(
+            data, self._index_offset + index * _OFFSET.size
+        )
+        original_size, position = _read_varint(data, position)
+        compressed_size, position = _read_varint(data, position)
+        if position + compressed_size > self._index_offset:
+            raise ValueError("unishox2 archive record %d is truncated" % index)
+        return self.codec.decompress(
+            data[position : position + compressed_size], original_size
+        )
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    @property
+    def closed(self):
+        return self._map.closed
+
+    def close(self):
+        """
+        Unmaps the file. Does nothing if already closed.
+        """
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open(path, mode="r", codec=None):
+    """
+    Opens an archive for reading or writing, much like the builtin open().
+
+    Args:
+        path: The path of the archive.
+        mode: "r" to read an existing archive, or "w" to create a new one.
+        codec: The codec to compress with, when writing. Readers use the archive's own.
+    Returns:
+        ArchiveReader or ArchiveWriter: The open archive.
+    """
+    if mode == "r":
+        if codec is not None:
+            raise ValueError("codec can only be given when writing an archive")
+        return ArchiveReader(path)
+    if mode == "w":
+        return ArchiveWriter(path, codec)
+    raise ValueError("invalid mode: %r" % mode)
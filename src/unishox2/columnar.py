@@ -0,0 +1,172 @@
+"""
+Column-level compression of Arrow and NumPy string arrays.
+
+compress_column() packs a whole column into one contiguous buffer of compressed data, plus
+arrays of offsets into it and of original sizes, and decompress_arrow() rebuilds an Arrow
+string array straight from those buffers. Neither creates a Python object per row.
+
+NumPy and pyarrow are both optional, and only imported once an array of theirs is given (or,
+for decompress_arrow(), asked for).
+"""
+
+import sys
+from collections import namedtuple
+
+from . import _unishox2
+
+__all__ = ["CompressedColumn", "compress_column", "decompress_arrow"]
+
+CompressedColumn = namedtuple(
+    "CompressedColumn", ["data", "offsets", "original_sizes", "validity"]
+)
+CompressedColumn.__doc__ = """
+A compressed column of n strings.
+
+Attributes:
+    data: The compressed strings, back to back, as bytes.
+    offsets: n + 1 int64 offsets into data, as a memoryview. String i is compressed in
+        data[offsets[i]:offsets[i + 1]].
+    original_sizes: n int64 sizes of the strings in UTF-8 bytes, as a memoryview.
+    validity: An Arrow validity bitmap as bytes, or None if no string is null. Null strings
+        are compressed as empty ones.
+"""
+
+
+def _imported(name):
+    """
+    Returns an optional module if it was already imported, since values can only be one of its
+    arrays if it was.
+    """
+    return sys.modules.get(name)
+
+
+def _compress_arrow(pa, values, codec, threads):
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if pa.types.is_string(values.type):
+        width = 4
+    elif pa.types.is_large_string(values.type):
+        width = 8
+    elif getattr(pa.types, "is_string_view", lambda type: False)(values.type):
+        values = values.cast(pa.large_string())
+        width = 8
+    else:
+        raise TypeError("cannot compress an Arrow array of type %s" % values.type)
+
+    count = len(values)
+    offsets, data = values.buffers()[1:3]
+    if offsets is None:
+        offsets = bytes(width)
+    else:
+        offsets = memoryview(offsets)[
+            values.offset * width : (values.offset + count + 1) * width
+        ]
+    data, offsets, original_sizes = _unishox2._compress_column(
+        b"" if data is None else data, offsets, width, codec, threads
+    )
+    validity = None
+    if values.null_count:
+        import pyarrow.compute
+
+        validity = pyarrow.compute.is_valid(values).buffers()[1].to_pybytes()
+    return data, offsets, original_sizes, validity
+
+
+def _compress_objects(values, na_object, codec, threads):
+    for value in values:
+        if value is None or value is na_object:
+            raise ValueError(
+                "cannot compress missing values in a NumPy array, use an Arrow array to "
+                "keep them null"
+            )
+        if not isinstance(value, (str, bytes)):
+            raise TypeError(
+                "cannot compress a NumPy array holding %s values" % type(value).__name__
+            )
+    return _unishox2._compress_strings(values, codec, threads)
+
+
+def _compress_numpy(np, values, codec, threads):
+    if values.ndim != 1:
+        raise ValueError("only one-dimensional arrays can be compressed as a column")
+    if values.dtype.kind == "T":
+        # StringDType stores strings out of line. Padding them out to fixed-width UCS-4 would
+        # cost the longest string's size for every row, so hand them over as objects instead.
+        na_object = getattr(values.dtype, "na_object", None)
+        return _compress_objects(values.astype(object), na_object, codec, threads)
+    if values.dtype.kind == "U":
+        values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("="))
+        if values.dtype.itemsize == 0:
+            return _unishox2._compress_strings([""] * len(values), codec, threads)
+        return _unishox2._compress_ucs4(
+            values, values.dtype.itemsize // 4, codec, threads
+        )
+    if values.dtype.kind == "O":
+        return _compress_objects(values, None, codec, threads)
+    raise TypeError("cannot compress a NumPy array of dtype %s" % values.dtype)
+
+
+def compress_column(values, codec=None, threads=1):
+    """
+    Compresses a whole column of strings into one CompressedColumn.
+
+    Args:
+        values: An Arrow string array (string, large_string or string_view, chunked or not),
+            a one-dimensional NumPy array of str, object or StringDType, or any sequence of
+            strings.
+        codec: The unishox2.Codec to compress with, or None for the default preset.
+        threads: The number of native threads to compress with (default 1).
+    Returns:
+        CompressedColumn: The compressed column.
+    """
+    pa = _imported("pyarrow")
+    np = _imported("numpy")
+    validity = None
+    if pa is not None and isinstance(values, (pa.Array, pa.ChunkedArray)):
+        data, offsets, original_sizes, validity = _compress_arrow(
+            pa, values, codec, threads
+        )
+    elif np is not None and isinstance(values, np.ndarray):
+        data, offsets, original_sizes = _compress_numpy(np, values, codec, threads)
+    else:
+        data, offsets, original_sizes = _unishox2._compress_strings(
+            values, codec, threads
+        )
+    return CompressedColumn(
+        data,
+        memoryview(offsets).cast("q"),
+        memoryview(original_sizes).cast("q"),
+        validity,
+    )
+
+
+def decompress_arrow(column, codec=None, threads=1):
+    """
+    Decompresses a CompressedColumn straight into an Arrow string array.
+
+    Args:
+        column: A CompressedColumn, as returned by compress_column().
+        codec: The unishox2.Codec the column was compressed with, None for the default preset.
+        threads: The number of native threads to decompress with (default 1).
+    Returns:
+        pyarrow.Array: A string array, or a large_string array if the strings add up to more
+        than 2 GiB.
+    Raises:
+        ValueError: If the column is corrupt.
+    """
+    import pyarrow as pa
+
+    count = len(column.original_sizes)
+    offsets, data = _unishox2._decompress_column(
+        column.data, column.offsets, column.original_sizes, -1, codec, threads
+    )
+    large = len(offsets) == (count + 1) * 8
+    validity = None if column.validity is None else pa.py_buffer(column.validity)
+    array = pa.Array.from_buffers(
+        pa.large_string() if large else pa.string(),
+        count,
+        [validity, pa.py_buffer(offsets), pa.py_buffer(data)],
+    )
+    # Corrupt input can decompress to invalid UTF-8, which Arrow must never be handed.
+    array.validate(full=True)
+    return array
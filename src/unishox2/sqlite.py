@@ -0,0 +1,169 @@
+"""
+Helpers for keeping Unishox2-compressed columns in SQLite.
+
+register() adds SQL functions to a connection, so queries can compress and decompress values
+themselves. compress_rows() and decompress_rows() wrap the rows going into executemany() or
+coming out of a cursor, compressing or decompressing whole batches of values at a time
+rather than making one call per row.
+
+A compressed column is stored as two: the compressed BLOB, and the original size of the text
+in UTF-8 bytes, which decompression needs. In SQL, that size is length(CAST(text AS BLOB)).
+
+The sqlite3 module itself is never imported here; any DB-API connection with SQLite's
+create_function() works.
+"""
+
+from ._unishox2 import Codec
+
+__all__ = ["compress_rows", "decompress_rows", "register"]
+
+_BATCH_SIZE = 1000
+
+
+def _create_function(connection, name, argument_count, function):
+    try:
+        connection.create_function(name, argument_count, function, deterministic=True)
+    except (TypeError, getattr(connection, "NotSupportedError", TypeError)):
+        # Python before 3.8, or SQLite before 3.8.3, cannot mark functions deterministic.
+        connection.create_function(name, argument_count, function)
+
+
+def register(connection, codec=None, prefix="unishox2"):
+    """
+    Registers deterministic SQL functions for compressing and decompressing on a connection:
+
+        unishox2_compress(text) -> BLOB
+        unishox2_decompress(blob, original_size) -> TEXT
+
+    Both return NULL when given NULL. Being deterministic, they can be used in indexes,
+    generated columns and CHECK constraints.
+
+    Args:
+        connection: A sqlite3.Connection.
+        codec: The unishox2.Codec (or Dictionary) to use, None for the default preset.
+        prefix: The prefix of the function names (default "unishox2").
+    """
+    codec = Codec() if codec is None else codec
+    compress = codec.compress
+    decompress = codec.decompress
+
+    def sql_compress(text):
+        if text is None:
+            return None
+        return compress(text)[0]
+
+    def sql_decompress(blob, original_size):
+        if blob is None or original_size is None:
+            return None
+        return decompress(bytes(blob), original_size)
+
+    _create_function(connection, prefix + "_compress", 1, sql_compress)
+    _create_function(connection, prefix + "_decompress", 2, sql_decompress)
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _check_batch_size(batch_size):
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+
+
+def compress_rows(rows, columns, codec=None, threads=1, batch_size=_BATCH_SIZE):
+    """
+    Compresses columns of rows for executemany(), a batch of rows at a time.
+
+    Each compressed column becomes two adjacent values, its compressed bytes and its
+    original size, so the SQL needs one more placeholder per compressed column:
+
+        connection.executemany(
+            "INSERT INTO posts (id, title, title_size) VALUES (?, ?, ?)",
+            unishox2.sqlite.compress_rows(rows, [1]),
+        )
+
+    Args:
+        rows: An iterable of row sequences, such as a list of tuples or a cursor.
+        columns: The positions of the text columns to compress. NULLs stay NULL, with a NULL
+            size.
+        codec: The unishox2.Codec (or Dictionary) to use, None for the default preset.
+        threads: The number of native threads to compress each batch with.
+        batch_size: How many rows to compress at a time.
+    Yields:
+        tuple: Each row, with its compressed columns expanded.
+    """
+    _check_batch_size(batch_size)
+    codec = Codec() if codec is None else codec
+    columns = sorted(set(columns))
+    for batch in _batches(rows, batch_size):
+        values = [row[column] for row in batch for column in columns]
+        compressed = iter(
+            codec.compress_many(
+                [value for value in values if value is not None], threads=threads
+            )
+        )
+        results = iter(
+            (None, None) if value is None else next(compressed) for value in values
+        )
+        for row in batch:
+            out = []
+            start = 0
+            for column in columns:
+                out.extend(row[start:column])
+                out.extend(next(results))
+                start = column + 1
+            out.extend(row[start:])
+            yield tuple(out)
+
+
+def decompress_rows(rows, columns, codec=None, threads=1, batch_size=_BATCH_SIZE):
+    """
+    Decompresses columns of rows read from a cursor, a batch of rows at a time.
+
+    Each compressed column is read as two adjacent values, its compressed bytes and its
+    original size, as written by compress_rows(), and becomes the decompressed text:
+
+        cursor = connection.execute("SELECT id, title, title_size FROM posts")
+        for id, title in unishox2.sqlite.decompress_rows(cursor, [1]):
+            ...
+
+    Args:
+        rows: An iterable of row sequences, such as a cursor.
+        columns: The positions of the compressed bytes of each compressed column, counted in
+            the rows as read. NULL bytes decompress to NULL.
+        codec: The unishox2.Codec (or Dictionary) the columns were compressed with.
+        threads: The number of native threads to decompress each batch with.
+        batch_size: How many rows to decompress at a time.
+    Yields:
+        tuple: Each row, with its compressed columns collapsed back into text.
+    """
+    _check_batch_size(batch_size)
+    codec = Codec() if codec is None else codec
+    columns = sorted(set(columns))
+    for batch in _batches(rows, batch_size):
+        pairs = [(row[column], row[column + 1]) for row in batch for column in columns]
+        decompressed = iter(
+            codec.decompress_many(
+                [(bytes(data), size) for data, size in pairs if data is not None],
+                threads=threads,
+            )
+        )
+        results = iter(
+            None if data is None else next(decompressed) for data, _ in pairs
+        )
+        for row in batch:
+            out = []
+            start = 0
+            for column in columns:
+                out.extend(row[start:column])
+                out.append(next(results))
+                start = column + 2
+            out.extend(row[start:])
+            yield tuple(out)
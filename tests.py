@@ -1,6 +1,15 @@
+import csv
+import io
+import json
+import pickle
+import sqlite3
+import sys
+import sysconfig
+from array import array
+
 import pytest
 from hypothesis import given, settings
-from hypothesis.strategies import integers, text
+from hypothesis.strategies import integers, lists, text
 
 import unishox2
 
@@ -322,3 +331,1544 @@ def test_random_unicode_strings(string):
     compressed, original_size = unishox2.compress(string)
     decompressed = unishox2.decompress(compressed, original_size)
     assert decompressed == string
+
+
+BATCH_STRINGS = [
+    "Hello",
+    "",
+    "The quick brown fox jumps over the lazy dog.",
+    "https://chris.partridge.tech",
+    "顔に1899-05-12T23:59:59あり",
+    "😀😃😄😁😆😅🤣😂🙂🙃😉😊😇🥰😍🤩😘😗😚😙",
+    "Hg@hF&6v^DrV^MDRV&&t4ieSJWFEUGFUf9raVX2^@M2iKgVgCia$9AY*A^XgJyjrtW2UKkLM6nHgD",
+] * 50
+
+
+@pytest.mark.parametrize("threads", [1, 2, 3, 8])
+def test_compress_many_matches_compress(threads):
+    """
+    Verify that batch compression gives the same result as compressing one at a time,
+    no matter how many threads the batch is split across.
+    """
+    expected = [unishox2.compress(string) for string in BATCH_STRINGS]
+    assert unishox2.compress_many(BATCH_STRINGS, threads=threads) == expected
+
+
+@pytest.mark.parametrize("threads", [1, 2, 3, 8])
+def test_decompress_many_round_trip(threads):
+    """
+    Verify that batch decompression restores every string in order.
+    """
+    compressed = unishox2.compress_many(BATCH_STRINGS, threads=threads)
+    decompressed = unishox2.decompress_many(compressed, threads=threads)
+    assert decompressed == BATCH_STRINGS
+
+
+def test_batch_empty_and_iterables():
+    """
+    Verify that empty batches and non-list iterables are accepted.
+    """
+    assert unishox2.compress_many([]) == []
+    assert unishox2.decompress_many(()) == []
+    compressed = unishox2.compress_many(iter(["Hello", "World"]), threads=4)
+    assert unishox2.decompress_many(iter(compressed)) == ["Hello", "World"]
+
+
+def test_compress_many_bad_input():
+    """
+    Verify that batch compression rejects non-string items and bad thread counts.
+    """
+    with pytest.raises(TypeError):
+        unishox2.compress_many(1)
+    with pytest.raises(TypeError):
+        unishox2.compress_many(["Hello", 1])
+    with pytest.raises(UnicodeEncodeError):
+        unishox2.compress_many(["Hello", "\ud800"])
+    with pytest.raises(ValueError):
+        unishox2.compress_many(["Hello"], threads=0)
+
+
+def test_decompress_many_bad_input():
+    """
+    Verify that batch decompression only takes (bytes, int) tuples.
+    """
+    compressed, original_size = unishox2.compress("Hello")
+    with pytest.raises(TypeError):
+        unishox2.decompress_many([compressed])
+    with pytest.raises(TypeError):
+        unishox2.decompress_many([[compressed, original_size]])
+    with pytest.raises(TypeError):
+        unishox2.decompress_many([("Hello", original_size)])
+    with pytest.raises(ValueError):
+        unishox2.decompress_many([(compressed, -1)])
+    with pytest.raises(ValueError):
+        unishox2.decompress_many([(compressed, original_size)], threads=-1)
+
+
+@given(lists(text()), integers(min_value=1, max_value=8))
+def test_random_unicode_batches(strings, threads):
+    """
+    Verify batches of hypothesis-generated strings round trip across thread counts.
+    """
+    compressed = unishox2.compress_many(strings, threads=threads)
+    assert unishox2.decompress_many(compressed, threads=threads) == strings
+
+
+@pytest.mark.parametrize(
+    "string",
+    [
+        "",
+        "Hello",
+        "\x01",
+        "\x01߿\x02\x80\x03߾\x04\x81\x05߽\x06\x82\x07߼\x08\x83",
+        "😀😃😄😁😆😅🤣😂🙂🙃😉😊😇🥰😍🤩😘😗😚😙",
+        "Hg@hF&6v^DrV^MDRV&&t4ieSJWFEUGFUf9raVX2^@M2iKgVgCia$9AY*A^XgJyjrtW2UKkLM6nHgD",
+    ],
+)
+def test_compress_bound(string):
+    """
+    Verify that compress_bound() is never exceeded, including for strings that expand.
+    """
+    compressed, original_size = unishox2.compress(string)
+    assert len(compressed) <= unishox2.compress_bound(original_size)
+
+
+@given(text())
+def test_random_unicode_compress_bound(string):
+    """
+    Verify compress_bound() holds for hypothesis-generated strings.
+    """
+    compressed, original_size = unishox2.compress(string)
+    assert len(compressed) <= unishox2.compress_bound(original_size)
+
+
+def test_compress_bound_bad_input():
+    """
+    Verify compress_bound() only takes non-negative integers.
+    """
+    with pytest.raises(TypeError):
+        unishox2.compress_bound("Hello")
+    with pytest.raises(ValueError):
+        unishox2.compress_bound(-1)
+
+
+@pytest.mark.parametrize(
+    "make_buffer",
+    [
+        bytearray,
+        lambda size: memoryview(bytearray(size)),
+        lambda size: array("b", bytes(size)),
+    ],
+)
+def test_compress_into_decompress_into(make_buffer):
+    """
+    Verify the zero-copy APIs round trip through any writable buffer.
+    """
+    string = "The quick brown fox jumps over the lazy dog."
+    compressed, original_size = unishox2.compress(string)
+
+    arena = make_buffer(unishox2.compress_bound(original_size))
+    written = unishox2.compress_into(string, arena)
+    assert bytes(memoryview(arena)[:written]) == compressed
+
+    output = make_buffer(original_size)
+    written = unishox2.decompress_into(memoryview(arena)[: len(compressed)], output)
+    assert written == original_size
+    assert bytes(memoryview(output)[:written]).decode("utf-8") == string
+
+
+def test_into_reuses_one_arena():
+    """
+    Verify that one preallocated arena can be reused across many calls.
+    """
+    arena = bytearray(unishox2.compress_bound(1024))
+    output = bytearray(1024)
+    for string in BATCH_STRINGS:
+        written = unishox2.compress_into(string.encode("utf-8"), arena)
+        size = unishox2.decompress_into(memoryview(arena)[:written], output)
+        assert output[:size].decode("utf-8") == string
+
+
+def test_into_buffer_too_small():
+    """
+    Verify that a small output buffer raises instead of being overrun.
+    """
+    string = "The quick brown fox jumps over the lazy dog."
+    compressed, original_size = unishox2.compress(string)
+    with pytest.raises(ValueError):
+        unishox2.compress_into(string, bytearray(len(compressed) - 1))
+    with pytest.raises(ValueError):
+        unishox2.decompress_into(compressed, bytearray(original_size - 1))
+
+
+def test_into_bad_input():
+    """
+    Verify the zero-copy APIs require a writable output buffer.
+    """
+    string = "The quick brown fox jumps over the lazy dog."
+    compressed, original_size = unishox2.compress(string)
+    with pytest.raises(TypeError):
+        unishox2.compress_into(string, bytes(100))
+    with pytest.raises(TypeError):
+        unishox2.compress_into([string], bytearray(100))
+    with pytest.raises(TypeError):
+        unishox2.decompress_into(compressed, bytes(100))
+    with pytest.raises(TypeError):
+        unishox2.decompress_into(string, bytearray(100))
+
+
+def test_decompress_size_too_small():
+    """
+    Verify that an original_size which is too small raises instead of overrunning memory.
+    """
+    string = "The quick brown fox jumps over the lazy dog."
+    compressed, original_size = unishox2.compress(string)
+    with pytest.raises(ValueError):
+        unishox2.decompress(compressed, original_size - 1)
+    with pytest.raises(ValueError):
+        unishox2.decompress(compressed, -1)
+    with pytest.raises(ValueError):
+        unishox2.decompress_many([(compressed, original_size - 1)])
+
+
+@pytest.mark.parametrize(
+    "preset, string",
+    [
+        ("default", "The quick brown fox jumps over the lazy dog."),
+        ("url", "https://www.example.com/r/Python/comments/abc123"),
+        ("json", '{"menu": {"id": "file", "value": "File"}}'),
+        ("html", '<p class="intro"><a href="https://siara.cc">Hello</a></p>'),
+        ("xml", '<?xml version="1.0"?><note xmlns:h="http://www.w3.org">Hi</note>'),
+        ("favor_alpha", "Beauty is not in the face. Beauty is a light in the heart."),
+        ("no_dict", "Hello World 2020-12-31T12:23:59.234Z"),
+        ("alpha_num_only", "Hello World 1234 hello world12"),
+        ("no_uni", "HELLO(993) 345-3495WORLD"),
+    ],
+)
+def test_codec_presets(preset, string):
+    """
+    Verify that codecs built from presets round trip content suited to them.
+    """
+    codec = unishox2.Codec(preset)
+    assert codec.preset == preset
+    compressed, original_size = codec.compress(string)
+    assert len(compressed) <= codec.compress_bound(original_size)
+    assert codec.decompress(compressed, original_size) == string
+
+
+def test_codec_default_matches_module():
+    """
+    Verify the default codec produces exactly what the module-level functions do.
+    """
+    codec = unishox2.Codec()
+    assert codec.compress_many(BATCH_STRINGS) == unishox2.compress_many(BATCH_STRINGS)
+    assert codec.compress_bound(100) == unishox2.compress_bound(100)
+
+
+def test_codec_url_preset_helps_urls():
+    """
+    Verify the URL preset actually pays off on URLs.
+    """
+    url = "https://www.example.com/index.html"
+    assert len(unishox2.Codec("url").compress(url)[0]) < len(unishox2.compress(url)[0])
+
+
+def test_codec_custom_tables():
+    """
+    Verify custom tables are used, and are exposed back as attributes.
+    """
+    freq_seq = ["/comments/", "reddit", ".com", "https://", "www.", "/r/"]
+    templates = ["tfff-of-tf", None, "ffffff"]
+    codec = unishox2.Codec("url", freq_seq=freq_seq, templates=templates)
+    assert codec.preset is None
+    assert codec.freq_seq == tuple(freq_seq)
+    assert codec.templates == ("tfff-of-tf", None, "ffffff", None, None)
+    assert codec.hcodes == unishox2.Codec("url").hcodes
+
+    string = "https://www.reddit.com/r/Python/comments/abc123 2020-12-31 ffeedd"
+    compressed, original_size = codec.compress(string)
+    assert len(compressed) < len(unishox2.Codec("url").compress(string)[0])
+    assert codec.decompress(compressed, original_size) == string
+
+    output = bytearray(original_size)
+    written = codec.decompress_into(compressed, output)
+    assert output[:written].decode("utf-8") == string
+    compressed_batch = codec.compress_many([string] * 10, threads=2)
+    assert codec.decompress_many(compressed_batch, threads=2) == [string] * 10
+
+
+@given(text(alphabet="0123456789abcdefABCDEF-:. "))
+def test_codec_short_templates_bound(string):
+    """
+    Verify compress_bound() accounts for short custom templates and sequences.
+    """
+    codec = unishox2.Codec(
+        templates=["f", "ff", "t", None, "fff"], freq_seq=["a", "b", "c", "d", "e", "f"]
+    )
+    compressed, original_size = codec.compress(string)
+    assert len(compressed) <= codec.compress_bound(original_size)
+    assert codec.decompress(compressed, original_size) == string
+
+
+def test_codec_bad_tables():
+    """
+    Verify that tables which would break Unishox2 are rejected.
+    """
+    with pytest.raises(ValueError):
+        unishox2.Codec("nonexistent")
+    with pytest.raises(TypeError):
+        unishox2.Codec("url", "json")
+    with pytest.raises(ValueError):
+        unishox2.Codec(hcodes=[0, 64, 128, 192])
+    with pytest.raises(ValueError):
+        unishox2.Codec(hcode_lens=[2, 2, 2, 3, 9])
+    with pytest.raises(ValueError):
+        unishox2.Codec(hcodes=[0x00, 0x40, 0x80, 0xC0, 0xE1])
+    with pytest.raises(TypeError):
+        unishox2.Codec(hcodes=[0, 64, 128, 192, "a"])
+    with pytest.raises(ValueError):
+        unishox2.Codec(freq_seq=["a", "b", "c", "d", "e"])
+    with pytest.raises(ValueError):
+        unishox2.Codec(freq_seq=["a", "b", "c", "d", "e", ""])
+    with pytest.raises(TypeError):
+        unishox2.Codec(freq_seq=["a", "b", "c", "d", "e", None])
+    with pytest.raises(ValueError):
+        unishox2.Codec(templates=["a\x00b"])
+    with pytest.raises(ValueError):
+        unishox2.Codec(templates=["a", "b", "c", "d", "e", "f"])
+
+
+TRAINING_URLS = [
+    "https://shop.example.com/catalog/item/%d?ref=homepage&lang=en" % i
+    for i in range(0, 3000, 7)
+]
+SMALL_DICTIONARY = unishox2.train(TRAINING_URLS[:50])
+
+
+def test_train_improves_compression():
+    """
+    Verify a trained dictionary beats the default tables on data like its training set.
+    """
+    dictionary = unishox2.train(TRAINING_URLS)
+    assert isinstance(dictionary, unishox2.Codec)
+    default_size = sum(len(unishox2.compress(url)[0]) for url in TRAINING_URLS)
+    trained_size = sum(len(dictionary.compress(url)[0]) for url in TRAINING_URLS)
+    assert trained_size < default_size * 0.8
+    for url in TRAINING_URLS:
+        assert dictionary.decompress(*dictionary.compress(url)) == url
+
+
+@given(text())
+def test_trained_dictionary_is_lossless(string):
+    """
+    Verify a trained dictionary still round-trips text unlike anything it was trained on.
+    """
+    compressed, original_size = SMALL_DICTIONARY.compress(string)
+    assert len(compressed) <= SMALL_DICTIONARY.compress_bound(original_size)
+    assert SMALL_DICTIONARY.decompress(compressed, original_size) == string
+
+
+def test_dictionary_serialization():
+    """
+    Verify dictionaries survive to_bytes()/from_bytes() and pickling.
+    """
+    dictionary = unishox2.train(TRAINING_URLS, max_sequences=3, max_templates=0)
+    compressed, original_size = dictionary.compress(TRAINING_URLS[0])
+
+    for loaded in (
+        unishox2.Dictionary.from_bytes(dictionary.to_bytes()),
+        unishox2.Dictionary.from_bytes(bytearray(dictionary.to_bytes())),
+        pickle.loads(pickle.dumps(dictionary)),
+    ):
+        assert type(loaded) is unishox2.Dictionary
+        assert loaded.to_bytes() == dictionary.to_bytes()
+        assert loaded.templates == dictionary.templates
+        assert loaded.decompress(compressed, original_size) == TRAINING_URLS[0]
+
+
+def test_train_bad_input():
+    """
+    Verify train() and Dictionary.from_bytes() reject bad input.
+    """
+    with pytest.raises(ValueError):
+        unishox2.train([])
+    with pytest.raises(ValueError):
+        unishox2.train(["", ""])
+    with pytest.raises(ValueError):
+        unishox2.train(TRAINING_URLS, max_sequences=7)
+    with pytest.raises(ValueError):
+        unishox2.train(TRAINING_URLS, max_templates=-1)
+    with pytest.raises(ValueError):
+        unishox2.train(TRAINING_URLS, preset="nonexistent")
+    for preset in ("alpha_num_only", "no_uni", "json_no_uni"):
+        with pytest.raises(ValueError):
+            unishox2.train(TRAINING_URLS, preset=preset)
+    assert unishox2.train(TRAINING_URLS[:20], preset="url").freq_seq
+
+    with pytest.raises(ValueError):
+        unishox2.Dictionary(freq_seq=["x" * 65536]).to_bytes()
+
+    data = unishox2.train(TRAINING_URLS[:20]).to_bytes()
+    with pytest.raises(ValueError):
+        unishox2.Dictionary.from_bytes(b"")
+    with pytest.raises(ValueError):
+        unishox2.Dictionary.from_bytes(b"NOTADICT" + data[8:])
+    with pytest.raises(ValueError):
+        unishox2.Dictionary.from_bytes(data[:8] + b"\x02" + data[9:])
+    with pytest.raises(ValueError):
+        unishox2.Dictionary.from_bytes(data[:-1])
+    with pytest.raises(ValueError):
+        unishox2.Dictionary.from_bytes(data + b"\x00")
+
+
+LOG_LINES = [
+    "2024-05-%02d 12:00:%02d INFO user %s logged in from 10.0.0.%d"
+    % (i % 28 + 1, i % 60, ["alice", "bob", "carol"][i % 3], i % 256)
+    for i in range(500)
+]
+
+
+@pytest.mark.parametrize("max_lines", [1, 4, 16])
+def test_line_context_round_trip(max_lines):
+    """
+    Verify lines compressed against a window decompress against the same window.
+    """
+    compressor = unishox2.LineContext(max_lines=max_lines)
+    decompressor = unishox2.LineContext(max_lines=max_lines)
+    compressed = [compressor.compress(line) for line in LOG_LINES]
+    assert [decompressor.decompress(*item) for item in compressed] == LOG_LINES
+    assert len(compressor) == len(decompressor) == max_lines
+    assert compressor.nbytes == decompressor.nbytes
+
+
+def test_line_context_beats_independent_lines():
+    """
+    Verify repetition across lines is deduplicated.
+    """
+    context = unishox2.LineContext()
+    independent = sum(len(unishox2.compress(line)[0]) for line in LOG_LINES)
+    contextual = sum(len(context.compress(line)[0]) for line in LOG_LINES)
+    assert contextual < independent * 0.8
+
+
+@given(lists(text(), max_size=20))
+def test_random_unicode_line_contexts(lines):
+    """
+    Verify line contexts round-trip random Unicode lines, with a small window and a codec.
+    """
+    codec = unishox2.Codec("favor_dict")
+    compressor = unishox2.LineContext(codec, max_lines=3, max_bytes=64)
+    decompressor = unishox2.LineContext(codec, max_lines=3, max_bytes=64)
+    for line in lines:
+        compressed, original_size = compressor.compress(line)
+        assert len(compressed) <= codec.compress_bound(original_size)
+        assert decompressor.decompress(compressed, original_size) == line
+        assert compressor.nbytes <= 64
+        assert compressor.nbytes == decompressor.nbytes
+
+
+def test_line_context_window_bounds():
+    """
+    Verify the window stays within max_lines and max_bytes, and reset() empties it.
+    """
+    context = unishox2.LineContext(max_lines=4, max_bytes=100)
+    assert context.codec is None
+    assert (context.max_lines, context.max_bytes) == (4, 100)
+    for line in LOG_LINES[:10]:
+        context.compress(line)
+        assert context.nbytes <= 100
+    assert len(context) == 1
+    context.reset()
+    assert (len(context), context.nbytes) == (0, 0)
+    context.compress("x" * 101)
+    context.compress("")
+    assert len(context) == 0
+    context.compress("short line")
+    assert (len(context), context.nbytes) == (1, 10)
+    context.reset()
+    assert (len(context), context.nbytes) == (0, 0)
+
+
+def test_line_context_bad_input():
+    """
+    Verify line contexts reject bad arguments and corrupt data.
+    """
+    with pytest.raises(TypeError):
+        unishox2.LineContext("url")
+    with pytest.raises(ValueError):
+        unishox2.LineContext(max_lines=0)
+    with pytest.raises(ValueError):
+        unishox2.LineContext(max_lines=1025)
+    with pytest.raises(ValueError):
+        unishox2.LineContext(max_bytes=0)
+
+    compressor = unishox2.LineContext()
+    decompressor = unishox2.LineContext()
+    decompressor.decompress(*compressor.compress(LOG_LINES[0]))
+    compressed, original_size = compressor.compress(LOG_LINES[1])
+    with pytest.raises(ValueError):
+        decompressor.decompress(compressed, original_size - 1)
+    with pytest.raises(ValueError):
+        decompressor.decompress(compressed, -1)
+    assert len(decompressor) == 1
+    assert decompressor.decompress(compressed, original_size) == LOG_LINES[1]
+
+
+def test_archive_random_access(tmp_path):
+    """
+    Verify records can be read back from an archive in any order.
+    """
+    path = str(tmp_path / "strings.usx")
+    with unishox2.archive.open(path, "w") as writer:
+        assert writer.write(BATCH_STRINGS[0]) == 0
+        writer.write_many(BATCH_STRINGS[1:], threads=2)
+        writer.write_many(LOG_LINES)
+        assert len(writer) == len(BATCH_STRINGS) + len(LOG_LINES)
+    assert writer.closed
+
+    expected = BATCH_STRINGS + LOG_LINES
+    with unishox2.archive.open(path) as reader:
+        assert len(reader) == len(expected)
+        assert reader[-1] == expected[-1]
+        for index in reversed(range(len(expected))):
+            assert reader[index] == expected[index]
+        assert list(reader) == expected
+        with pytest.raises(IndexError):
+            reader[len(expected)]
+    assert reader.closed
+
+
+def test_archive_stores_codec(tmp_path):
+    """
+    Verify an archive records the tables it was written with, and may be empty.
+    """
+    path = str(tmp_path / "urls.usx")
+    codec = unishox2.Codec("url")
+    with unishox2.archive.ArchiveWriter(path, codec) as writer:
+        writer.write_many(TRAINING_URLS)
+    with unishox2.archive.ArchiveReader(path) as reader:
+        assert reader.codec.freq_seq == codec.freq_seq
+        assert reader.codec.hcodes == codec.hcodes
+        assert list(reader) == TRAINING_URLS
+
+    unishox2.archive.open(path, "w", codec=SMALL_DICTIONARY).close()
+    with unishox2.archive.open(path) as reader:
+        assert len(reader) == 0
+        assert reader.codec.to_bytes() == SMALL_DICTIONARY.to_bytes()
+
+
+def test_archive_bad_files(tmp_path):
+    """
+    Verify invalid, truncated and unclosed archives are rejected.
+    """
+    path = tmp_path / "strings.usx"
+    with unishox2.archive.open(str(path), "w") as writer:
+        writer.write_many(LOG_LINES[:10])
+    data = path.read_bytes()
+
+    for bad in (b"", b"not an archive" * 10, data[:-1], data[:100], b"X" + data[1:]):
+        path.write_bytes(bad)
+        with pytest.raises(ValueError):
+            unishox2.archive.open(str(path))
+
+    with pytest.raises(ValueError):
+        unishox2.archive.open(str(path), "a")
+    with pytest.raises(ValueError):
+        unishox2.archive.open(str(path), "r", codec=SMALL_DICTIONARY)
+
+
+def test_open_round_trip(tmp_path):
+    """
+    Verify text written with unishox2.open() reads back the same, line by line.
+    """
+    path = str(tmp_path / "lines.usx")
+    text = "".join(line + "\n" for line in LOG_LINES) + "no newline at the end"
+    with unishox2.open(path, "wt", block_size=1000) as file:
+        for line in LOG_LINES:
+            file.write(line)
+            file.write("\n")
+        file.write("no newline ")
+        file.write("at the end")
+
+    with unishox2.open(path) as file:
+        assert list(file) == text.splitlines(keepends=True)
+    with unishox2.open(path, "rt") as file:
+        assert file.readline() == LOG_LINES[0] + "\n"
+        assert file.readline(4) == LOG_LINES[1][:4]
+        assert file.read(10) == text[len(LOG_LINES[0]) + 5 :][:10]
+        assert file.read() == text[len(LOG_LINES[0]) + 15 :]
+        assert file.readline() == ""
+
+
+def _stream_block_records(data):
+    """
+    Returns how many records each block of a unishox2.open() stream holds, read off the
+    stream format: a header, then blocks of a varint record count and a varint size.
+    """
+
+    def varint(position):
+        value = shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value, position
+            shift += 7
+
+    tables_size, position = varint(9)
+    position += tables_size
+    records = []
+    while True:
+        count, position = varint(position)
+        if not count:
+            return records
+        size, position = varint(position)
+        records.append(count)
+        position += size
+
+
+def test_open_block_size_with_print():
+    """
+    Verify lines written with print() are batched into blocks of block_size, even though
+    each line arrives in two writes.
+    """
+    buffer = io.BytesIO()
+    line = "x" * 200
+    with unishox2.open(buffer, "w", block_size=1000) as file:
+        for _ in range(1000):
+            print(line, file=file)
+    assert _stream_block_records(buffer.getvalue()) == [5] * 200
+
+    buffer.seek(0)
+    with unishox2.open(buffer) as file:
+        assert file.read() == (line + "\n") * 1000
+
+
+@given(lists(text(), max_size=10))
+def test_random_unicode_streams(writes):
+    """
+    Verify streams round-trip arbitrary writes, through file objects and tiny blocks.
+    """
+    buffer = io.BytesIO()
+    with unishox2.open(buffer, "w", codec=SMALL_DICTIONARY, block_size=8) as file:
+        for string in writes:
+            assert file.write(string) == len(string)
+        file.flush()
+    assert not buffer.closed
+
+    buffer.seek(0)
+    with unishox2.open(buffer, threads=2) as file:
+        assert file.codec.to_bytes() == SMALL_DICTIONARY.to_bytes()
+        assert file.read() == "".join(writes)
+
+
+def test_open_bad_input(tmp_path):
+    """
+    Verify unishox2.open() rejects bad modes, misuse and corrupt streams.
+    """
+    path = tmp_path / "lines.usx"
+    with pytest.raises(ValueError):
+        unishox2.open(str(path), "a")
+    with pytest.raises(ValueError):
+        unishox2.open(str(path), "wb")
+    # Closing a file whose constructor raised, as garbage collection does, is harmless.
+    file = unishox2.UnishoxFile.__new__(unishox2.UnishoxFile)
+    with pytest.raises(ValueError):
+        file.__init__(str(path), "a")
+    file.close()
+
+    with unishox2.open(str(path), "w") as file:
+        file.write("\n".join(LOG_LINES))
+        with pytest.raises(io.UnsupportedOperation):
+            file.read()
+        with pytest.raises(TypeError):
+            file.write(b"bytes")
+    with pytest.raises(ValueError):
+        file.write("closed")
+    with pytest.raises(FileExistsError):
+        unishox2.open(str(path), "x")
+    with pytest.raises(ValueError):
+        unishox2.open(str(path), "r", codec=SMALL_DICTIONARY)
+
+    data = path.read_bytes()
+    with unishox2.open(str(path)) as file:
+        with pytest.raises(io.UnsupportedOperation):
+            file.write("read only")
+    for bad in (b"", b"not a stream", data[:-1], data[:150]):
+        path.write_bytes(bad)
+        with pytest.raises(ValueError):
+            with unishox2.open(str(path)) as file:
+                file.read()
+
+
+COLUMN_STRINGS = BATCH_STRINGS + LOG_LINES[:50] + ["", "ünïcödé ✓ 🎉"]
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_column_from_strings(threads):
+    """
+    Verify a column of plain strings matches compress_many(), item for item.
+    """
+    column = unishox2.columnar.compress_column(COLUMN_STRINGS, threads=threads)
+    assert column.validity is None
+    assert len(column.offsets) == len(COLUMN_STRINGS) + 1
+    for i, (compressed, original_size) in enumerate(
+        unishox2.compress_many(COLUMN_STRINGS)
+    ):
+        assert column.data[column.offsets[i] : column.offsets[i + 1]] == compressed
+        assert column.original_sizes[i] == original_size
+
+
+def test_column_arrow_round_trip():
+    """
+    Verify Arrow string arrays round-trip, including slices, nulls and large strings.
+    """
+    pa = pytest.importorskip("pyarrow")
+    codec = unishox2.Codec("url")
+    for array in (
+        pa.array(COLUMN_STRINGS),
+        pa.array(COLUMN_STRINGS, pa.large_string()).slice(3, 20),
+        pa.array(["a", None, "b", None] * 10),
+        pa.chunked_array([COLUMN_STRINGS[:5], COLUMN_STRINGS[5:]]),
+        pa.array([], pa.string()),
+    ):
+        column = unishox2.columnar.compress_column(array, codec=codec, threads=2)
+        restored = unishox2.columnar.decompress_arrow(column, codec=codec, threads=2)
+        assert restored.type == pa.string()
+        assert restored.to_pylist() == array.to_pylist()
+    with pytest.raises(TypeError):
+        unishox2.columnar.compress_column(pa.array([1, 2, 3]))
+
+
+def test_column_arrow_rejects_non_strings(monkeypatch):
+    """
+    Verify non-string Arrow arrays are rejected, also by pyarrow versions without string views.
+    """
+    pa = pytest.importorskip("pyarrow")
+    arrays = (
+        pa.array([1, 2, 3]),
+        pa.array([b"a", b"b"]),
+        pa.array([1.5], pa.float64()),
+    )
+    for array in arrays:
+        with pytest.raises(TypeError):
+            unishox2.columnar.compress_column(array)
+    monkeypatch.delattr(pa.types, "is_string_view", raising=False)
+    for array in arrays:
+        with pytest.raises(TypeError):
+            unishox2.columnar.compress_column(array)
+
+
+def test_column_numpy():
+    """
+    Verify NumPy str and object arrays compress to the same column as a list does.
+    """
+    np = pytest.importorskip("numpy")
+    expected = unishox2.columnar.compress_column(COLUMN_STRINGS)
+    arrays = [
+        np.array(COLUMN_STRINGS),
+        np.array(COLUMN_STRINGS, dtype=object),
+        np.array(COLUMN_STRINGS).astype(">U400"),
+    ]
+    if hasattr(np, "dtypes") and hasattr(np.dtypes, "StringDType"):
+        arrays.append(np.array(COLUMN_STRINGS, dtype=np.dtypes.StringDType()))
+    for array in arrays:
+        column = unishox2.columnar.compress_column(array)
+        assert column.data == expected.data
+        assert column.offsets.tolist() == expected.offsets.tolist()
+        assert column.original_sizes.tolist() == expected.original_sizes.tolist()
+    with pytest.raises(ValueError):
+        unishox2.columnar.compress_column(np.array([["a", "b"]]))
+    with pytest.raises(TypeError):
+        unishox2.columnar.compress_column(np.arange(3))
+
+    nulls = [np.array(["a", None], dtype=object)]
+    if hasattr(np, "dtypes") and hasattr(np.dtypes, "StringDType"):
+        for na_object in (None, float("nan"), "<NA>"):
+            dtype = np.dtypes.StringDType(na_object=na_object)
+            nulls.append(np.array(["a", na_object], dtype=dtype))
+    for array in nulls:
+        with pytest.raises(ValueError, match="missing values"):
+            unishox2.columnar.compress_column(array)
+    with pytest.raises(TypeError, match="int values"):
+        unishox2.columnar.compress_column(np.array(["a", 1], dtype=object))
+
+
+def test_column_bad_input():
+    """
+    Verify corrupt columns are rejected rather than read out of bounds.
+    """
+    pa = pytest.importorskip("pyarrow")
+    column = unishox2.columnar.compress_column(LOG_LINES[:10])
+    offsets = array("q", column.offsets)
+    offsets[3] = offsets[4] + 1
+    sizes = array("q", column.original_sizes)
+    sizes[5] -= 1
+    for bad in (
+        column._replace(offsets=offsets),
+        column._replace(offsets=column.offsets[:-1]),
+        column._replace(original_sizes=sizes),
+    ):
+        with pytest.raises(ValueError):
+            unishox2.columnar.decompress_arrow(bad)
+    with pytest.raises(TypeError):
+        unishox2.columnar.compress_column([b"ok", None])
+    with pytest.raises(TypeError):
+        unishox2.columnar.compress_column(LOG_LINES, codec="url")
+
+
+@pytest.fixture
+def module_cache():
+    """
+    Installs a fresh module-level decompression cache, removing it again afterwards.
+    """
+    cache = unishox2.DecompressCache(max_entries=8, max_bytes=4096)
+    unishox2.set_decompress_cache(cache)
+    yield cache
+    unishox2.set_decompress_cache(None)
+
+
+def test_decompress_cache_hits(module_cache):
+    """
+    Verify repeated decompression is answered from the cache, with the same result.
+    """
+    assert unishox2.get_decompress_cache() is module_cache
+    compressed, original_size = unishox2.compress(LOG_LINES[0])
+    for _ in range(3):
+        assert unishox2.decompress(compressed, original_size) == LOG_LINES[0]
+    assert (module_cache.hits, module_cache.misses) == (2, 1)
+    assert len(module_cache) == 1
+    assert module_cache.nbytes == len(compressed) + original_size
+    # A cached string still has to fit in the original size given.
+    with pytest.raises(ValueError):
+        unishox2.decompress(compressed, original_size - 1)
+
+    # Only exact bytes are cached.
+    class Compressed(bytes):
+        pass
+
+    assert unishox2.decompress(Compressed(compressed), original_size) == LOG_LINES[0]
+    assert module_cache.misses == 2
+    module_cache.clear()
+    assert len(module_cache) == 0 and module_cache.nbytes == 0
+    assert module_cache.hits == 2
+
+
+def test_decompress_cache_eviction():
+    """
+    Verify the cache stays within both bounds, evicting the least recently used entry.
+    """
+    cache = unishox2.DecompressCache(max_entries=3, max_bytes=200)
+    codec = unishox2.Codec(cache=cache)
+    assert codec.cache is cache and unishox2.Codec().cache is None
+    items = [codec.compress("line %d" % i) for i in range(4)]
+    for item in items[:3]:
+        codec.decompress(*item)
+    codec.decompress(*items[0])
+    codec.decompress(*items[3])
+    assert (len(cache), cache.evictions) == (3, 1)
+    # "line 1" was the least recently used, so it went first.
+    codec.decompress(*items[0])
+    codec.decompress(*items[1])
+    assert cache.hits == 2 and cache.evictions == 2
+
+    # Entries larger than max_bytes are never cached, and others evict to make room.
+    codec.decompress(*codec.compress("y" * 300))
+    assert len(cache) == 3
+    codec.decompress(*codec.compress("x" * 185))
+    assert cache.nbytes <= 200 and len(cache) < 3
+
+
+def test_decompress_cache_threads():
+    """
+    Verify a cache shared between threads keeps consistent counters.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = unishox2.DecompressCache(max_entries=16)
+    codec = unishox2.Codec(cache=cache)
+    items = [codec.compress(line) for line in LOG_LINES[:40]]
+
+    def work(seed):
+        for i in range(500):
+            index = (seed * 7 + i * 13) % len(items)
+            assert codec.decompress(*items[index]) == LOG_LINES[index]
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(work, range(8)))
+    assert cache.hits + cache.misses == 8 * 500
+    assert cache.misses - cache.evictions == len(cache) <= 16
+
+
+def test_decompress_cache_bad_input():
+    """
+    Verify invalid cache settings are rejected.
+    """
+    for kwargs in ({"max_entries": 0}, {"max_bytes": -1}):
+        with pytest.raises(ValueError):
+            unishox2.DecompressCache(**kwargs)
+    with pytest.raises(TypeError):
+        unishox2.Codec(cache={})
+    with pytest.raises(TypeError):
+        unishox2.set_decompress_cache({})
+    assert unishox2.get_decompress_cache() is None
+
+
+def test_decompress_ascii_and_utf8_paths():
+    """
+    Verify decompress() builds the right str whether or not its output is pure ASCII, whether
+    or not the original size given is larger than needed, and for subclasses of its arguments.
+    """
+
+    class Compressed(bytes):
+        pass
+
+    class Size(int):
+        pass
+
+    codec = unishox2.Codec()
+    for string in [
+        "",
+        "a",
+        "ascii only, 20 bytes",
+        "caf\u00e9",
+        "\U0001f600",
+        "x\u00e9" * 50,
+    ]:
+        data, size = unishox2.compress(string)
+        for decompress in (unishox2.decompress, codec.decompress):
+            assert decompress(data, size) == string
+            assert decompress(data, size + 9) == string
+            assert decompress(Compressed(data), Size(size)) == string
+        if size:
+            with pytest.raises(ValueError):
+                unishox2.decompress(data, size - 1)
+
+
+@pytest.fixture
+def bench():
+    """
+    Imports the benchmark suite, which lives outside the package.
+    """
+    import importlib.util
+    import os
+
+    path = os.path.join(os.path.dirname(__file__), "benchmarks", "bench.py")
+    spec = importlib.util.spec_from_file_location("bench", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_benchmark_corpora_round_trip(bench):
+    """
+    Verify every bundled corpus round-trips, and compresses better than zlib on its own.
+    """
+    report = bench.run(min_time=0, repeat=1)
+    assert {result["corpus"] for result in report["results"]} == set(bench.CORPORA)
+    ratios = {
+        (result["corpus"], result["codec"]): result["ratio"]
+        for result in report["results"]
+    }
+    for corpus in bench.CORPORA:
+        assert ratios[corpus, "unishox2"] < ratios[corpus, "zlib-9"]
+
+
+def test_benchmark_regression_gate(bench, tmp_path, capsys):
+    """
+    Verify the regression gate passes against itself, and fails on worse results.
+    """
+    baseline = tmp_path / "baseline.json"
+    arguments = [
+        "--corpus",
+        "urls",
+        "--codec",
+        "unishox2",
+        "--min-time",
+        "0",
+        "--repeat",
+        "1",
+    ]
+    assert bench.main(arguments + ["--json", str(baseline)]) == 0
+    assert "urls" in capsys.readouterr().out
+    report = json.loads(baseline.read_text())
+    assert bench.compare(report, report) == []
+
+    worse = json.loads(baseline.read_text())
+    worse["results"][0]["ratio"] += 0.01
+    worse["results"][0]["decompress"]["mb_per_second"] /= 2
+    regressions = bench.compare(worse, report)
+    assert len(regressions) == 2
+    assert "ratio" in regressions[0] and "decompress" in regressions[1]
+    with pytest.raises(ValueError):
+        bench.compare(report, dict(report, format=0))
+
+    # Corpora the baseline has no results for are reported, not skipped.
+    regressions = bench.compare(report, dict(report, results=[]))
+    assert regressions == ["urls: missing from the baseline"]
+    # Without a tolerance, only ratios are compared.
+    ratios_only = bench.compare(worse, report, tolerance=None)
+    assert len(ratios_only) == 1 and "ratio" in ratios_only[0]
+
+
+def test_benchmark_baseline(bench):
+    """
+    Verify the committed baseline covers every corpus, and that the ratios still match it.
+    """
+    with open(bench.BASELINE, encoding="utf-8") as file:
+        baseline = json.load(file)
+    report = bench.run(codecs=("unishox2",), min_time=0, repeat=1)
+    assert bench.compare(report, baseline, tolerance=None) == []
+
+
+@pytest.fixture
+def enabled_stats():
+    """
+    Counts statistics from zero, turning them off again afterwards.
+    """
+    unishox2.reset_stats()
+    unishox2.set_stats_enabled(True)
+    yield
+    unishox2.set_stats_enabled(False)
+    unishox2.set_slow_call_hook(None)
+    unishox2.reset_stats()
+
+
+@pytest.fixture
+def calls_bench():
+    """
+    Imports the call overhead benchmark, which lives outside the package.
+    """
+    import importlib.util
+    import os
+
+    path = os.path.join(os.path.dirname(__file__), "benchmarks", "calls.py")
+    spec = importlib.util.spec_from_file_location("calls", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_call_benchmark(calls_bench, tmp_path, capsys):
+    """
+    Verify the call overhead benchmark times every case, and compares against earlier results.
+    """
+    baseline = tmp_path / "calls.json"
+    arguments = ["--loops", "10", "--repeat", "1"]
+    assert calls_bench.main(arguments + ["--json", str(baseline)]) == 0
+    results = json.loads(baseline.read_text())["results"]
+    assert len(results) == 3 * len(calls_bench.CASES) + 1
+    assert calls_bench.main(arguments + ["--compare", str(baseline)]) == 0
+    assert "was" in capsys.readouterr().out
+
+
+def test_stats_disabled_by_default():
+    """
+    Verify nothing is counted unless statistics are enabled.
+    """
+    unishox2.reset_stats()
+    unishox2.decompress(*unishox2.compress(LOG_LINES[0]))
+    stats = unishox2.stats()
+    assert stats["enabled"] is False
+    assert stats["compress"]["calls"] == stats["decompress"]["calls"] == 0
+
+
+def test_stats_counters(enabled_stats):
+    """
+    Verify calls, bytes, expansions and allocations are counted across all entry points.
+    """
+    compressed, original_size = unishox2.compress(LOG_LINES[0])
+    unishox2.decompress(compressed, original_size + 100)
+    # High entropy strings grow rather than shrink.
+    unishox2.Codec().compress("\x01\x02\x03\x04")
+    unishox2.decompress_many(unishox2.compress_many(LOG_LINES[:10]))
+    buffer = bytearray(unishox2.compress_bound(original_size))
+    unishox2.compress_into(LOG_LINES[0], buffer)
+
+    stats = unishox2.stats()
+    assert stats["enabled"] is True
+    compress, decompress = stats["compress"], stats["decompress"]
+    assert compress["calls"] == 13 and decompress["calls"] == 11
+    assert compress["bytes_in"] == 2 * original_size + 4 + sum(
+        len(line.encode("utf-8")) for line in LOG_LINES[:10]
+    )
+    assert decompress["bytes_out"] == compress["bytes_in"] - original_size - 4
+    assert compress["expansions"] == 1 and decompress["expansions"] == 0
+    assert decompress["max_allocation"] >= original_size + 100
+    assert compress["seconds"] > 0
+    # Batches count every string, but only single-string calls have a latency.
+    assert sum(count for _, count in compress["latency"]) == 3
+    assert sum(count for _, count in compress["ratio"]) == 13
+    bounds = [bound for bound, _ in compress["ratio"]]
+    assert bounds == sorted(bounds) and bounds[-1] == float("inf")
+
+    unishox2.reset_stats()
+    assert unishox2.stats()["compress"]["calls"] == 0
+
+
+def test_stats_allocations_and_cache_hits(enabled_stats, module_cache):
+    """
+    Verify only heap buffers count as allocations, and cache hits are counted apart from calls.
+    """
+    compressed, original_size = unishox2.compress(LOG_LINES[0])
+    assert unishox2.stats()["compress"]["max_allocation"] == 0
+    unishox2.compress(" ".join(LOG_LINES))
+    assert unishox2.stats()["compress"]["max_allocation"] > 512
+
+    for _ in range(3):
+        unishox2.decompress(compressed, original_size)
+    decompress = unishox2.stats()["decompress"]
+    assert (decompress["calls"], decompress["cache_hits"]) == (1, 2)
+    assert decompress["cache_hits"] == module_cache.hits
+    assert unishox2.stats()["compress"]["cache_hits"] == 0
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+def test_stats_slow_call_hook(enabled_stats):
+    """
+    Verify slow calls are reported to the hook, and exceptions from it are ignored.
+    """
+    calls = []
+    unishox2.set_slow_call_hook(lambda *call: calls.append(call), threshold=0)
+    compressed, original_size = unishox2.compress(LOG_LINES[0])
+    unishox2.decompress_many([(compressed, original_size)])
+    assert [call[0] for call in calls] == ["compress", "decompress_many"]
+    function, seconds, bytes_in, bytes_out = calls[0]
+    assert seconds >= 0 and (bytes_in, bytes_out) == (original_size, len(compressed))
+
+    unishox2.set_slow_call_hook(lambda *call: calls.append(call), threshold=60)
+    unishox2.compress(LOG_LINES[0])
+    assert len(calls) == 2
+
+    unishox2.set_slow_call_hook(lambda *call: 1 / 0, threshold=0)
+    assert unishox2.decompress(compressed, original_size) == LOG_LINES[0]
+
+    with pytest.raises(TypeError):
+        unishox2.set_slow_call_hook(42)
+    with pytest.raises(ValueError):
+        unishox2.set_slow_call_hook(print, threshold=-1)
+
+
+def test_cli_csv_round_trip(tmp_path, capsys):
+    """
+    Verify selected CSV columns are compressed over a process pool, in their original order.
+    """
+    from unishox2._cli import main
+
+    original = tmp_path / "export.csv"
+    rows = [["id", "line", "note"]]
+    rows += [[str(i), line, 'a, "quoted"\nnote'] for i, line in enumerate(LOG_LINES)]
+    with original.open("w", encoding="utf-8", newline="") as file:
+        csv.writer(file).writerows(rows)
+    compressed = tmp_path / "compressed.csv"
+    restored = tmp_path / "restored.csv"
+
+    arguments = ["-c", "line,note", "-j", "2", "--chunk-size", "7"]
+    assert (
+        main(["compress", str(original), "-o", str(compressed), "--stats"] + arguments)
+        == 0
+    )
+    assert "ratio:" in capsys.readouterr().err
+    with compressed.open(encoding="utf-8", newline="") as file:
+        compressed_rows = list(csv.reader(file))
+    assert [row[0] for row in compressed_rows] == [row[0] for row in rows]
+    assert compressed_rows[1][1] != rows[1][1]
+
+    assert main(["decompress", str(compressed), "-o", str(restored)] + arguments) == 0
+    assert restored.read_bytes() == original.read_bytes()
+
+
+def test_cli_csv_ragged_rows(tmp_path, capsys):
+    """
+    Verify rows shorter than the header round-trip, and their missing columns are not counted.
+    """
+    from unishox2._cli import main
+
+    original = tmp_path / "ragged.csv"
+    original.write_text("a,b\n1,2\n3\n\n4,5,6\n", encoding="utf-8")
+    compressed = tmp_path / "compressed.csv"
+    restored = tmp_path / "restored.csv"
+
+    assert main(["compress", str(original), "-o", str(compressed), "--stats"]) == 0
+    assert "values:      5\n" in capsys.readouterr().err
+    assert main(["decompress", str(compressed), "-o", str(restored)]) == 0
+    assert restored.read_bytes().replace(b"\r\n", b"\n") == original.read_bytes()
+
+
+def test_cli_jsonl_round_trip(tmp_path):
+    """
+    Verify every string field of JSONL records is compressed by default, and nothing else.
+    """
+    from unishox2._cli import decode_value, main
+
+    records = [
+        {"id": i, "line": line, "tags": ["x"], "none": None}
+        for i, line in enumerate(LOG_LINES)
+    ]
+    original = tmp_path / "export.jsonl"
+    original.write_text(
+        "".join(json.dumps(record) + "\n" for record in records), encoding="utf-8"
+    )
+    compressed = tmp_path / "compressed.ndjson"
+    restored = tmp_path / "restored.txt"
+
+    assert (
+        main(["compress", str(original), "-o", str(compressed), "--preset", "url"]) == 0
+    )
+    compressed_records = [
+        json.loads(line) for line in compressed.read_text(encoding="utf-8").splitlines()
+    ]
+    assert compressed_records[0]["tags"] == ["x"] and compressed_records[0]["id"] == 0
+    data, original_size = decode_value(compressed_records[0]["line"])
+    assert unishox2.Codec("url").decompress(data, original_size) == LOG_LINES[0]
+
+    assert (
+        main(
+            [
+                "decompress",
+                str(compressed),
+                "-o",
+                str(restored),
+                "-f",
+                "jsonl",
+                "--preset",
+                "url",
+            ]
+        )
+        == 0
+    )
+    assert [
+        json.loads(line) for line in restored.read_text(encoding="utf-8").splitlines()
+    ] == records
+
+
+def test_cli_bad_input(tmp_path, capsys):
+    """
+    Verify bad input is reported as an error rather than a traceback.
+    """
+    from unishox2._cli import main
+
+    path = tmp_path / "plain.csv"
+    path.write_text("id,line\n1,not compressed\n", encoding="utf-8")
+    output = str(tmp_path / "out.csv")
+    assert main(["decompress", str(path), "-o", output]) == 1
+    assert main(["compress", str(path), "-o", output, "-c", "missing"]) == 1
+    assert "no such column: missing" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        main(["compress", str(tmp_path / "no_extension")])
+
+
+@settings(deadline=None)
+@given(lists(text()), integers(min_value=0, max_value=4))
+def test_random_unicode_string_stores(strings, split):
+    """
+    Verify a string store holds any strings, whether appended one by one or in a batch.
+    """
+    store = unishox2.StringStore(index=split % 2 == 0)
+    store.extend(strings[split:])
+    for string in strings[:split]:
+        store.append(string)
+    expected = strings[split:] + strings[:split]
+    assert len(store) == len(expected)
+    assert list(store) == expected
+    for position, string in enumerate(expected):
+        assert store[position] == string
+        assert store.index(string) == expected.index(string)
+
+
+def test_string_store_is_compact():
+    """
+    Verify a string store costs less than the strings themselves, and far less than bytes.
+    """
+    import sys
+
+    store = unishox2.StringStore()
+    store.extend(LOG_LINES * 10, threads=2)
+    assert store[-1] == LOG_LINES[-1]
+    assert store.nbytes < sum(sys.getsizeof(line) for line in LOG_LINES * 10) / 2
+    assert "in" not in store and LOG_LINES[3] in store
+    assert 42 not in store and None not in store and b"in" not in store
+    for bad in (b"in", None):
+        for method in (store.append, store.index, lambda value: store.extend([value])):
+            with pytest.raises(TypeError):
+                method(bad)
+    assert len(store) == len(LOG_LINES) * 10
+
+
+def test_string_store_index():
+    """
+    Verify the hash index finds the first of equal strings, and keeps up with appends.
+    """
+    store = unishox2.StringStore(index=True)
+    assert store.indexed and len(store) == 0 and "" not in store
+    store.extend(["a", "b", "a", ""])
+    assert (store.index("a"), store.index("b"), store.index("")) == (0, 1, 3)
+    for i in range(100):
+        assert store.append("line %d" % i) == i + 4
+    assert store.index("line 42") == 46
+    with pytest.raises(ValueError):
+        store.index("line 100")
+    with pytest.raises(IndexError):
+        store[104]
+    assert store[-104] == "a"
+
+
+def test_string_store_serialization():
+    """
+    Verify a string store saves and loads as one buffer, along with its codec.
+    """
+    dictionary = unishox2.train(TRAINING_URLS)
+    store = unishox2.StringStore(dictionary)
+    store.extend(TRAINING_URLS)
+    data = store.to_bytes()
+    loaded = unishox2.StringStore.from_bytes(data, index=True)
+    assert list(loaded) == TRAINING_URLS and loaded.indexed
+    assert loaded.codec.freq_seq == dictionary.freq_seq
+    assert loaded.to_bytes() == data
+    loaded.append("https://example.com/")
+    assert loaded.index("https://example.com/") == len(TRAINING_URLS)
+
+    copied = pickle.loads(pickle.dumps(loaded))
+    assert list(copied) == list(loaded) and copied.indexed
+
+    for bad in (b"", data[:-1], data + b"\x00", b"USX2STO\x00\x02" + data[9:]):
+        with pytest.raises(ValueError):
+            unishox2.StringStore.from_bytes(bad)
+
+
+@given(text(), text())
+def test_random_unicode_compressed_strs(first, second):
+    """
+    Verify a CompressedStr behaves like the str it holds.
+    """
+    lazy_first, lazy_second = unishox2.CompressedStr(first), unishox2.CompressedStr(
+        second
+    )
+    assert str(lazy_first) == first
+    assert (lazy_first == lazy_second) == (first == second)
+    assert (lazy_first != second) == (first != second)
+    assert (lazy_first < lazy_second) == (first < second)
+    assert (lazy_first >= second) == (first >= second)
+    assert bool(lazy_first) == bool(first)
+    assert hash(lazy_first) == hash(first)
+
+
+def test_compressed_str():
+    """
+    Verify a CompressedStr holds only its compressed form, and pickles as it.
+    """
+    lazy = unishox2.CompressedStr(LOG_LINES[0])
+    compressed, original_size = unishox2.compress(LOG_LINES[0])
+    assert (lazy.compressed, lazy.original_size) == (compressed, original_size)
+    assert not hasattr(lazy, "__dict__")
+    assert repr(lazy) == "CompressedStr(%r)" % LOG_LINES[0]
+    assert "{:>5}".format(unishox2.CompressedStr("ab")) == "   ab"
+    assert {lazy: 1}[LOG_LINES[0]] == 1
+    assert sorted([unishox2.CompressedStr("b"), "a"]) == ["a", "b"]
+    assert lazy != 42 and lazy != compressed
+
+    pickled = pickle.dumps(lazy)
+    assert LOG_LINES[0].encode("utf-8") not in pickled
+    assert pickle.loads(pickled) == lazy
+    assert unishox2.CompressedStr.from_compressed(compressed, original_size) == lazy
+
+    with pytest.raises(AttributeError):
+        lazy._data = b""
+    with pytest.raises(TypeError):
+        unishox2.CompressedStr(b"bytes")
+    with pytest.raises(TypeError):
+        unishox2.CompressedStr.from_compressed("text", 4)
+    with pytest.raises(ValueError):
+        unishox2.CompressedStr.from_compressed(compressed, -1)
+
+
+def test_sqlite_functions():
+    """
+    Verify SQL queries can compress, decompress and filter on compressed columns.
+    """
+    connection = sqlite3.connect(":memory:")
+    unishox2.sqlite.register(connection)
+    connection.execute("CREATE TABLE lines (data BLOB, size INTEGER)")
+    connection.executemany(
+        "INSERT INTO lines VALUES (unishox2_compress(:line), length(CAST(:line AS BLOB)))",
+        [{"line": line} for line in LOG_LINES],
+    )
+    rows = connection.execute(
+        "SELECT unishox2_decompress(data, size) FROM lines ORDER BY rowid"
+    ).fetchall()
+    assert [row[0] for row in rows] == LOG_LINES
+    matches = connection.execute(
+        "SELECT count(*) FROM lines WHERE unishox2_decompress(data, size) LIKE '%GET%'"
+    ).fetchone()[0]
+    assert matches == sum("GET" in line for line in LOG_LINES)
+    assert connection.execute(
+        "SELECT unishox2_compress(NULL), unishox2_decompress(NULL, 3)"
+    ).fetchone() == (None, None)
+
+    # The functions are deterministic, so they can be indexed on.
+    connection.execute(
+        "CREATE INDEX lines_text ON lines (unishox2_decompress(data, size))"
+    )
+
+    dictionary = unishox2.train(TRAINING_URLS)
+    unishox2.sqlite.register(connection, dictionary, prefix="urls")
+    assert connection.execute(
+        "SELECT urls_decompress(urls_compress(:url), length(CAST(:url AS BLOB)))",
+        {"url": TRAINING_URLS[0]},
+    ).fetchone() == (TRAINING_URLS[0],)
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_sqlite_rows(batch_size):
+    """
+    Verify rows compressed in batches for executemany() read back from a cursor.
+    """
+    rows = [
+        (i, line, None if i % 4 == 0 else BATCH_STRINGS[i % len(BATCH_STRINGS)], i * 2)
+        for i, line in enumerate(LOG_LINES)
+    ]
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE posts (id, title, title_size, body, body_size, n)")
+    connection.executemany(
+        "INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?)",
+        unishox2.sqlite.compress_rows(rows, [1, 2], threads=2, batch_size=batch_size),
+    )
+    stored = connection.execute("SELECT title, title_size FROM posts ORDER BY id")
+    assert [unishox2.decompress(data, size) for data, size in stored] == LOG_LINES
+    cursor = connection.execute("SELECT * FROM posts ORDER BY id")
+    assert (
+        list(unishox2.sqlite.decompress_rows(cursor, [1, 3], batch_size=batch_size))
+        == rows
+    )
+
+    with pytest.raises(ValueError):
+        next(unishox2.sqlite.compress_rows(rows, [1], batch_size=0))
+
+
+def test_concurrent_stress(enabled_stats):
+    """
+    Verify every entry point keeps giving the right results, and consistent counters, when
+    many threads call it at once, as they do in parallel without a GIL.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers, rounds = 8, 200
+    codec = unishox2.Codec(cache=unishox2.DecompressCache(max_entries=16))
+    expected = [unishox2.compress(line) for line in LOG_LINES]
+    caches = [unishox2.DecompressCache(max_entries=8), None]
+    barrier = threading.Barrier(workers)
+    unishox2.reset_stats()
+
+    def work(seed):
+        # Line contexts are stateful, so each thread codes its own stream.
+        compressor, decompressor = unishox2.LineContext(), unishox2.LineContext()
+        strings = 0
+        barrier.wait()
+        for i in range(rounds):
+            index = (seed * 7 + i * 13) % len(LOG_LINES)
+            line = LOG_LINES[index]
+            assert unishox2.compress(line) == expected[index]
+            assert unishox2.decompress(*expected[index]) == line
+            assert codec.decompress(*codec.compress(line)) == line
+            assert decompressor.decompress(*compressor.compress(line)) == line
+            strings += 2
+            if i % 20 == 0:
+                unishox2.set_decompress_cache(caches[(seed + i) % 2])
+                batch = LOG_LINES[index : index + 10]
+                compressed = unishox2.compress_many(batch, threads=2)
+                assert unishox2.decompress_many(compressed, threads=2) == batch
+                strings += len(batch)
+        return strings
+
+    with ThreadPoolExecutor(workers) as pool:
+        strings = sum(pool.map(work, range(workers)))
+    unishox2.set_decompress_cache(None)
+
+    # Strings answered from a cache are not decompressed, so not counted either.
+    stats = unishox2.stats()
+    hits = caches[0].hits + codec.cache.hits
+    assert stats["compress"]["calls"] == stats["decompress"]["calls"] + hits == strings
+    assert codec.cache.hits + codec.cache.misses == workers * rounds
+    assert len(codec.cache) <= 16
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 9), reason="every copy of the module shares one state"
+)
+def test_module_state_is_per_module():
+    """
+    Verify a second copy of the extension module keeps its own types, cache and statistics.
+    """
+    import importlib.util
+
+    from unishox2 import _unishox2
+
+    spec = importlib.util.spec_from_file_location(
+        _unishox2.__name__, _unishox2.__file__
+    )
+    other = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(other)
+    assert other.Codec is not unishox2.Codec
+    compressed, original_size = other.compress(LOG_LINES[0])
+    assert unishox2.decompress(compressed, original_size) == LOG_LINES[0]
+
+    other.set_stats_enabled(True)
+    other.Codec().decompress(compressed, original_size)
+    assert other.stats()["decompress"]["calls"] == 1
+    assert unishox2.stats()["enabled"] is False
+    other.set_decompress_cache(other.DecompressCache())
+    assert unishox2.get_decompress_cache() is None
+
+    # Objects of one copy are not accepted by the other.
+    with pytest.raises(TypeError):
+        other.set_decompress_cache(unishox2.DecompressCache())
+    with pytest.raises(TypeError):
+        unishox2.LineContext(other.Codec())
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 12), reason="needs subinterpreters with their own GIL"
+)
+def test_isolated_subinterpreter():
+    """
+    Verify the module imports and works in a subinterpreter with its own GIL.
+    """
+    import os
+
+    try:
+        import _interpreters as interpreters
+    except ImportError:
+        interpreters = pytest.importorskip("_xxsubinterpreters")
+
+    path = os.path.dirname(os.path.dirname(unishox2.__file__))
+    source = (
+        "import sys\n"
+        "sys.path.insert(0, %r)\n"
+        "import unishox2\n"
+        "assert unishox2.decompress(*unishox2.compress(%r)) == %r\n"
+    ) % (path, LOG_LINES[0], LOG_LINES[0])
+    if hasattr(interpreters, "exec"):
+        interpreter = interpreters.create("isolated")
+        try:
+            assert interpreters.exec(interpreter, source) is None
+        finally:
+            interpreters.destroy(interpreter)
+    else:
+        interpreter = interpreters.create(isolated=True)
+        try:
+            interpreters.run_string(interpreter, source)
+        finally:
+            interpreters.destroy(interpreter)
+
+
+@pytest.mark.skipif(
+    not sysconfig.get_config_var("Py_GIL_DISABLED"),
+    reason="needs a free-threaded build",
+)
+def test_import_keeps_gil_disabled():
+    """
+    Verify importing the module does not turn the GIL back on in a free-threaded build.
+    """
+    assert not sys._is_gil_enabled()
@@ -1,85 +1,3110 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <limits.h>
+#include <stddef.h>
+#include <stdint.h>
+#include <time.h>
 #include "./Unishox2/unishox2.h"
 
-static PyObject * py_unishox_compress(PyObject *self, PyObject *args) {
-    char *uncompressed_input;
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <pthread.h>
+#endif
+
+/*
+ * Every call into Unishox2 goes through the APIs that take an output buffer length, so the
+ * codec can never write past the buffers we hand it. setup.py turns this on for both the
+ * library and this module; building either one without it would break the calling convention.
+ */
+#if !UNISHOX_API_WITH_OUTPUT_LEN
+#error "unishox2_module.c must be built with UNISHOX_API_WITH_OUTPUT_LEN=1, see setup.py"
+#endif
+
+/*
+ * Interpreter support
+ *
+ * The module uses multi-phase initialization, and keeps its types, cache and statistics in a
+ * per-module state, so every (sub)interpreter importing it gets its own. Before Python 3.9,
+ * a type cannot find the module it was created by, so there every module object shares one
+ * state instead, created on first import and never freed.
+ *
+ * Nothing in here relies on the GIL for correctness. On free-threaded builds, objects with
+ * mutable state (caches and line contexts) are guarded by critical sections, and the module
+ * state by a mutex; with a GIL, all of that compiles away.
+ */
+#if PY_VERSION_HEX >= 0x03090000
+#define USX_PER_MODULE_STATE 1
+#else
+#define USX_PER_MODULE_STATE 0
+#endif
+
+#ifndef Py_BEGIN_CRITICAL_SECTION
+#define Py_BEGIN_CRITICAL_SECTION(op) {
+#define Py_END_CRITICAL_SECTION() }
+#endif
+
+#ifndef Py_TPFLAGS_IMMUTABLETYPE
+#define Py_TPFLAGS_IMMUTABLETYPE 0
+#endif
+
+/* Python 3.6 has no macro for it. */
+#ifndef PyDict_GET_SIZE
+#define PyDict_GET_SIZE(op) PyDict_Size(op)
+#endif
+
+/*
+ * Flags read on every call (such as whether statistics are enabled) are read without the
+ * mutex, so threads only ever queue on it when there is something to count. On free-threaded
+ * builds they are read and written atomically, with no ordering, which is all a flag needs.
+ */
+#ifdef Py_GIL_DISABLED
+#define USX_MUTEX PyMutex mutex;
+#define USX_LOCK(owner) PyMutex_Lock(&(owner)->mutex)
+#define USX_UNLOCK(owner) PyMutex_Unlock(&(owner)->mutex)
+#if defined(_MSC_VER) && defined(_M_ARM64)
+#define USX_LOAD_FLAG(flag) ((int) __iso_volatile_load32((const volatile __int32 *) &(flag)))
+#define USX_STORE_FLAG(flag, value) __iso_volatile_store32((volatile __int32 *) &(flag), (value))
+#elif defined(_MSC_VER)
+/* Aligned 32-bit accesses are atomic on x86 and x64. */
+#define USX_LOAD_FLAG(flag) (*(const volatile int *) &(flag))
+#define USX_STORE_FLAG(flag, value) (*(volatile int *) &(flag) = (value))
+#else
+#define USX_LOAD_FLAG(flag) __atomic_load_n(&(flag), __ATOMIC_RELAXED)
+#define USX_STORE_FLAG(flag, value) __atomic_store_n(&(flag), (value), __ATOMIC_RELAXED)
+#endif
+#else
+#define USX_MUTEX
+#define USX_LOCK(owner)
+#define USX_UNLOCK(owner)
+#define USX_LOAD_FLAG(flag) (flag)
+#define USX_STORE_FLAG(flag, value) ((flag) = (value))
+#endif
+
+/*
+ * Instances of heap types own a reference to their type from Python 3.8, which their dealloc
+ * has to release, and from 3.9 their traverse has to visit.
+ */
+#if PY_VERSION_HEX >= 0x03080000
+#define USX_RELEASE_TYPE(type) Py_DECREF(type)
+#else
+#define USX_RELEASE_TYPE(type)
+#endif
+
+#if PY_VERSION_HEX >= 0x03090000
+#define USX_VISIT_TYPE(self) Py_VISIT(Py_TYPE(self))
+#else
+#define USX_VISIT_TYPE(self)
+#endif
+
+static struct PyModuleDef unishox2_module;
+
+/*
+ * Upper limit for the number of native worker threads a single batch call may use.
+ */
+#define USX_MAX_THREADS 256
+
+/*
+ * Inputs at least this large are (de)compressed with the GIL released by the *_into APIs.
+ * Below it, dropping and re-taking the GIL costs more than it could ever win back.
+ */
+#define USX_RELEASE_GIL_SIZE 4096
+
+/*
+ * The four tables Unishox2 codes with. Module-level functions use the default preset, while
+ * each Codec object carries its own. bits_per_byte caches usx_max_bits_per_byte() for them.
+ */
+typedef struct {
+    const unsigned char *hcodes;
+    const unsigned char *hcode_lens;
+    const char **freq_seq;
+    const char **templates;
+    int bits_per_byte;
+} usx_tables;
+
+#define USX_HCODE_COUNT 5
+#define USX_FREQ_SEQ_COUNT 6
+#define USX_TEMPLATE_COUNT 5
+
+static usx_tables usx_default_tables = {USX_PSET_DFLT, 0};
+
+/*
+ * The number of bits encodeCount() spends on a count.
+ */
+static int usx_count_bits(Py_ssize_t count) {
+    return count < 4 ? 3 : count < 20 ? 6 : count < 148 ? 10 : count < 2196 ? 15 : 20;
+}
+
+/*
+ * The largest number of output bits Unishox2 can spend on a single input byte, for a given
+ * set of tables (with hcode lengths A = alpha, S = symbol, N = number). Each case is one step
+ * of the encoder loop in unishox2_compress_lines(), at its most expensive:
+ *
+ * - A byte which is not valid UTF-8 (or an unprintable ASCII byte) is escaped: possibly
+ *   leaving upper-case mode (2 + A bits) or a unicode run (a 7 bit switch code), then the
+ *   number set hcode, a 2 bit nibble escape, a 5 bit binary marker, a 3 bit count of 1 and
+ *   the 8 raw bits.
+ * - An upper case letter after a unicode run switches back to alpha twice (7 + A, 2 + A),
+ *   may enter upper-case mode (2 + A) and then needs its vertical code (up to 8 bits).
+ * - Any other single character (or frequent sequence) may leave upper-case mode or a
+ *   unicode run, switch to its set and spend a vertical code.
+ * - A unicode character is at least 2 bytes long, and costs at most three set switches,
+ *   a 3 bit space marker and a 27 bit delta code.
+ * - A template is used once more than 2/3 of it matches, and costs a nibble escape, a 1 bit
+ *   marker, a step code of up to 4 bits, the count of unmatched characters and up to 4 bits
+ *   per matched character. Short custom templates can make this the most expensive case.
+ *
+ * Repeats, hex runs and UUIDs always cover several input bytes at once, and so are cheaper
+ * per byte than the cases above.
+ */
+static int usx_max_bits_per_byte(const usx_tables *tables) {
+    int alpha = tables->hcode_lens[0], sym = tables->hcode_lens[1], num = tables->hcode_lens[2];
+    int leave_state = alpha + 4 > 7 ? alpha + 4 : 7;
+    int bits = leave_state + num + 2 + 5 + 3 + 8;
+    int upper = 7 + alpha + 2 + alpha + 2 + alpha + 8;
+    int other = leave_state + (sym > num ? sym : num) + 8;
+    int unicode = (3 * (alpha + 2) + 3 + 27 + 1) / 2;
+    if (upper > bits) {
+        bits = upper;
+    }
+    if (other > bits) {
+        bits = other;
+    }
+    if (unicode > bits) {
+        bits = unicode;
+    }
+    for (int i = 0; tables->templates != NULL && i < USX_TEMPLATE_COUNT; i++) {
+        if (tables->templates[i] == NULL) {
+            continue;
+        }
+        Py_ssize_t template_len = (Py_ssize_t) strlen(tables->templates[i]);
+        Py_ssize_t matched = template_len * 2 / 3 + 1;
+        if (matched > template_len) {
+            matched = template_len;
+        }
+        int cost = 7 + num + 2 + 1 + 4 + usx_count_bits(template_len - matched) + 4 * (int) matched;
+        int per_byte = (int) ((cost + matched - 1) / matched);
+        if (per_byte > bits) {
+            bits = per_byte;
+        }
+    }
+    return bits;
+}
+
+/*
+ * Worst case size, in bytes, of the compressed form of `len` bytes of input. Unishox2 only
+ * spends whole bytes on the bits it emits, plus the leading magic bit(s).
+ */
+static Py_ssize_t usx_compress_bound(Py_ssize_t len, const usx_tables *tables) {
+    Py_ssize_t bits_per_byte = tables->bits_per_byte;
+    if (len > (PY_SSIZE_T_MAX - UNISHOX_MAGIC_BIT_LEN - 7) / bits_per_byte) {
+        return -1;
+    }
+    return (len * bits_per_byte + UNISHOX_MAGIC_BIT_LEN + 7) / 8;
+}
+
+/*
+ * Unishox2 works with int lengths. Output buffers larger than that are simply not used
+ * past INT_MAX - 1 bytes, since no single string can need more.
+ */
+static int usx_output_len(Py_ssize_t size) {
+    return size > INT_MAX - 1 ? INT_MAX - 1 : (int) size;
+}
+
+static int usx_compress(const usx_tables *tables, const char *in, int len, char *out, int olen) {
+    return unishox2_compress(in, len, out, olen, tables->hcodes, tables->hcode_lens,
+                             tables->freq_seq, tables->templates);
+}
+
+static int usx_decompress(const usx_tables *tables, const char *in, int len, char *out, int olen) {
+    return unishox2_decompress(in, len, out, olen, tables->hcodes, tables->hcode_lens,
+                               tables->freq_seq, tables->templates);
+}
+
+/*
+ * Single-string calls are cheap enough that packing their arguments into a tuple, and parsing
+ * it back out, costs about as much as coding a short string. On Python 3.7 and later they take
+ * a METH_FASTCALL argument array instead. On 3.6, where that convention was still private,
+ * they unpack the usual argument tuple into the same array and count.
+ */
+#if PY_VERSION_HEX >= 0x03070000
+#define USX_METH_FASTCALL METH_FASTCALL
+#define USX_FASTCALL_PARAMS PyObject *const *args, Py_ssize_t nargs
+#define USX_FASTCALL_UNPACK
+#else
+#define USX_METH_FASTCALL METH_VARARGS
+#define USX_FASTCALL_PARAMS PyObject *arg_tuple
+#define USX_FASTCALL_UNPACK \
+    PyObject *const *args = &PyTuple_GET_ITEM(arg_tuple, 0); \
+    Py_ssize_t nargs = PyTuple_GET_SIZE(arg_tuple);
+#endif
+
+/*
+ * Parses fastcall arguments with a PyArg_ParseTuple() format. The fast paths only fall back to
+ * this for arguments they do not handle themselves, so conversions and error messages stay
+ * exactly those of the format.
+ */
+static int usx_parse_args(PyObject *const *args, Py_ssize_t nargs, const char *format, ...) {
+    PyObject *tuple = PyTuple_New(nargs);
+    if (tuple == NULL) {
+        return 0;
+    }
+    for (Py_ssize_t i = 0; i < nargs; i++) {
+        Py_INCREF(args[i]);
+        PyTuple_SET_ITEM(tuple, i, args[i]);
+    }
+    va_list vargs;
+    va_start(vargs, format);
+    int parsed = PyArg_VaParse(tuple, format, vargs);
+    va_end(vargs);
+    Py_DECREF(tuple);
+    return parsed;
+}
+
+/*
+ * The UTF-8 form of a str. Compact ASCII strings already are UTF-8, so their data is used as
+ * it is, without looking up (or validating and building) the UTF-8 copy other strings cache.
+ */
+static const char * usx_str_utf8(PyObject *string, Py_ssize_t *size) {
+    if (PyUnicode_IS_COMPACT_ASCII(string)) {
+        *size = PyUnicode_GET_LENGTH(string);
+        return (const char *) PyUnicode_DATA(string);
+    }
+    return PyUnicode_AsUTF8AndSize(string, size);
+}
+
+static int usx_is_ascii(const char *data, Py_ssize_t size) {
+    const unsigned char *bytes = (const unsigned char *) data;
+    Py_ssize_t i = 0;
+    for (; i + 8 <= size; i += 8) {
+        uint64_t word;
+        memcpy(&word, bytes + i, 8);
+        if (word & 0x8080808080808080ULL) {
+            return 0;
+        }
+    }
+    for (; i < size; i++) {
+        if (bytes[i] & 0x80) {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+/*
+ * Decompression cache
+ *
+ * A DecompressCache maps compressed bytes to the strings they decompress to, so hot values
+ * skip the allocation and the decode entirely. It is bounded both by its number of entries
+ * and by their total size (compressed plus UTF-8 bytes), evicting the least recently used
+ * entry first. Entries live in a dict for lookup, and in a doubly linked list from newest to
+ * oldest for eviction.
+ *
+ * Operations never call back into Python code (keys are exact bytes objects, and values are
+ * str), and each one runs in a critical section on its cache, so each is atomic with respect
+ * to other threads, with or without a GIL.
+ */
+#define USX_DEFAULT_CACHE_ENTRIES 4096
+#define USX_DEFAULT_CACHE_BYTES (8 * 1024 * 1024)
+
+typedef struct usx_cache_entry {
+    PyObject_HEAD
+    PyObject *key;
+    PyObject *value;
+    Py_ssize_t utf8_size;
+    Py_ssize_t nbytes;
+    struct usx_cache_entry *newer;
+    struct usx_cache_entry *older;
+} CacheEntryObject;
+
+static void CacheEntry_dealloc(CacheEntryObject *self) {
+    PyTypeObject *type = Py_TYPE(self);
+    PyObject_GC_UnTrack(self);
+    Py_XDECREF(self->key);
+    Py_XDECREF(self->value);
+    type->tp_free((PyObject *) self);
+    USX_RELEASE_TYPE(type);
+}
+
+static int CacheEntry_traverse(CacheEntryObject *self, visitproc visit, void *arg) {
+    USX_VISIT_TYPE(self);
+    return 0;
+}
+
+static PyType_Slot CacheEntry_slots[] = {
+    {Py_tp_dealloc, (void *) CacheEntry_dealloc},
+    {Py_tp_traverse, (void *) CacheEntry_traverse},
+    {0, NULL} /* Sentinel */
+};
+
+static PyType_Spec CacheEntry_spec = {
+    "unishox2._CacheEntry",
+    sizeof(CacheEntryObject),
+    0,
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_IMMUTABLETYPE | Py_TPFLAGS_HAVE_GC,
+    CacheEntry_slots,
+};
+
+typedef struct {
+    PyObject_HEAD
+    /* Maps each compressed bytes object to its CacheEntryObject, which the dict owns. */
+    PyObject *entries;
+    CacheEntryObject *newest;
+    CacheEntryObject *oldest;
+    Py_ssize_t max_entries;
+    Py_ssize_t max_bytes;
+    Py_ssize_t nbytes;
+    unsigned long long hits;
+    unsigned long long misses;
+    unsigned long long evictions;
+    /* The type of the entries, from the same module as the cache. */
+    PyTypeObject *entry_type;
+} DecompressCacheObject;
+
+static PyTypeObject * usx_cache_entry_type(PyTypeObject *cache_type);
+
+static void usx_cache_unlink(DecompressCacheObject *cache, CacheEntryObject *entry) {
+    if (entry->newer != NULL) {
+        entry->newer->older = entry->older;
+    } else {
+        cache->newest = entry->older;
+    }
+    if (entry->older != NULL) {
+        entry->older->newer = entry->newer;
+    } else {
+        cache->oldest = entry->newer;
+    }
+    entry->newer = entry->older = NULL;
+}
+
+static void usx_cache_link_newest(DecompressCacheObject *cache, CacheEntryObject *entry) {
+    entry->newer = NULL;
+    entry->older = cache->newest;
+    if (cache->newest != NULL) {
+        cache->newest->newer = entry;
+    } else {
+        cache->oldest = entry;
+    }
+    cache->newest = entry;
+}
+
+/*
+ * Drops an entry. It stays alive until its dict reference is gone, which is the last one.
+ */
+static int usx_cache_remove(DecompressCacheObject *cache, CacheEntryObject *entry) {
+    usx_cache_unlink(cache, entry);
+    cache->nbytes -= entry->nbytes;
+    return PyDict_DelItem(cache->entries, entry->key);
+}
+
+/*
+ * Returns a new reference to the cached string for `key`, or NULL (without an exception) on
+ * a miss. A cached string only counts if it fits in `original_size`, since decompress() has to
+ * raise otherwise.
+ */
+static PyObject * usx_cache_get_locked(DecompressCacheObject *cache, PyObject *key, int original_size) {
+    CacheEntryObject *entry = (CacheEntryObject *) PyDict_GetItem(cache->entries, key);
+    if (entry == NULL || entry->utf8_size > original_size) {
+        cache->misses++;
+        return NULL;
+    }
+    cache->hits++;
+    if (entry != cache->newest) {
+        usx_cache_unlink(cache, entry);
+        usx_cache_link_newest(cache, entry);
+    }
+    Py_INCREF(entry->value);
+    return entry->value;
+}
+
+static PyObject * usx_cache_get(DecompressCacheObject *cache, PyObject *key, int original_size) {
+    PyObject *value;
+    Py_BEGIN_CRITICAL_SECTION(cache);
+    value = usx_cache_get_locked(cache, key, original_size);
+    Py_END_CRITICAL_SECTION();
+    return value;
+}
+
+/*
+ * Caches a freshly decompressed string, evicting the oldest entries to make room. A cache is
+ * only ever an optimization, so failing to add an entry is not an error.
+ */
+static void usx_cache_put_locked(DecompressCacheObject *cache, PyObject *key, PyObject *value,
+                                 Py_ssize_t utf8_size) {
+    Py_ssize_t nbytes = PyBytes_GET_SIZE(key) + utf8_size;
+    if (nbytes > cache->max_bytes || PyDict_GetItem(cache->entries, key) != NULL) {
+        return;
+    }
+    CacheEntryObject *entry = (CacheEntryObject *) cache->entry_type->tp_alloc(cache->entry_type, 0);
+    if (entry == NULL) {
+        PyErr_Clear();
+        return;
+    }
+    Py_INCREF(key);
+    Py_INCREF(value);
+    entry->key = key;
+    entry->value = value;
+    entry->utf8_size = utf8_size;
+    entry->nbytes = nbytes;
+    entry->newer = entry->older = NULL;
+    int added = PyDict_SetItem(cache->entries, key, (PyObject *) entry);
+    Py_DECREF(entry);
+    if (added < 0) {
+        PyErr_Clear();
+        return;
+    }
+    usx_cache_link_newest(cache, entry);
+    cache->nbytes += nbytes;
+
+    while (PyDict_GET_SIZE(cache->entries) > cache->max_entries || cache->nbytes > cache->max_bytes) {
+        if (usx_cache_remove(cache, cache->oldest) < 0) {
+            PyErr_Clear();
+            return;
+        }
+        cache->evictions++;
+    }
+}
+
+static void usx_cache_put(DecompressCacheObject *cache, PyObject *key, PyObject *value, Py_ssize_t utf8_size) {
+    Py_BEGIN_CRITICAL_SECTION(cache);
+    usx_cache_put_locked(cache, key, value, utf8_size);
+    Py_END_CRITICAL_SECTION();
+}
+
+static void usx_cache_clear(DecompressCacheObject *cache) {
+    cache->newest = cache->oldest = NULL;
+    cache->nbytes = 0;
+    PyDict_Clear(cache->entries);
+}
+
+static PyObject * DecompressCache_new(PyTypeObject *type, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"max_entries", "max_bytes", NULL};
+    Py_ssize_t max_entries = USX_DEFAULT_CACHE_ENTRIES;
+    Py_ssize_t max_bytes = USX_DEFAULT_CACHE_BYTES;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|nn:DecompressCache", kwlist, &max_entries, &max_bytes)) {
+        return NULL;
+    }
+    if (max_entries < 1 || max_bytes < 1) {
+        PyErr_SetString(PyExc_ValueError, "max_entries and max_bytes must be positive");
+        return NULL;
+    }
+    PyTypeObject *entry_type = usx_cache_entry_type(type);
+    if (entry_type == NULL) {
+        return NULL;
+    }
+    DecompressCacheObject *self = (DecompressCacheObject *) type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    Py_INCREF(entry_type);
+    self->entry_type = entry_type;
+    self->entries = PyDict_New();
+    if (self->entries == NULL) {
+        Py_DECREF(self);
+        return NULL;
+    }
+    self->max_entries = max_entries;
+    self->max_bytes = max_bytes;
+    return (PyObject *) self;
+}
+
+static void DecompressCache_dealloc(DecompressCacheObject *self) {
+    PyTypeObject *type = Py_TYPE(self);
+    PyObject_GC_UnTrack(self);
+    Py_XDECREF(self->entries);
+    Py_XDECREF(self->entry_type);
+    type->tp_free((PyObject *) self);
+    USX_RELEASE_TYPE(type);
+}
+
+static int DecompressCache_traverse(DecompressCacheObject *self, visitproc visit, void *arg) {
+    USX_VISIT_TYPE(self);
+    Py_VISIT(self->entries);
+    Py_VISIT(self->entry_type);
+    return 0;
+}
+
+static int DecompressCache_tp_clear(DecompressCacheObject *self) {
+    if (self->entries != NULL) {
+        usx_cache_clear(self);
+    }
+    return 0;
+}
+
+static PyObject * DecompressCache_repr(DecompressCacheObject *self) {
+    Py_ssize_t count, nbytes;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    count = PyDict_GET_SIZE(self->entries);
+    nbytes = self->nbytes;
+    Py_END_CRITICAL_SECTION();
+    return PyUnicode_FromFormat("<%s %zd/%zd entries, %zd/%zd bytes>", Py_TYPE(self)->tp_name,
+                                count, self->max_entries, nbytes, self->max_bytes);
+}
+
+static Py_ssize_t DecompressCache_length(DecompressCacheObject *self) {
+    Py_ssize_t count;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    count = PyDict_GET_SIZE(self->entries);
+    Py_END_CRITICAL_SECTION();
+    return count;
+}
+
+static PyObject * DecompressCache_clear(DecompressCacheObject *self, PyObject *ignored) {
+    Py_BEGIN_CRITICAL_SECTION(self);
+    usx_cache_clear(self);
+    Py_END_CRITICAL_SECTION();
+    Py_RETURN_NONE;
+}
+
+static PyObject * DecompressCache_get_counter(DecompressCacheObject *self, void *closure) {
+    unsigned long long value;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    value = *(unsigned long long *) ((char *) self + (size_t) closure);
+    Py_END_CRITICAL_SECTION();
+    return PyLong_FromUnsignedLongLong(value);
+}
+
+static PyObject * DecompressCache_get_size(DecompressCacheObject *self, void *closure) {
+    Py_ssize_t value;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    value = *(Py_ssize_t *) ((char *) self + (size_t) closure);
+    Py_END_CRITICAL_SECTION();
+    return PyLong_FromSsize_t(value);
+}
+
+static PyMethodDef DecompressCache_methods[] = {
+    {"clear", (PyCFunction) DecompressCache_clear, METH_NOARGS,
+     "Drops every entry. The hit, miss and eviction counters keep counting."},
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+static PyGetSetDef DecompressCache_getset[] = {
+    {"hits", (getter) DecompressCache_get_counter, NULL, "The number of lookups answered from the cache.",
+     (void *) offsetof(DecompressCacheObject, hits)},
+    {"misses", (getter) DecompressCache_get_counter, NULL, "The number of lookups which had to decompress.",
+     (void *) offsetof(DecompressCacheObject, misses)},
+    {"evictions", (getter) DecompressCache_get_counter, NULL, "The number of entries evicted to make room.",
+     (void *) offsetof(DecompressCacheObject, evictions)},
+    {"nbytes", (getter) DecompressCache_get_size, NULL, "The total size of the entries, compressed plus UTF-8.",
+     (void *) offsetof(DecompressCacheObject, nbytes)},
+    {"max_entries", (getter) DecompressCache_get_size, NULL, "The largest number of entries kept.",
+     (void *) offsetof(DecompressCacheObject, max_entries)},
+    {"max_bytes", (getter) DecompressCache_get_size, NULL, "The largest total size of the entries kept.",
+     (void *) offsetof(DecompressCacheObject, max_bytes)},
+    {NULL, NULL, NULL, NULL, NULL} /* Sentinel */
+};
+
+static PyType_Slot DecompressCache_slots[] = {
+    {Py_tp_dealloc, (void *) DecompressCache_dealloc},
+    {Py_tp_traverse, (void *) DecompressCache_traverse},
+    {Py_tp_clear, (void *) DecompressCache_tp_clear},
+    {Py_tp_repr, (void *) DecompressCache_repr},
+    {Py_sq_length, (void *) DecompressCache_length},
+    {Py_tp_methods, DecompressCache_methods},
+    {Py_tp_getset, DecompressCache_getset},
+    {Py_tp_new, (void *) DecompressCache_new},
+    {Py_tp_doc, "DecompressCache(max_entries=4096, max_bytes=8388608)\n--\n\n"
+                "A thread-safe LRU cache of decompressed strings, keyed on their compressed bytes.\n\n"
+                "Args:\n"
+                "    max_entries: The largest number of strings to keep.\n"
+                "    max_bytes: The largest total size to keep, counting compressed plus UTF-8 bytes.\n\n"
+                "Use it with unishox2.set_decompress_cache() or Codec(cache=...). Only data passed as\n"
+                "bytes is cached, and a cache must only be shared by codecs with the same tables."},
+    {0, NULL} /* Sentinel */
+};
+
+static PyType_Spec DecompressCache_spec = {
+    "unishox2.DecompressCache",
+    sizeof(DecompressCacheObject),
+    0,
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_IMMUTABLETYPE | Py_TPFLAGS_HAVE_GC,
+    DecompressCache_slots,
+};
+
+/*
+ * Statistics
+ *
+ * When enabled, every compress and decompress call (including the *_into and *_many variants)
+ * is counted: calls, bytes in and out, how often data expanded instead of shrinking, wall
+ * time, and log-scaled histograms of latency and compression ratio. The counters are only
+ * ever touched with the GIL held (or, on free-threaded builds, their mutex), and while
+ * disabled each call costs one branch on the enabled flag.
+ */
+#define USX_LATENCY_BUCKETS 25
+#define USX_RATIO_BUCKETS 18
+
+/* Latency bucket i counts calls faster than 2**(i + USX_LATENCY_SHIFT) ns, the last any slower. */
+#define USX_LATENCY_SHIFT 8
+
+/* The upper bound of each ratio bucket, 2**(i / 4) from 1/8 to 2, and then anything larger. */
+static const double usx_ratio_bounds[USX_RATIO_BUCKETS - 1] = {
+    0.125, 0.1487, 0.1768, 0.2102, 0.25, 0.2973, 0.3536, 0.4204, 0.5,
+    0.5946, 0.7071, 0.8409, 1.0, 1.1892, 1.4142, 1.6818, 2.0,
+};
+
+typedef struct {
+    unsigned long long calls;
+    unsigned long long bytes_in;
+    unsigned long long bytes_out;
+    unsigned long long expansions;
+    unsigned long long nanoseconds;
+    unsigned long long max_allocation;
+    /* Calls answered from a decompression cache, which code nothing and so count nowhere else. */
+    unsigned long long cache_hits;
+    unsigned long long latency[USX_LATENCY_BUCKETS];
+    unsigned long long ratio[USX_RATIO_BUCKETS];
+} usx_op_stats;
+
+typedef struct {
+    int enabled;
+    usx_op_stats compress;
+    usx_op_stats decompress;
+    /* Called as hook(function, seconds, bytes_in, bytes_out) for calls of at least slow_ns. */
+    PyObject *slow_hook;
+    int64_t slow_ns;
+    USX_MUTEX
+} usx_stats;
+
+static int64_t usx_now_ns(void) {
+#ifdef _WIN32
+    static LARGE_INTEGER frequency;
+    LARGE_INTEGER now;
+    if (frequency.QuadPart == 0) {
+        QueryPerformanceFrequency(&frequency);
+    }
+    QueryPerformanceCounter(&now);
+    return (int64_t) ((double) now.QuadPart * 1e9 / (double) frequency.QuadPart);
+#else
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (int64_t) now.tv_sec * 1000000000 + now.tv_nsec;
+#endif
+}
+
+/*
+ * Returns the time a call starts at, or 0 if statistics are disabled. Calls pass it back to
+ * usx_stats_finish(), so toggling statistics halfway through a call is harmless.
+ */
+static int64_t usx_stats_start(usx_stats *stats) {
+    return USX_LOAD_FLAG(stats->enabled) ? usx_now_ns() : 0;
+}
+
+/*
+ * Counts one string coded by an operation. The ratio is always compressed over original size.
+ */
+static void usx_stats_add(usx_stats *stats, usx_op_stats *op, Py_ssize_t bytes_in, Py_ssize_t bytes_out) {
+    Py_ssize_t original = op == &stats->compress ? bytes_in : bytes_out;
+    Py_ssize_t compressed = op == &stats->compress ? bytes_out : bytes_in;
+    op->calls++;
+    op->bytes_in += bytes_in;
+    op->bytes_out += bytes_out;
+    if (compressed > original) {
+        op->expansions++;
+    }
+    if (original > 0) {
+        double ratio = (double) compressed / (double) original;
+        int bucket = 0;
+        while (bucket < USX_RATIO_BUCKETS - 1 && ratio > usx_ratio_bounds[bucket]) {
+            bucket++;
+        }
+        op->ratio[bucket]++;
+    }
+}
+
+/*
+ * Records the time a call took, and the largest buffer it allocated. Calls coding a single
+ * string are also counted here, and go into the latency histogram. Calls at least as slow as
+ * the slow call threshold are reported to the hook, whose exceptions are printed and then
+ * ignored.
+ */
+static void usx_stats_finish(usx_stats *stats, usx_op_stats *op, const char *function, int64_t start, int single,
+                             Py_ssize_t bytes_in, Py_ssize_t bytes_out, Py_ssize_t allocation) {
+    int64_t elapsed = usx_now_ns() - start;
+    if (elapsed < 0) {
+        elapsed = 0;
+    }
+    USX_LOCK(stats);
+    op->nanoseconds += (unsigned long long) elapsed;
+    if ((unsigned long long) allocation > op->max_allocation) {
+        op->max_allocation = (unsigned long long) allocation;
+    }
+    if (single) {
+        int bucket = 0;
+        while (bucket < USX_LATENCY_BUCKETS - 1 && (elapsed >> (bucket + USX_LATENCY_SHIFT)) != 0) {
+            bucket++;
+        }
+        op->latency[bucket]++;
+        usx_stats_add(stats, op, bytes_in, bytes_out);
+    }
+    /* The hook may replace itself, so keep it alive for the duration of the call. */
+    PyObject *hook = stats->slow_hook;
+    if (hook != NULL && elapsed >= stats->slow_ns) {
+        Py_INCREF(hook);
+    } else {
+        hook = NULL;
+    }
+    USX_UNLOCK(stats);
+
+    if (hook != NULL) {
+        PyObject *result = PyObject_CallFunction(hook, "sdnn", function, (double) elapsed / 1e9, bytes_in, bytes_out);
+        if (result == NULL) {
+            PyErr_WriteUnraisable(hook);
+        }
+        Py_XDECREF(result);
+        Py_DECREF(hook);
+    }
+}
+
+static PyObject * usx_histogram(const unsigned long long *counts, int bucket_count, const double *bounds) {
+    PyObject *histogram = PyTuple_New(bucket_count);
+    if (histogram == NULL) {
+        return NULL;
+    }
+    for (int i = 0; i < bucket_count; i++) {
+        double bound = i == bucket_count - 1 ? HUGE_VAL
+                                             : bounds != NULL ? bounds[i] : (double) (1LL << (i + USX_LATENCY_SHIFT)) / 1e9;
+        PyObject *pair = Py_BuildValue("(dK)", bound, counts[i]);
+        if (pair == NULL) {
+            Py_DECREF(histogram);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(histogram, i, pair);
+    }
+    return histogram;
+}
+
+static PyObject * usx_op_stats_dict(const usx_op_stats *op) {
+    PyObject *latency = usx_histogram(op->latency, USX_LATENCY_BUCKETS, NULL);
+    if (latency == NULL) {
+        return NULL;
+    }
+    PyObject *ratio = usx_histogram(op->ratio, USX_RATIO_BUCKETS, usx_ratio_bounds);
+    if (ratio == NULL) {
+        Py_DECREF(latency);
+        return NULL;
+    }
+    return Py_BuildValue("{sKsKsKsKsdsKsKsNsN}", "calls", op->calls, "bytes_in", op->bytes_in,
+                         "bytes_out", op->bytes_out, "expansions", op->expansions,
+                         "seconds", (double) op->nanoseconds / 1e9, "max_allocation", op->max_allocation,
+                         "cache_hits", op->cache_hits, "latency", latency, "ratio", ratio);
+}
+
+/*
+ * Module state
+ *
+ * Everything one import of the module owns: its types, the cache of the module-level
+ * decompress() and its statistics. Codecs point at the statistics of the module their type
+ * came from, which their type keeps alive.
+ */
+typedef struct {
+    PyTypeObject *CacheEntryType;
+    PyTypeObject *DecompressCacheType;
+    PyTypeObject *CodecType;
+    PyTypeObject *LineContextType;
+    /* The cache used by the module-level decompress(), if any. Guarded by the mutex. */
+    DecompressCacheObject *cache;
+    usx_stats stats;
+    USX_MUTEX
+} usx_state;
+
+#if USX_PER_MODULE_STATE
+#define USX_MODULE_STATE_SIZE ((Py_ssize_t) sizeof(usx_state))
+#else
+#define USX_MODULE_STATE_SIZE 0
+static usx_state usx_shared_state;
+#endif
+
+static usx_state * usx_get_state(PyObject *module) {
+#if USX_PER_MODULE_STATE
+    return (usx_state *) PyModule_GetState(module);
+#else
+    return &usx_shared_state;
+#endif
+}
+
+/*
+ * The state of the module a type (or a subclass of it) was created by.
+ */
+static usx_state * usx_type_state(PyTypeObject *type) {
+#if PY_VERSION_HEX >= 0x030B0000
+    PyObject *module = PyType_GetModuleByDef(type, &unishox2_module);
+    return module == NULL ? NULL : usx_get_state(module);
+#elif USX_PER_MODULE_STATE
+    for (PyTypeObject *base = type; base != NULL; base = base->tp_base) {
+        PyObject *module = base->tp_flags & Py_TPFLAGS_HEAPTYPE ? ((PyHeapTypeObject *) base)->ht_module : NULL;
+        if (module != NULL && PyModule_Check(module) && PyModule_GetDef(module) == &unishox2_module) {
+            return usx_get_state(module);
+        }
+    }
+    PyErr_Format(PyExc_TypeError, "%.200s is not a unishox2 type", type->tp_name);
+    return NULL;
+#else
+    return &usx_shared_state;
+#endif
+}
+
+static PyTypeObject * usx_cache_entry_type(PyTypeObject *cache_type) {
+    usx_state *state = usx_type_state(cache_type);
+    return state == NULL ? NULL : state->CacheEntryType;
+}
+
+/*
+ * Returns a new reference to the cache of the module-level decompress(), or NULL if it has
+ * none.
+ */
+static DecompressCacheObject * usx_state_cache(usx_state *state) {
+    USX_LOCK(state);
+    DecompressCacheObject *cache = state->cache;
+    Py_XINCREF(cache);
+    USX_UNLOCK(state);
+    return cache;
+}
+
+/*
+ * Outputs up to this large are compressed into a buffer on the stack, and then copied into a
+ * bytes object of the exact size. Larger ones are compressed straight into a bytes object of
+ * the worst-case size, which is then shrunk in place.
+ */
+#define USX_STACK_OUTPUT_SIZE 512
+
+static PyObject * usx_compress_object(usx_stats *stats, const usx_tables *tables, PyObject *const *args,
+                                      Py_ssize_t nargs) {
+    const char *uncompressed_input;
     Py_ssize_t uncompressed_input_size;
     /*
      * ":compress" leads to Python referencing this function correctly in the event of
-     * an error during PyArg_ParseTuple, like when passing a list instead of a string.
+     * an error during parsing, like when passing a list instead of a string.
      */
-    if (!PyArg_ParseTuple(args, "s#:compress", &uncompressed_input, &uncompressed_input_size)) {
+    if (nargs == 1 && PyUnicode_Check(args[0])) {
+        uncompressed_input = usx_str_utf8(args[0], &uncompressed_input_size);
+        if (uncompressed_input == NULL) {
+            return NULL;
+        }
+    } else if (!usx_parse_args(args, nargs, "s#:compress", &uncompressed_input, &uncompressed_input_size)) {
+        return NULL;
+    }
+    if (uncompressed_input_size > INT_MAX / 8) {
+        PyErr_SetString(PyExc_OverflowError, "input is too large to compress");
+        return NULL;
+    }
+
+    /*
+     * We cannot say certainly that the compressed output will be smaller, so allocate
+     * for the worst case that Unishox2 can produce for this many bytes.
+     */
+    int64_t start = usx_stats_start(stats);
+    int output_buffer_size = (int) usx_compress_bound(uncompressed_input_size, tables);
+    char stack_buffer[USX_STACK_OUTPUT_SIZE];
+    char *output_buffer = stack_buffer;
+    PyObject *compressed = NULL;
+    Py_ssize_t allocation = 0;
+    if (output_buffer_size > USX_STACK_OUTPUT_SIZE) {
+        allocation = output_buffer_size;
+        compressed = PyBytes_FromStringAndSize(NULL, output_buffer_size);
+        if (compressed == NULL) {
+            return NULL;
+        }
+        output_buffer = PyBytes_AS_STRING(compressed);
+    }
+    int compressed_size = usx_compress(tables, uncompressed_input, (int) uncompressed_input_size,
+                                       output_buffer, output_buffer_size);
+    if (compressed_size > output_buffer_size) {
+        Py_XDECREF(compressed);
+        PyErr_SetString(PyExc_SystemError, "unishox2 exceeded its compress_bound()");
+        return NULL;
+    }
+
+    /*
+     * Yay. Compression done. No matter how big our buffer is, the "compressed_size" tells us
+     * where the actual data stops. That's where we mark the end.
+     */
+    if (compressed == NULL) {
+        compressed = PyBytes_FromStringAndSize(stack_buffer, compressed_size);
+    } else {
+        _PyBytes_Resize(&compressed, compressed_size);
+    }
+    if (compressed == NULL) {
+        return NULL;
+    }
+    PyObject *original_size = PyLong_FromSsize_t(uncompressed_input_size);
+    if (original_size == NULL) {
+        Py_DECREF(compressed);
+        return NULL;
+    }
+    PyObject *py_multi_object = PyTuple_New(2);
+    if (py_multi_object == NULL) {
+        Py_DECREF(compressed);
+        Py_DECREF(original_size);
+        return NULL;
+    }
+    PyTuple_SET_ITEM(py_multi_object, 0, compressed);
+    PyTuple_SET_ITEM(py_multi_object, 1, original_size);
+    if (start != 0) {
+        usx_stats_finish(stats, &stats->compress, "compress", start, 1, uncompressed_input_size, compressed_size,
+                         allocation);
+    }
+    return py_multi_object;
+}
+
+/*
+ * Decompresses straight into a new str. Most short strings are pure ASCII, so the str is made
+ * an ASCII one of the original size up front, and its own storage serves as the output buffer.
+ * Only if something non-ASCII comes out is that UTF-8 decoded into a second str.
+ */
+static PyObject * usx_decompress_str(const usx_tables *tables, const char *in, int len, int original_size,
+                                     int *decompressed_size) {
+    if (original_size == 0) {
+        char empty[1];
+        *decompressed_size = usx_decompress(tables, in, len, empty, 0);
+        return *decompressed_size > 0 ? NULL : PyUnicode_New(0, 0);
+    }
+    PyObject *string = PyUnicode_New(original_size, 127);
+    if (string == NULL) {
+        return NULL;
+    }
+    char *out = (char *) PyUnicode_1BYTE_DATA(string);
+    int size = usx_decompress(tables, in, len, out, original_size);
+    *decompressed_size = size;
+    if (size > original_size) {
+        Py_DECREF(string);
+        return NULL;
+    }
+    if (!usx_is_ascii(out, size)) {
+        PyObject *decoded = PyUnicode_DecodeUTF8(out, size, NULL);
+        Py_DECREF(string);
+        return decoded;
+    }
+    if (size < original_size && PyUnicode_Resize(&string, size) < 0) {
+        Py_DECREF(string);
+        return NULL;
+    }
+    return string;
+}
+
+static PyObject * usx_decompress_object(usx_stats *stats, const usx_tables *tables, DecompressCacheObject *cache,
+                                        PyObject *const *args, Py_ssize_t nargs) {
+    const char *compressed_data;
+    Py_ssize_t compressed_data_size;
+    int original_data_size;
+    int parsed = 0;
+
+    if (nargs == 2 && PyBytes_Check(args[0]) && PyLong_CheckExact(args[1])) {
+        int overflow;
+        long size = PyLong_AsLongAndOverflow(args[1], &overflow);
+        if (!overflow && size >= INT_MIN && size <= INT_MAX) {
+            compressed_data = PyBytes_AS_STRING(args[0]);
+            compressed_data_size = PyBytes_GET_SIZE(args[0]);
+            original_data_size = (int) size;
+            parsed = 1;
+        }
+    }
+    /*
+     * ":decompress" leads to Python referencing this function correctly in the event of
+     * an error during parsing, like when passing a list instead of bytes.
+     *
+     * Note that we *have* to use "y#" because "y" does not allow for NULL bytes.
+     */
+    if (!parsed && !usx_parse_args(args, nargs, "y#i:decompress", &compressed_data, &compressed_data_size,
+                                   &original_data_size)) {
+        return NULL;
+    }
+    if (original_data_size < 0) {
+        PyErr_SetString(PyExc_ValueError, "original size must not be negative");
+        return NULL;
+    }
+    if (compressed_data_size > INT_MAX) {
+        PyErr_SetString(PyExc_OverflowError, "input is too large to decompress");
+        return NULL;
+    }
+
+    /* Only exact bytes are cached, since they are immutable and hash by their contents. */
+    PyObject *key = args[0];
+    if (cache != NULL && !PyBytes_CheckExact(key)) {
+        cache = NULL;
+    }
+    if (cache != NULL) {
+        PyObject *cached = usx_cache_get(cache, key, original_data_size);
+        if (cached != NULL) {
+            if (USX_LOAD_FLAG(stats->enabled)) {
+                USX_LOCK(stats);
+                stats->decompress.cache_hits++;
+                USX_UNLOCK(stats);
+            }
+            return cached;
+        }
+    }
+
+    /**
+     * Notice that this is trusting user input for length: Unishox2 does not record it.
+     * Too big? No problem. Too small? Unishox2 stops at the end of the buffer, and we raise
+     * a ValueError instead of returning a truncated string.
+     *
+     * See: https://github.com/siara-cc/Unishox/issues/5
+     *
+     * I recommend calculating and storing the initial string length separately.
+     */
+    int64_t start = usx_stats_start(stats);
+    int decompressed_size = 0;
+    PyObject *py_string_object = usx_decompress_str(tables, compressed_data, (int) compressed_data_size,
+                                                    original_data_size, &decompressed_size);
+    if (py_string_object == NULL) {
+        if (decompressed_size > original_data_size) {
+            PyErr_SetString(PyExc_ValueError, "original size is too small for the decompressed string");
+        }
+        return NULL;
+    }
+    if (cache != NULL) {
+        usx_cache_put(cache, key, py_string_object, decompressed_size);
+    }
+    if (start != 0) {
+        usx_stats_finish(stats, &stats->decompress, "decompress", start, 1, compressed_data_size, decompressed_size,
+                         original_data_size);
+    }
+    return py_string_object;
+}
+
+static PyObject * usx_compress_bound_object(const usx_tables *tables, PyObject *const *args, Py_ssize_t nargs) {
+    Py_ssize_t size;
+
+    if (nargs == 1 && PyLong_CheckExact(args[0])) {
+        size = PyLong_AsSsize_t(args[0]);
+        if (size == -1 && PyErr_Occurred()) {
+            return NULL;
+        }
+    } else if (!usx_parse_args(args, nargs, "n:compress_bound", &size)) {
+        return NULL;
+    }
+    if (size < 0) {
+        PyErr_SetString(PyExc_ValueError, "size must not be negative");
+        return NULL;
+    }
+    Py_ssize_t bound = usx_compress_bound(size, tables);
+    if (bound < 0) {
+        PyErr_SetString(PyExc_OverflowError, "size is too large");
+        return NULL;
+    }
+    return PyLong_FromSsize_t(bound);
+}
+
+/*
+ * compress_into() and decompress_into() write straight into a caller-provided buffer, and
+ * return how many bytes they wrote. Both sides go through the buffer protocol, so any
+ * contiguous bytes-like object works: bytes, bytearray, memoryview, mmap, array, NumPy...
+ */
+typedef int (*usx_codec_fn)(const usx_tables *tables, const char *in, int len, char *out, int olen);
+
+static PyObject * usx_codec_into(usx_stats *stats, usx_codec_fn codec, const usx_tables *tables,
+                                 Py_buffer *input, Py_buffer *output) {
+    int written;
+    int64_t start = usx_stats_start(stats);
+
+    if (input->len > INT_MAX / 8) {
+        PyErr_SetString(PyExc_OverflowError, "input is too large");
+        return NULL;
+    }
+    int olen = usx_output_len(output->len);
+    if (input->len >= USX_RELEASE_GIL_SIZE) {
+        Py_BEGIN_ALLOW_THREADS
+        written = codec(tables, (const char *) input->buf, (int) input->len, (char *) output->buf, olen);
+        Py_END_ALLOW_THREADS
+    } else {
+        written = codec(tables, (const char *) input->buf, (int) input->len, (char *) output->buf, olen);
+    }
+    if (written > olen) {
+        PyErr_SetString(PyExc_ValueError, "output buffer is too small");
+        return NULL;
+    }
+    if (start != 0) {
+        usx_op_stats *op = codec == usx_compress ? &stats->compress : &stats->decompress;
+        usx_stats_finish(stats, op, codec == usx_compress ? "compress_into" : "decompress_into", start, 1,
+                         input->len, written, 0);
+    }
+    return PyLong_FromLong(written);
+}
+
+/*
+ * Gets the buffers of compress_into() or decompress_into() without going through a format.
+ * Returns 0, with no exception set, for anything it does not handle, which is then parsed with
+ * the usual format so that conversions and errors stay the same. `text` allows a str input.
+ */
+static int usx_get_buffers(PyObject *const *args, Py_ssize_t nargs, int text, Py_buffer *input, Py_buffer *output) {
+    if (nargs != 2) {
+        return 0;
+    }
+    if (text && PyUnicode_Check(args[0])) {
+        Py_ssize_t size;
+        const char *utf8 = usx_str_utf8(args[0], &size);
+        if (utf8 == NULL) {
+            PyErr_Clear();
+            return 0;
+        }
+        PyBuffer_FillInfo(input, args[0], (void *) utf8, size, 1, PyBUF_SIMPLE);
+    } else if (PyObject_GetBuffer(args[0], input, PyBUF_SIMPLE) < 0) {
+        PyErr_Clear();
+        return 0;
+    }
+    if (PyObject_GetBuffer(args[1], output, PyBUF_WRITABLE) < 0) {
+        PyErr_Clear();
+        PyBuffer_Release(input);
+        return 0;
+    }
+    return 1;
+}
+
+static PyObject * usx_compress_into_object(usx_stats *stats, const usx_tables *tables, PyObject *const *args,
+                                           Py_ssize_t nargs) {
+    Py_buffer input, output;
+
+    if (!usx_get_buffers(args, nargs, 1, &input, &output) &&
+        !usx_parse_args(args, nargs, "s*w*:compress_into", &input, &output)) {
+        return NULL;
+    }
+    PyObject *result = usx_codec_into(stats, usx_compress, tables, &input, &output);
+    PyBuffer_Release(&input);
+    PyBuffer_Release(&output);
+    return result;
+}
+
+static PyObject * usx_decompress_into_object(usx_stats *stats, const usx_tables *tables, PyObject *const *args,
+                                             Py_ssize_t nargs) {
+    Py_buffer input, output;
+
+    if (!usx_get_buffers(args, nargs, 0, &input, &output) &&
+        !usx_parse_args(args, nargs, "y*w*:decompress_into", &input, &output)) {
+        return NULL;
+    }
+    PyObject *result = usx_codec_into(stats, usx_decompress, tables, &input, &output);
+    PyBuffer_Release(&input);
+    PyBuffer_Release(&output);
+    return result;
+}
+
+/*
+ * Batch API
+ *
+ * compress_many() and decompress_many() collect the raw input pointers of every item while
+ * holding the GIL, then run the whole batch through Unishox2 with the GIL released. The batch
+ * can be fanned out over several native threads, each of which works on a contiguous run of
+ * items. Every job owns a disjoint slice of one shared output arena, so workers never need
+ * to synchronize with each other.
+ */
+typedef struct {
+    const char *in;
+    int in_size;
+    char *out;
+    int out_len;
+    int out_size;
+} usx_job;
+
+typedef struct {
+    usx_codec_fn codec;
+    const usx_tables *tables;
+    usx_job *jobs;
+    Py_ssize_t start;
+    Py_ssize_t stop;
+} usx_batch;
+
+static void usx_run_batch(usx_batch *batch) {
+    for (Py_ssize_t i = batch->start; i < batch->stop; i++) {
+        usx_job *job = &batch->jobs[i];
+        job->out_size = batch->codec(batch->tables, job->in, job->in_size, job->out, job->out_len);
+    }
+}
+
+#ifdef _WIN32
+typedef HANDLE usx_thread;
+
+static DWORD WINAPI usx_thread_main(LPVOID arg) {
+    usx_run_batch((usx_batch *) arg);
+    return 0;
+}
+
+static int usx_thread_start(usx_thread *thread, usx_batch *batch) {
+    *thread = CreateThread(NULL, 0, usx_thread_main, batch, 0, NULL);
+    return *thread == NULL ? -1 : 0;
+}
+
+static void usx_thread_join(usx_thread thread) {
+    WaitForSingleObject(thread, INFINITE);
+    CloseHandle(thread);
+}
+#else
+typedef pthread_t usx_thread;
+
+static void * usx_thread_main(void *arg) {
+    usx_run_batch((usx_batch *) arg);
+    return NULL;
+}
+
+static int usx_thread_start(usx_thread *thread, usx_batch *batch) {
+    return pthread_create(thread, NULL, usx_thread_main, batch) == 0 ? 0 : -1;
+}
+
+static void usx_thread_join(usx_thread thread) {
+    pthread_join(thread, NULL);
+}
+#endif
+
+/*
+ * Runs every job through the codec. Must be called *without* the GIL held.
+ *
+ * Items are split into at most `threads` contiguous runs of roughly equal input size, so a
+ * few long strings don't leave the other workers idle. The calling thread always takes the
+ * last run itself, and if a worker thread can't be started its run is done inline instead.
+ */
+static void usx_run_jobs(usx_codec_fn codec, const usx_tables *tables, usx_job *jobs,
+                         Py_ssize_t job_count, int threads) {
+    usx_batch batches[USX_MAX_THREADS];
+    usx_thread handles[USX_MAX_THREADS];
+    int started[USX_MAX_THREADS];
+    Py_ssize_t total_size = 0;
+    Py_ssize_t chunk_size, chunk_filled = 0;
+    int batch_count = 0;
+
+    if (threads > job_count) {
+        threads = (int) job_count;
+    }
+    if (threads <= 1) {
+        usx_batch batch = {codec, tables, jobs, 0, job_count};
+        usx_run_batch(&batch);
+        return;
+    }
+
+    for (Py_ssize_t i = 0; i < job_count; i++) {
+        total_size += jobs[i].in_size + 1;
+    }
+    chunk_size = total_size / threads + 1;
+
+    batches[0].codec = codec;
+    batches[0].tables = tables;
+    batches[0].jobs = jobs;
+    batches[0].start = 0;
+    for (Py_ssize_t i = 0; i < job_count; i++) {
+        chunk_filled += jobs[i].in_size + 1;
+        if (chunk_filled >= chunk_size && batch_count < threads - 1 && i + 1 < job_count) {
+            batches[batch_count].stop = i + 1;
+            batch_count++;
+            batches[batch_count].codec = codec;
+            batches[batch_count].tables = tables;
+            batches[batch_count].jobs = jobs;
+            batches[batch_count].start = i + 1;
+            chunk_filled = 0;
+        }
+    }
+    batches[batch_count].stop = job_count;
+    batch_count++;
+
+    for (int t = 0; t < batch_count - 1; t++) {
+        started[t] = usx_thread_start(&handles[t], &batches[t]) == 0;
+        if (!started[t]) {
+            usx_run_batch(&batches[t]);
+        }
+    }
+    usx_run_batch(&batches[batch_count - 1]);
+    for (int t = 0; t < batch_count - 1; t++) {
+        if (started[t]) {
+            usx_thread_join(handles[t]);
+        }
+    }
+}
+
+static int usx_check_threads(int threads) {
+    if (threads < 1 || threads > USX_MAX_THREADS) {
+        PyErr_Format(PyExc_ValueError, "threads must be between 1 and %d", USX_MAX_THREADS);
+        return -1;
+    }
+    return 0;
+}
+
+/*
+ * Points a job at the UTF-8 bytes of a str (or bytes) item, which has to stay alive until the
+ * job is done.
+ */
+static int usx_set_string_job(PyObject *item, usx_job *job, const char *function) {
+    const char *data;
+    Py_ssize_t size;
+    if (PyUnicode_Check(item)) {
+        data = PyUnicode_AsUTF8AndSize(item, &size);
+        if (data == NULL) {
+            return -1;
+        }
+    } else if (PyBytes_Check(item)) {
+        data = PyBytes_AS_STRING(item);
+        size = PyBytes_GET_SIZE(item);
+    } else {
+        PyErr_Format(PyExc_TypeError, "%s() items must be str or bytes, not %.200s", function,
+                     Py_TYPE(item)->tp_name);
+        return -1;
+    }
+    if (size > INT_MAX / 8) {
+        PyErr_Format(PyExc_OverflowError, "%s() item is too large", function);
+        return -1;
+    }
+    job->in = data;
+    job->in_size = (int) size;
+    return 0;
+}
+
+/*
+ * Counts every job of a finished batch, then the batch call as a whole.
+ */
+static void usx_stats_finish_batch(usx_stats *stats, usx_op_stats *op, const char *function, int64_t start,
+                                   const usx_job *jobs, Py_ssize_t job_count, Py_ssize_t allocation) {
+    Py_ssize_t bytes_in = 0, bytes_out = 0;
+    USX_LOCK(stats);
+    for (Py_ssize_t i = 0; i < job_count; i++) {
+        usx_stats_add(stats, op, jobs[i].in_size, jobs[i].out_size);
+        bytes_in += jobs[i].in_size;
+        bytes_out += jobs[i].out_size;
+    }
+    USX_UNLOCK(stats);
+    usx_stats_finish(stats, op, function, start, 0, bytes_in, bytes_out, allocation);
+}
+
+static PyObject * usx_compress_many_object(usx_stats *stats, const usx_tables *tables, PyObject *args,
+                                           PyObject *kwargs) {
+    static char *kwlist[] = {"strings", "threads", NULL};
+    PyObject *strings;
+    int threads = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|i:compress_many", kwlist, &strings, &threads)) {
+        return NULL;
+    }
+    if (usx_check_threads(threads) < 0) {
+        return NULL;
+    }
+
+    /*
+     * A private tuple keeps every item (and so every UTF-8 buffer we point into) alive while
+     * the GIL is released, even if the caller's list is mutated by another thread meanwhile.
+     */
+    int64_t start = usx_stats_start(stats);
+    PyObject *items = PySequence_Tuple(strings);
+    if (items == NULL) {
+        return NULL;
+    }
+    Py_ssize_t item_count = PyTuple_GET_SIZE(items);
+    usx_job *jobs = PyMem_New(usx_job, item_count ? item_count : 1);
+    char *arena = NULL;
+    PyObject *result = NULL;
+    Py_ssize_t arena_size = 0;
+    if (jobs == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    for (Py_ssize_t i = 0; i < item_count; i++) {
+        if (usx_set_string_job(PyTuple_GET_ITEM(items, i), &jobs[i], "compress_many") < 0) {
+            goto done;
+        }
+        jobs[i].out_len = (int) usx_compress_bound(jobs[i].in_size, tables);
+        if (arena_size > PY_SSIZE_T_MAX - jobs[i].out_len) {
+            PyErr_NoMemory();
+            goto done;
+        }
+        arena_size += jobs[i].out_len;
+    }
+
+    arena = PyMem_Malloc(arena_size ? arena_size : 1);
+    if (arena == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    arena_size = 0;
+    for (Py_ssize_t i = 0; i < item_count; i++) {
+        jobs[i].out = arena + arena_size;
+        arena_size += jobs[i].out_len;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    usx_run_jobs(usx_compress, tables, jobs, item_count, threads);
+    Py_END_ALLOW_THREADS
+
+    result = PyList_New(item_count);
+    if (result == NULL) {
+        goto done;
+    }
+    for (Py_ssize_t i = 0; i < item_count; i++) {
+        if (jobs[i].out_size > jobs[i].out_len) {
+            Py_CLEAR(result);
+            PyErr_SetString(PyExc_SystemError, "unishox2 exceeded its compress_bound()");
+            goto done;
+        }
+        PyObject *pair = Py_BuildValue("y#i", jobs[i].out, (Py_ssize_t) jobs[i].out_size, jobs[i].in_size);
+        if (pair == NULL) {
+            Py_CLEAR(result);
+            goto done;
+        }
+        PyList_SET_ITEM(result, i, pair);
+    }
+    if (start != 0) {
+        usx_stats_finish_batch(stats, &stats->compress, "compress_many", start, jobs, item_count, arena_size);
+    }
+
+done:
+    PyMem_Free(arena);
+    PyMem_Free(jobs);
+    Py_DECREF(items);
+    return result;
+}
+
+static PyObject * usx_decompress_many_object(usx_stats *stats, const usx_tables *tables, PyObject *args,
+                                             PyObject *kwargs) {
+    static char *kwlist[] = {"items", "threads", NULL};
+    PyObject *pairs;
+    int threads = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|i:decompress_many", kwlist, &pairs, &threads)) {
+        return NULL;
+    }
+    if (usx_check_threads(threads) < 0) {
+        return NULL;
+    }
+
+    int64_t start = usx_stats_start(stats);
+    PyObject *items = PySequence_Tuple(pairs);
+    if (items == NULL) {
+        return NULL;
+    }
+    Py_ssize_t item_count = PyTuple_GET_SIZE(items);
+    usx_job *jobs = PyMem_New(usx_job, item_count ? item_count : 1);
+    char *arena = NULL;
+    PyObject *result = NULL;
+    Py_ssize_t arena_size = 0;
+    if (jobs == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    for (Py_ssize_t i = 0; i < item_count; i++) {
+        PyObject *item = PyTuple_GET_ITEM(items, i);
+        const char *data;
+        Py_ssize_t size;
+        int original_size;
+        if (!PyTuple_Check(item)) {
+            PyErr_Format(PyExc_TypeError, "decompress_many() items must be (bytes, int) tuples, not %.200s",
+                         Py_TYPE(item)->tp_name);
+            goto done;
+        }
+        if (!PyArg_ParseTuple(item, "y#i:decompress_many", &data, &size, &original_size)) {
+            goto done;
+        }
+        if (original_size < 0) {
+            PyErr_SetString(PyExc_ValueError, "decompress_many() original sizes must not be negative");
+            goto done;
+        }
+        if (size > INT_MAX) {
+            PyErr_SetString(PyExc_OverflowError, "decompress_many() item is too large");
+            goto done;
+        }
+        jobs[i].in = data;
+        jobs[i].in_size = (int) size;
+        jobs[i].out_len = original_size;
+        arena_size += original_size;
+    }
+
+    arena = PyMem_Malloc(arena_size ? arena_size : 1);
+    if (arena == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    arena_size = 0;
+    for (Py_ssize_t i = 0; i < item_count; i++) {
+        jobs[i].out = arena + arena_size;
+        arena_size += jobs[i].out_len;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    usx_run_jobs(usx_decompress, tables, jobs, item_count, threads);
+    Py_END_ALLOW_THREADS
+
+    result = PyList_New(item_count);
+    if (result == NULL) {
+        goto done;
+    }
+    for (Py_ssize_t i = 0; i < item_count; i++) {
+        if (jobs[i].out_size > jobs[i].out_len) {
+            Py_CLEAR(result);
+            PyErr_Format(PyExc_ValueError, "original size of item %zd is too small for the decompressed string", i);
+            goto done;
+        }
+        PyObject *string = PyUnicode_FromStringAndSize(jobs[i].out, jobs[i].out_size);
+        if (string == NULL) {
+            Py_CLEAR(result);
+            goto done;
+        }
+        PyList_SET_ITEM(result, i, string);
+    }
+    if (start != 0) {
+        usx_stats_finish_batch(stats, &stats->decompress, "decompress_many", start, jobs, item_count, arena_size);
+    }
+
+done:
+    PyMem_Free(arena);
+    PyMem_Free(jobs);
+    Py_DECREF(items);
+    return result;
+}
+
+/*
+ * Codec objects
+ *
+ * A Codec is built once from one of Unishox2's presets, optionally with some of its tables
+ * replaced, and keeps those tables in native memory for its whole lifetime. Codecs are
+ * immutable, so a single one can safely be shared between threads.
+ */
+typedef struct {
+    const char *name;
+    usx_tables tables;
+} usx_preset;
+
+static const usx_preset usx_presets[] = {
+    {"default", {USX_PSET_DFLT, 0}},
+    {"alpha_only", {USX_PSET_ALPHA_ONLY, 0}},
+    {"alpha_num_only", {USX_PSET_ALPHA_NUM_ONLY, 0}},
+    {"alpha_num_sym_only", {USX_PSET_ALPHA_NUM_SYM_ONLY, 0}},
+    {"alpha_num_sym_only_txt", {USX_PSET_ALPHA_NUM_SYM_ONLY_TXT, 0}},
+    {"favor_alpha", {USX_PSET_FAVOR_ALPHA, 0}},
+    {"favor_dict", {USX_PSET_FAVOR_DICT, 0}},
+    {"favor_sym", {USX_PSET_FAVOR_SYM, 0}},
+    {"favor_umlaut", {USX_PSET_FAVOR_UMLAUT, 0}},
+    {"no_dict", {USX_PSET_NO_DICT, 0}},
+    {"no_uni", {USX_PSET_NO_UNI, 0}},
+    {"no_uni_favor_text", {USX_PSET_NO_UNI_FAVOR_TEXT, 0}},
+    {"url", {USX_PSET_URL, 0}},
+    {"json", {USX_PSET_JSON, 0}},
+    {"json_no_uni", {USX_PSET_JSON_NO_UNI, 0}},
+    {"xml", {USX_PSET_XML, 0}},
+    {"html", {USX_PSET_HTML, 0}},
+    {NULL, {NULL, NULL, NULL, NULL, 0}} /* Sentinel */
+};
+
+typedef struct {
+    PyObject_HEAD
+    usx_tables tables;
+    unsigned char hcodes[USX_HCODE_COUNT];
+    unsigned char hcode_lens[USX_HCODE_COUNT];
+    const char *freq_seq[USX_FREQ_SEQ_COUNT];
+    const char *templates[USX_TEMPLATE_COUNT];
+    /* The preset this codec was built from, or NULL if any of its tables were replaced. */
+    const char *preset;
+    /* Holds the UTF-8 bytes of any replaced frequent sequences and templates. */
+    PyObject *strings;
+    /* The cache decompress() uses, or NULL. */
+    DecompressCacheObject *cache;
+    /* The statistics of the module this codec's type belongs to. */
+    usx_stats *stats;
+} CodecObject;
+
+/*
+ * Reads exactly `count` small integers from a sequence into `out`. Every hcode has to fit in
+ * its length, since Unishox2 emits them MSB-first straight from the byte.
+ */
+static int usx_read_hcode_table(PyObject *sequence, const char *name, int limit, unsigned char *out) {
+    PyObject *items = PySequence_Fast(sequence, "hcode tables must be sequences of integers");
+    if (items == NULL) {
+        return -1;
+    }
+    if (PySequence_Fast_GET_SIZE(items) != USX_HCODE_COUNT) {
+        PyErr_Format(PyExc_ValueError, "%s must have exactly %d items", name, USX_HCODE_COUNT);
+        Py_DECREF(items);
+        return -1;
+    }
+    for (int i = 0; i < USX_HCODE_COUNT; i++) {
+        long value = PyLong_AsLong(PySequence_Fast_GET_ITEM(items, i));
+        if (value == -1 && PyErr_Occurred()) {
+            Py_DECREF(items);
+            return -1;
+        }
+        if (value < 0 || value > limit) {
+            PyErr_Format(PyExc_ValueError, "%s items must be between 0 and %d", name, limit);
+            Py_DECREF(items);
+            return -1;
+        }
+        out[i] = (unsigned char) value;
+    }
+    Py_DECREF(items);
+    return 0;
+}
+
+/*
+ * Reads up to `count` strings from a sequence, appending their UTF-8 bytes to `strings` and
+ * pointing `out` into them. Frequent sequences can never be None or empty, since Unishox2
+ * would match an empty one forever.
+ */
+static int usx_read_string_table(PyObject *sequence, const char *name, Py_ssize_t count,
+                                 int allow_none, PyObject *strings, const char **out) {
+    PyObject *items = PySequence_Fast(sequence, "string tables must be sequences of strings");
+    if (items == NULL) {
+        return -1;
+    }
+    Py_ssize_t size = PySequence_Fast_GET_SIZE(items);
+    if (allow_none ? size > count : size != count) {
+        PyErr_Format(PyExc_ValueError, allow_none ? "%s must have at most %zd items" : "%s must have exactly %zd items",
+                     name, count);
+        Py_DECREF(items);
+        return -1;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        PyObject *item = i < size ? PySequence_Fast_GET_ITEM(items, i) : Py_None;
+        if (item == Py_None && allow_none) {
+            out[i] = NULL;
+            continue;
+        }
+        if (!PyUnicode_Check(item)) {
+            PyErr_Format(PyExc_TypeError, "%s items must be str, not %.200s", name, Py_TYPE(item)->tp_name);
+            Py_DECREF(items);
+            return -1;
+        }
+        PyObject *encoded = PyUnicode_AsUTF8String(item);
+        if (encoded == NULL) {
+            Py_DECREF(items);
+            return -1;
+        }
+        if (PyBytes_GET_SIZE(encoded) == 0 || strlen(PyBytes_AS_STRING(encoded)) != (size_t) PyBytes_GET_SIZE(encoded)) {
+            PyErr_Format(PyExc_ValueError, "%s items must be non-empty and must not contain NUL characters", name);
+            Py_DECREF(encoded);
+            Py_DECREF(items);
+            return -1;
+        }
+        if (PyList_Append(strings, encoded) < 0) {
+            Py_DECREF(encoded);
+            Py_DECREF(items);
+            return -1;
+        }
+        out[i] = PyBytes_AS_STRING(encoded);
+        Py_DECREF(encoded);
+    }
+    Py_DECREF(items);
+    return 0;
+}
+
+static PyObject * Codec_new(PyTypeObject *type, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"preset", "hcodes", "hcode_lens", "freq_seq", "templates", "cache", NULL};
+    const char *preset_name = "default";
+    PyObject *hcodes = Py_None, *hcode_lens = Py_None, *freq_seq = Py_None, *templates = Py_None;
+    PyObject *cache = Py_None;
+    const usx_preset *preset;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|s$OOOOO:Codec", kwlist, &preset_name,
+                                     &hcodes, &hcode_lens, &freq_seq, &templates, &cache)) {
+        return NULL;
+    }
+    usx_state *state = usx_type_state(type);
+    if (state == NULL) {
+        return NULL;
+    }
+    if (cache != Py_None && !PyObject_TypeCheck(cache, state->DecompressCacheType)) {
+        PyErr_Format(PyExc_TypeError, "cache must be a unishox2.DecompressCache or None, not %.200s",
+                     Py_TYPE(cache)->tp_name);
+        return NULL;
+    }
+    for (preset = usx_presets; preset->name != NULL; preset++) {
+        if (strcmp(preset->name, preset_name) == 0) {
+            break;
+        }
+    }
+    if (preset->name == NULL) {
+        PyErr_Format(PyExc_ValueError, "unknown preset: '%.200s'", preset_name);
+        return NULL;
+    }
+
+    CodecObject *self = (CodecObject *) type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    memcpy(self->hcodes, preset->tables.hcodes, sizeof(self->hcodes));
+    memcpy(self->hcode_lens, preset->tables.hcode_lens, sizeof(self->hcode_lens));
+    memcpy(self->freq_seq, preset->tables.freq_seq, sizeof(self->freq_seq));
+    memcpy(self->templates, preset->tables.templates, sizeof(self->templates));
+    self->preset = preset->name;
+    self->stats = &state->stats;
+    self->strings = PyList_New(0);
+    if (self->strings == NULL) {
+        goto error;
+    }
+
+    if (hcodes != Py_None) {
+        self->preset = NULL;
+        if (usx_read_hcode_table(hcodes, "hcodes", 255, self->hcodes) < 0) {
+            goto error;
+        }
+    }
+    if (hcode_lens != Py_None) {
+        self->preset = NULL;
+        if (usx_read_hcode_table(hcode_lens, "hcode_lens", 8, self->hcode_lens) < 0) {
+            goto error;
+        }
+    }
+    for (int i = 0; i < USX_HCODE_COUNT; i++) {
+        if ((unsigned char) (self->hcodes[i] << self->hcode_lens[i]) != 0) {
+            PyErr_Format(PyExc_ValueError, "hcode %d (0x%02x) does not fit in %d bits", i,
+                         self->hcodes[i], self->hcode_lens[i]);
+            goto error;
+        }
+    }
+    if (freq_seq != Py_None) {
+        self->preset = NULL;
+        if (usx_read_string_table(freq_seq, "freq_seq", USX_FREQ_SEQ_COUNT, 0, self->strings, self->freq_seq) < 0) {
+            goto error;
+        }
+    }
+    if (templates != Py_None) {
+        self->preset = NULL;
+        if (usx_read_string_table(templates, "templates", USX_TEMPLATE_COUNT, 1, self->strings, self->templates) < 0) {
+            goto error;
+        }
+    }
+
+    self->tables.hcodes = self->hcodes;
+    self->tables.hcode_lens = self->hcode_lens;
+    self->tables.freq_seq = self->freq_seq;
+    self->tables.templates = self->templates;
+    self->tables.bits_per_byte = usx_max_bits_per_byte(&self->tables);
+    if (cache != Py_None) {
+        Py_INCREF(cache);
+        self->cache = (DecompressCacheObject *) cache;
+    }
+    return (PyObject *) self;
+
+error:
+    Py_DECREF(self);
+    return NULL;
+}
+
+static void Codec_dealloc(CodecObject *self) {
+    PyTypeObject *type = Py_TYPE(self);
+    PyObject_GC_UnTrack(self);
+    Py_XDECREF(self->strings);
+    Py_XDECREF(self->cache);
+    type->tp_free((PyObject *) self);
+    USX_RELEASE_TYPE(type);
+}
+
+static int Codec_traverse(CodecObject *self, visitproc visit, void *arg) {
+    USX_VISIT_TYPE(self);
+    Py_VISIT(self->cache);
+    return 0;
+}
+
+/*
+ * Only drops the cache, which is optional. The tables point into `strings`, so it has to stay.
+ */
+static int Codec_tp_clear(CodecObject *self) {
+    Py_CLEAR(self->cache);
+    return 0;
+}
+
+static PyObject * Codec_repr(CodecObject *self) {
+    if (self->preset == NULL) {
+        return PyUnicode_FromFormat("<%s with custom tables>", Py_TYPE(self)->tp_name);
+    }
+    return PyUnicode_FromFormat("%s(preset='%s')", Py_TYPE(self)->tp_name, self->preset);
+}
+
+static PyObject * Codec_compress(CodecObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_compress_object(self->stats, &self->tables, args, nargs);
+}
+
+static PyObject * Codec_decompress(CodecObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_decompress_object(self->stats, &self->tables, self->cache, args, nargs);
+}
+
+static PyObject * Codec_compress_bound(CodecObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_compress_bound_object(&self->tables, args, nargs);
+}
+
+static PyObject * Codec_compress_into(CodecObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_compress_into_object(self->stats, &self->tables, args, nargs);
+}
+
+static PyObject * Codec_decompress_into(CodecObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_decompress_into_object(self->stats, &self->tables, args, nargs);
+}
+
+static PyObject * Codec_compress_many(CodecObject *self, PyObject *args, PyObject *kwargs) {
+    return usx_compress_many_object(self->stats, &self->tables, args, kwargs);
+}
+
+static PyObject * Codec_decompress_many(CodecObject *self, PyObject *args, PyObject *kwargs) {
+    return usx_decompress_many_object(self->stats, &self->tables, args, kwargs);
+}
+
+static PyObject * usx_string_table_tuple(const char **table, Py_ssize_t count) {
+    PyObject *result = PyTuple_New(count);
+    if (result == NULL) {
+        return NULL;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        PyObject *item;
+        if (table[i] == NULL) {
+            item = Py_None;
+            Py_INCREF(item);
+        } else {
+            item = PyUnicode_FromString(table[i]);
+            if (item == NULL) {
+                Py_DECREF(result);
+                return NULL;
+            }
+        }
+        PyTuple_SET_ITEM(result, i, item);
+    }
+    return result;
+}
+
+static PyObject * Codec_get_preset(CodecObject *self, void *closure) {
+    if (self->preset == NULL) {
+        Py_RETURN_NONE;
+    }
+    return PyUnicode_FromString(self->preset);
+}
+
+static PyObject * Codec_get_hcodes(CodecObject *self, void *closure) {
+    return Py_BuildValue("(BBBBB)", self->hcodes[0], self->hcodes[1], self->hcodes[2], self->hcodes[3], self->hcodes[4]);
+}
+
+static PyObject * Codec_get_hcode_lens(CodecObject *self, void *closure) {
+    return Py_BuildValue("(BBBBB)", self->hcode_lens[0], self->hcode_lens[1], self->hcode_lens[2],
+                         self->hcode_lens[3], self->hcode_lens[4]);
+}
+
+static PyObject * Codec_get_freq_seq(CodecObject *self, void *closure) {
+    return usx_string_table_tuple(self->freq_seq, USX_FREQ_SEQ_COUNT);
+}
+
+static PyObject * Codec_get_templates(CodecObject *self, void *closure) {
+    return usx_string_table_tuple(self->templates, USX_TEMPLATE_COUNT);
+}
+
+static PyObject * Codec_get_cache(CodecObject *self, void *closure) {
+    PyObject *cache = self->cache == NULL ? Py_None : (PyObject *) self->cache;
+    Py_INCREF(cache);
+    return cache;
+}
+
+static PyMethodDef Codec_methods[] = {
+    {"compress", (PyCFunction)(void(*)(void)) Codec_compress, USX_METH_FASTCALL,
+     "Compresses a string using this codec's tables.\n\nArgs:\n    string: An input string.\nReturns:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output."},
+    {"decompress", (PyCFunction)(void(*)(void)) Codec_decompress, USX_METH_FASTCALL,
+     "Decompresses a string compressed with this codec's tables.\n\nArgs:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output.\nReturns:\n    string: The decompressed, near-original string.\nRaises:\n    ValueError: If the number of bytes is too small for the output."},
+    {"compress_bound", (PyCFunction)(void(*)(void)) Codec_compress_bound, USX_METH_FASTCALL,
+     "Returns the largest possible compressed size of an input with this codec's tables.\n\nArgs:\n    int: The size of the input, in UTF-8 bytes.\nReturns:\n    int: The worst-case number of bytes compress() can produce for it."},
+    {"compress_into", (PyCFunction)(void(*)(void)) Codec_compress_into, USX_METH_FASTCALL,
+     "Compresses a string into a writable buffer using this codec's tables.\n\nSee unishox2.compress_into()."},
+    {"decompress_into", (PyCFunction)(void(*)(void)) Codec_decompress_into, USX_METH_FASTCALL,
+     "Decompresses a string into a writable buffer using this codec's tables.\n\nSee unishox2.decompress_into()."},
+    {"compress_many", (PyCFunction)(void(*)(void)) Codec_compress_many, METH_VARARGS | METH_KEYWORDS,
+     "Compresses a sequence of strings using this codec's tables.\n\nSee unishox2.compress_many()."},
+    {"decompress_many", (PyCFunction)(void(*)(void)) Codec_decompress_many, METH_VARARGS | METH_KEYWORDS,
+     "Decompresses a sequence of strings using this codec's tables.\n\nSee unishox2.decompress_many()."},
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+static PyGetSetDef Codec_getset[] = {
+    {"preset", (getter) Codec_get_preset, NULL, "The name of the preset used, or None for custom tables.", NULL},
+    {"hcodes", (getter) Codec_get_hcodes, NULL, "The horizontal codes, one per character set.", NULL},
+    {"hcode_lens", (getter) Codec_get_hcode_lens, NULL, "The length of each horizontal code, in bits.", NULL},
+    {"freq_seq", (getter) Codec_get_freq_seq, NULL, "The six frequently occurring sequences.", NULL},
+    {"templates", (getter) Codec_get_templates, NULL, "The five templates, None where unused.", NULL},
+    {"cache", (getter) Codec_get_cache, NULL, "The DecompressCache decompress() uses, or None.", NULL},
+    {NULL, NULL, NULL, NULL, NULL} /* Sentinel */
+};
+
+static PyType_Slot Codec_slots[] = {
+    {Py_tp_dealloc, (void *) Codec_dealloc},
+    {Py_tp_traverse, (void *) Codec_traverse},
+    {Py_tp_clear, (void *) Codec_tp_clear},
+    {Py_tp_repr, (void *) Codec_repr},
+    {Py_tp_methods, Codec_methods},
+    {Py_tp_getset, Codec_getset},
+    {Py_tp_new, (void *) Codec_new},
+    {Py_tp_doc, "Codec(preset='default', *, hcodes=None, hcode_lens=None, freq_seq=None, templates=None, cache=None)\n--\n\n"
+                "A unishox2 codec with its own, prepared set of tables.\n\n"
+                "Args:\n"
+                "    preset: The name of a Unishox2 preset to start from, see unishox2.PRESETS.\n"
+                "    hcodes: Five horizontal codes replacing the preset's.\n"
+                "    hcode_lens: Five horizontal code lengths replacing the preset's.\n"
+                "    freq_seq: Six frequently occurring sequences replacing the preset's.\n"
+                "    templates: Up to five templates (or None) replacing the preset's.\n"
+                "    cache: A DecompressCache for decompress() to use, or None.\n\n"
+                "Data must be decompressed with a codec using the same tables it was compressed with."},
+    {0, NULL} /* Sentinel */
+};
+
+static PyType_Spec Codec_spec = {
+    "unishox2.Codec",
+    sizeof(CodecObject),
+    0,
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_IMMUTABLETYPE | Py_TPFLAGS_HAVE_GC,
+    Codec_slots,
+};
+
+/*
+ * Line contexts
+ *
+ * Unishox2 can code a repeated run of bytes as a back-reference into one of the lines coded
+ * before it, handed over as a us_lnk_lst list which starts at the line being coded. A
+ * LineContext keeps a bounded window of the most recent lines, so that records which repeat
+ * each other (log lines, chat messages, ...) compress against each other. The decompressing
+ * side has to see the same lines in the same order to rebuild the same window.
+ */
+#define USX_DEFAULT_WINDOW_LINES 16
+#define USX_DEFAULT_WINDOW_BYTES 65536
+#define USX_MAX_WINDOW_LINES 1024
+
+/*
+ * encodeCount() silently emits nothing for counts of 67732 or more, so a back-reference into
+ * a longer line could not be decoded. Lines longer than this never enter the window.
+ */
+#define USX_MAX_WINDOW_LINE_LEN 65535
+
+typedef struct {
+    PyObject_HEAD
+    /* The codec whose tables are used, or NULL for the default preset. */
+    CodecObject *codec;
+    const usx_tables *tables;
+    /* A ring of max_lines NUL-terminated lines, the oldest at index `first`. */
+    char **lines;
+    Py_ssize_t *line_lens;
+    Py_ssize_t max_lines;
+    Py_ssize_t max_bytes;
+    Py_ssize_t first;
+    Py_ssize_t count;
+    Py_ssize_t nbytes;
+    /* One list node for the line being coded, plus one per window line. */
+    struct us_lnk_lst *links;
+} LineContextObject;
+
+static void LineContext_clear_window(LineContextObject *self) {
+    for (Py_ssize_t i = 0; i < self->count; i++) {
+        PyMem_Free(self->lines[(self->first + i) % self->max_lines]);
+    }
+    self->first = 0;
+    self->count = 0;
+    self->nbytes = 0;
+}
+
+/*
+ * Takes ownership of a PyMem_Malloc'd line and appends it to the window, evicting the oldest
+ * lines to stay within max_lines and max_bytes. Lines which could never fit are dropped, as
+ * are empty ones, which could never be referenced. Both sides of a context make the same
+ * decision, since it only depends on the line itself.
+ */
+static void LineContext_push(LineContextObject *self, char *line, Py_ssize_t len) {
+    if (len == 0 || len > self->max_bytes || len > USX_MAX_WINDOW_LINE_LEN) {
+        PyMem_Free(line);
+        return;
+    }
+    while (self->count == self->max_lines || self->nbytes + len > self->max_bytes) {
+        self->nbytes -= self->line_lens[self->first];
+        PyMem_Free(self->lines[self->first]);
+        self->first = (self->first + 1) % self->max_lines;
+        self->count--;
+    }
+    Py_ssize_t index = (self->first + self->count) % self->max_lines;
+    self->lines[index] = line;
+    self->line_lens[index] = len;
+    self->count++;
+    self->nbytes += len;
+}
+
+/*
+ * Links the line being coded in front of the window lines, newest first, which is the order
+ * Unishox2 numbers them in.
+ */
+static struct us_lnk_lst * LineContext_link(LineContextObject *self, char *current, char **window) {
+    self->links[0].data = current;
+    for (Py_ssize_t i = 1; i <= self->count; i++) {
+        self->links[i - 1].previous = &self->links[i];
+        self->links[i].data = window[i - 1];
+    }
+    self->links[self->count].previous = NULL;
+    return self->links;
+}
+
+static PyObject * LineContext_new(PyTypeObject *type, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"codec", "max_lines", "max_bytes", NULL};
+    PyObject *codec = Py_None;
+    Py_ssize_t max_lines = USX_DEFAULT_WINDOW_LINES;
+    Py_ssize_t max_bytes = USX_DEFAULT_WINDOW_BYTES;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O$nn:LineContext", kwlist, &codec, &max_lines, &max_bytes)) {
+        return NULL;
+    }
+    usx_state *state = usx_type_state(type);
+    if (state == NULL) {
+        return NULL;
+    }
+    if (codec != Py_None && !PyObject_TypeCheck(codec, state->CodecType)) {
+        PyErr_Format(PyExc_TypeError, "codec must be a unishox2.Codec or None, not %.200s", Py_TYPE(codec)->tp_name);
+        return NULL;
+    }
+    if (max_lines < 1 || max_lines > USX_MAX_WINDOW_LINES) {
+        PyErr_Format(PyExc_ValueError, "max_lines must be between 1 and %d", USX_MAX_WINDOW_LINES);
+        return NULL;
+    }
+    if (max_bytes < 1) {
+        PyErr_SetString(PyExc_ValueError, "max_bytes must be positive");
+        return NULL;
+    }
+
+    LineContextObject *self = (LineContextObject *) type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    self->max_lines = max_lines;
+    self->max_bytes = max_bytes;
+    self->lines = PyMem_New(char *, max_lines);
+    self->line_lens = PyMem_New(Py_ssize_t, max_lines);
+    self->links = PyMem_New(struct us_lnk_lst, max_lines + 1);
+    if (self->lines == NULL || self->line_lens == NULL || self->links == NULL) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+    if (codec == Py_None) {
+        self->tables = &usx_default_tables;
+    } else {
+        Py_INCREF(codec);
+        self->codec = (CodecObject *) codec;
+        self->tables = &self->codec->tables;
+    }
+    return (PyObject *) self;
+}
+
+static void LineContext_dealloc(LineContextObject *self) {
+    PyTypeObject *type = Py_TYPE(self);
+    PyObject_GC_UnTrack(self);
+    if (self->lines != NULL) {
+        LineContext_clear_window(self);
+    }
+    PyMem_Free(self->lines);
+    PyMem_Free(self->line_lens);
+    PyMem_Free(self->links);
+    Py_XDECREF(self->codec);
+    type->tp_free((PyObject *) self);
+    USX_RELEASE_TYPE(type);
+}
+
+static int LineContext_traverse(LineContextObject *self, visitproc visit, void *arg) {
+    USX_VISIT_TYPE(self);
+    Py_VISIT(self->codec);
+    return 0;
+}
+
+/*
+ * The window is shared state, so a context codes one line at a time even without a GIL. The
+ * *_locked functions run in a critical section on the context.
+ */
+static PyObject * LineContext_compress_locked(LineContextObject *self, const char *uncompressed_input,
+                                              Py_ssize_t uncompressed_input_size) {
+    const usx_tables *tables = self->tables;
+    char *window[USX_MAX_WINDOW_LINES];
+
+    if (uncompressed_input_size > INT_MAX / 8) {
+        PyErr_SetString(PyExc_OverflowError, "input is too large to compress");
         return NULL;
     }
 
     /*
-     * We cannot say certainly that the compressed output will be smaller.
-     * This current extra allocation is wasteful, and I'd like to get a better method.
+     * Unishox2 finds the end of every line in the list with strlen(), so the window holds
+     * NUL-terminated copies. This one becomes the newest window line afterwards.
      */
-    int output_buffer_size = (uncompressed_input_size + 8) * 1.5;
-    char *output_buffer = (char *) malloc(output_buffer_size);
-    int compressed_size = unishox2_compress_simple(uncompressed_input, uncompressed_input_size, output_buffer);
+    char *line = (char *) PyMem_Malloc(uncompressed_input_size + 1);
+    if (line == NULL) {
+        return PyErr_NoMemory();
+    }
+    memcpy(line, uncompressed_input, uncompressed_input_size);
+    line[uncompressed_input_size] = '\0';
 
     /*
-     * Yay. Compression done. Let's build python bytes out of that raw memory!
-     * No matter how big our buffer is, the "compressed_size" tells us where the actual
-     * data stops. That's where we mark the end.
+     * The first node of the list should be the line being coded, but Unishox2 lets a match
+     * there run on past the current position, which its decoder cannot copy back. Linking a
+     * blank line of the same length instead keeps it from finding any match in the current
+     * line, while still scanning the window exactly as it would otherwise.
      */
-    PyObject *py_multi_object = Py_BuildValue("y#i", output_buffer, compressed_size, uncompressed_input_size);
-    free(output_buffer);
+    int output_buffer_size = (int) usx_compress_bound(uncompressed_input_size, tables);
+    char *output_buffer = (char *) PyMem_Malloc(output_buffer_size + uncompressed_input_size + 1);
+    if (output_buffer == NULL) {
+        PyMem_Free(line);
+        return PyErr_NoMemory();
+    }
+    char *blank = output_buffer + output_buffer_size;
+    memset(blank, 0, uncompressed_input_size + 1);
+    for (Py_ssize_t i = 0; i < self->count; i++) {
+        window[i] = self->lines[(self->first + self->count - 1 - i) % self->max_lines];
+    }
+    int compressed_size = unishox2_compress_lines(line, (int) uncompressed_input_size,
+                                                  output_buffer, output_buffer_size,
+                                                  tables->hcodes, tables->hcode_lens, tables->freq_seq,
+                                                  tables->templates, LineContext_link(self, blank, window));
+    if (compressed_size > output_buffer_size) {
+        PyMem_Free(output_buffer);
+        PyMem_Free(line);
+        PyErr_SetString(PyExc_SystemError, "unishox2 exceeded its compress_bound()");
+        return NULL;
+    }
+
+    PyObject *py_multi_object = Py_BuildValue("y#n", output_buffer, (Py_ssize_t) compressed_size,
+                                              uncompressed_input_size);
+    PyMem_Free(output_buffer);
+    if (py_multi_object == NULL) {
+        PyMem_Free(line);
+        return NULL;
+    }
+    LineContext_push(self, line, uncompressed_input_size);
     return py_multi_object;
 }
 
-static PyObject * py_unishox_decompress(PyObject *self, PyObject *args) {
-    char *compressed_data;
-    Py_ssize_t compressed_data_size;
-    int original_data_size;
+static PyObject * LineContext_compress(LineContextObject *self, PyObject *args) {
+    const char *uncompressed_input;
+    Py_ssize_t uncompressed_input_size;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "s#:compress", &uncompressed_input, &uncompressed_input_size)) {
+        return NULL;
+    }
+    Py_BEGIN_CRITICAL_SECTION(self);
+    result = LineContext_compress_locked(self, uncompressed_input, uncompressed_input_size);
+    Py_END_CRITICAL_SECTION();
+    return result;
+}
+
+static PyObject * LineContext_decompress_locked(LineContextObject *self, const char *compressed_data,
+                                                Py_ssize_t compressed_data_size, int original_data_size) {
+    const usx_tables *tables = self->tables;
+    char *window[USX_MAX_WINDOW_LINES];
+
+    if (original_data_size < 0) {
+        PyErr_SetString(PyExc_ValueError, "original size must not be negative");
+        return NULL;
+    }
+    if (compressed_data_size > INT_MAX) {
+        PyErr_SetString(PyExc_OverflowError, "input is too large to decompress");
+        return NULL;
+    }
 
     /*
-     * ":decompress" leads to Python referencing this function correctly in the event of
-     * an error during PyArg_ParseTuple, like when passing a list instead of bytes.
-     *
-     * Note that we *have* to use "y#" because "y" does not allow for NULL bytes.
+     * Unishox2 copies back-references without checking them against the end of the line
+     * they point into, only against the space left in the output. Laying the window lines
+     * out in one arena, directly followed by the output buffer, keeps even a corrupt
+     * back-reference inside memory we own. The output is zeroed, since Unishox2 also calls
+     * strlen() on it to find back-references into the line being decoded.
      */
+    size_t arena_size = (size_t) self->nbytes + (size_t) self->count + (size_t) original_data_size + 1;
+    char *arena = (char *) PyMem_Malloc(arena_size);
+    if (arena == NULL) {
+        return PyErr_NoMemory();
+    }
+    char *output_buffer = arena;
+    for (Py_ssize_t i = 0; i < self->count; i++) {
+        Py_ssize_t index = (self->first + self->count - 1 - i) % self->max_lines;
+        memcpy(output_buffer, self->lines[index], self->line_lens[index] + 1);
+        window[i] = output_buffer;
+        output_buffer += self->line_lens[index] + 1;
+    }
+    memset(output_buffer, 0, (size_t) original_data_size + 1);
+
+    int decompressed_size = unishox2_decompress_lines(compressed_data, (int) compressed_data_size,
+                                                      output_buffer, original_data_size,
+                                                      tables->hcodes, tables->hcode_lens, tables->freq_seq,
+                                                      tables->templates, LineContext_link(self, output_buffer, window));
+    if (decompressed_size > original_data_size) {
+        PyMem_Free(arena);
+        PyErr_SetString(PyExc_ValueError, "original size is too small for the decompressed string");
+        return NULL;
+    }
+
+    PyObject *py_string_object = Py_BuildValue("s#", output_buffer, (Py_ssize_t) decompressed_size);
+    char *line = py_string_object == NULL ? NULL : (char *) PyMem_Malloc(decompressed_size + 1);
+    if (line != NULL) {
+        memcpy(line, output_buffer, decompressed_size);
+        line[decompressed_size] = '\0';
+        LineContext_push(self, line, decompressed_size);
+    } else if (py_string_object != NULL) {
+        Py_CLEAR(py_string_object);
+        PyErr_NoMemory();
+    }
+    PyMem_Free(arena);
+    return py_string_object;
+}
+
+static PyObject * LineContext_decompress(LineContextObject *self, PyObject *args) {
+    const char *compressed_data;
+    Py_ssize_t compressed_data_size;
+    int original_data_size;
+    PyObject *result;
+
     if (!PyArg_ParseTuple(args, "y#i:decompress", &compressed_data, &compressed_data_size, &original_data_size)) {
         return NULL;
     }
+    Py_BEGIN_CRITICAL_SECTION(self);
+    result = LineContext_decompress_locked(self, compressed_data, compressed_data_size, original_data_size);
+    Py_END_CRITICAL_SECTION();
+    return result;
+}
 
-    /**
-     * Notice that this is trusting user input for length, and there is no ability to try or catch.
-     * You put in a number that's too small? Too bad. This *WILL* core dump. Too big? No problem.
-     * 
-     * It's a feature, sorta: https://github.com/siara-cc/Unishox/issues/5
-     * 
-     * I recommend calculating and storing the initial string length separately.
+static PyObject * LineContext_reset(LineContextObject *self, PyObject *ignored) {
+    Py_BEGIN_CRITICAL_SECTION(self);
+    LineContext_clear_window(self);
+    Py_END_CRITICAL_SECTION();
+    Py_RETURN_NONE;
+}
+
+static Py_ssize_t LineContext_length(LineContextObject *self) {
+    Py_ssize_t count;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    count = self->count;
+    Py_END_CRITICAL_SECTION();
+    return count;
+}
+
+static PyObject * LineContext_get_codec(LineContextObject *self, void *closure) {
+    if (self->codec == NULL) {
+        Py_RETURN_NONE;
+    }
+    Py_INCREF(self->codec);
+    return (PyObject *) self->codec;
+}
+
+static PyObject * LineContext_get_max_lines(LineContextObject *self, void *closure) {
+    return PyLong_FromSsize_t(self->max_lines);
+}
+
+static PyObject * LineContext_get_max_bytes(LineContextObject *self, void *closure) {
+    return PyLong_FromSsize_t(self->max_bytes);
+}
+
+static PyObject * LineContext_get_nbytes(LineContextObject *self, void *closure) {
+    Py_ssize_t nbytes;
+    Py_BEGIN_CRITICAL_SECTION(self);
+    nbytes = self->nbytes;
+    Py_END_CRITICAL_SECTION();
+    return PyLong_FromSsize_t(nbytes);
+}
+
+static PyMethodDef LineContext_methods[] = {
+    {"compress", (PyCFunction) LineContext_compress, METH_VARARGS,
+     "Compresses the next line against the window, then adds it to the window.\n\nArgs:\n    string: An input string.\nReturns:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output."},
+    {"decompress", (PyCFunction) LineContext_decompress, METH_VARARGS,
+     "Decompresses the next line against the window, then adds it to the window.\n\nArgs:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output.\nReturns:\n    string: The decompressed, near-original string.\nRaises:\n    ValueError: If the number of bytes is too small for the output."},
+    {"reset", (PyCFunction) LineContext_reset, METH_NOARGS,
+     "Empties the window, as if the context had just been created."},
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+static PyGetSetDef LineContext_getset[] = {
+    {"codec", (getter) LineContext_get_codec, NULL, "The codec whose tables are used, or None for the default preset.", NULL},
+    {"max_lines", (getter) LineContext_get_max_lines, NULL, "The largest number of lines kept in the window.", NULL},
+    {"max_bytes", (getter) LineContext_get_max_bytes, NULL, "The largest number of UTF-8 bytes kept in the window.", NULL},
+    {"nbytes", (getter) LineContext_get_nbytes, NULL, "The number of UTF-8 bytes currently in the window.", NULL},
+    {NULL, NULL, NULL, NULL, NULL} /* Sentinel */
+};
+
+static PyType_Slot LineContext_slots[] = {
+    {Py_tp_dealloc, (void *) LineContext_dealloc},
+    {Py_tp_traverse, (void *) LineContext_traverse},
+    {Py_sq_length, (void *) LineContext_length},
+    {Py_tp_methods, LineContext_methods},
+    {Py_tp_getset, LineContext_getset},
+    {Py_tp_new, (void *) LineContext_new},
+    {Py_tp_doc, "LineContext(codec=None, *, max_lines=16, max_bytes=65536)\n--\n\n"
+                "Compresses a stream of related lines against a window of the lines before them.\n\n"
+                "Args:\n"
+                "    codec: The unishox2.Codec whose tables to use, or None for the default preset.\n"
+                "    max_lines: The largest number of previous lines to keep (at most 1024).\n"
+                "    max_bytes: The largest number of UTF-8 bytes of previous lines to keep.\n\n"
+                "Lines must be decompressed in the order they were compressed in, by a new context with\n"
+                "the same arguments. A context is not meant to be shared between threads."},
+    {0, NULL} /* Sentinel */
+};
+
+static PyType_Spec LineContext_spec = {
+    "unishox2.LineContext",
+    sizeof(LineContextObject),
+    0,
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_IMMUTABLETYPE | Py_TPFLAGS_HAVE_GC,
+    LineContext_slots,
+};
+
+/*
+ * Column API
+ *
+ * These take and return whole columns of strings in the layout Arrow uses: one contiguous
+ * data buffer plus n + 1 offsets into it, with compressed columns also carrying the n original
+ * sizes. Unlike compress_many() and decompress_many(), they create no Python object per row.
+ * unishox2.columnar adapts Arrow and NumPy arrays to them.
+ *
+ * Offsets and sizes are native int64s, except for the offsets of a decompressed column, which
+ * are int32s unless a large column (with int64 offsets, like Arrow's large_string) is needed.
+ */
+static int usx_codec_tables(usx_state *state, PyObject *codec, const usx_tables **tables) {
+    if (codec == Py_None) {
+        *tables = &usx_default_tables;
+        return 0;
+    }
+    if (!PyObject_TypeCheck(codec, state->CodecType)) {
+        PyErr_Format(PyExc_TypeError, "codec must be a unishox2.Codec or None, not %.200s", Py_TYPE(codec)->tp_name);
+        return -1;
+    }
+    *tables = &((CodecObject *) codec)->tables;
+    return 0;
+}
+
+/*
+ * Reads the n + 1 offsets of a column, checking they are in order and within its data.
+ */
+static int64_t * usx_read_offsets(Py_buffer *offsets, int width, Py_ssize_t count, Py_ssize_t data_size,
+                                  int64_t item_limit) {
+    int64_t *values = PyMem_New(int64_t, count + 1);
+    if (values == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (Py_ssize_t i = 0; i <= count; i++) {
+        if (width == 4) {
+            int32_t value;
+            memcpy(&value, (const char *) offsets->buf + i * 4, 4);
+            values[i] = value;
+        } else {
+            memcpy(&values[i], (const char *) offsets->buf + i * 8, 8);
+        }
+        if (values[i] < 0 || values[i] > data_size || (i > 0 && values[i] < values[i - 1])) {
+            PyErr_Format(PyExc_ValueError, "offset %zd is out of order or out of range", i);
+            PyMem_Free(values);
+            return NULL;
+        }
+        if (i > 0 && values[i] - values[i - 1] > item_limit) {
+            PyErr_Format(PyExc_OverflowError, "item %zd is too large", i - 1);
+            PyMem_Free(values);
+            return NULL;
+        }
+    }
+    return values;
+}
+
+/*
+ * Compresses jobs whose inputs are already set, packing the output into a new column of
+ * (data, offsets, sizes).
+ */
+static PyObject * usx_compress_column_jobs(const usx_tables *tables, usx_job *jobs, Py_ssize_t count, int threads) {
+    Py_ssize_t arena_size = 0;
+    int exceeded = 0;
+    PyObject *result = NULL, *data = NULL, *offsets = NULL, *sizes = NULL;
+
+    for (Py_ssize_t i = 0; i < count; i++) {
+        jobs[i].out_len = (int) usx_compress_bound(jobs[i].in_size, tables);
+        if (arena_size > PY_SSIZE_T_MAX - jobs[i].out_len) {
+            return PyErr_NoMemory();
+        }
+        arena_size += jobs[i].out_len;
+    }
+    data = PyBytes_FromStringAndSize(NULL, arena_size);
+    offsets = PyBytes_FromStringAndSize(NULL, (count + 1) * (Py_ssize_t) sizeof(int64_t));
+    sizes = PyBytes_FromStringAndSize(NULL, count * (Py_ssize_t) sizeof(int64_t));
+    if (data == NULL || offsets == NULL || sizes == NULL) {
+        goto done;
+    }
+    char *out = PyBytes_AS_STRING(data);
+    int64_t *out_offsets = (int64_t *) PyBytes_AS_STRING(offsets);
+    int64_t *out_sizes = (int64_t *) PyBytes_AS_STRING(sizes);
+    arena_size = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+        jobs[i].out = out + arena_size;
+        arena_size += jobs[i].out_len;
+    }
+
+    int64_t position = 0;
+    Py_BEGIN_ALLOW_THREADS
+    usx_run_jobs(usx_compress, tables, jobs, count, threads);
+    /* Every job is done, so the outputs can be packed together in place. */
+    for (Py_ssize_t i = 0; i < count; i++) {
+        if (jobs[i].out_size > jobs[i].out_len) {
+            exceeded = 1;
+            break;
+        }
+        memmove(out + position, jobs[i].out, jobs[i].out_size);
+        out_offsets[i] = position;
+        out_sizes[i] = jobs[i].in_size;
+        position += jobs[i].out_size;
+    }
+    out_offsets[count] = position;
+    Py_END_ALLOW_THREADS
+
+    if (exceeded) {
+        PyErr_SetString(PyExc_SystemError, "unishox2 exceeded its compress_bound()");
+        goto done;
+    }
+    if (_PyBytes_Resize(&data, (Py_ssize_t) position) < 0) {
+        data = NULL;
+        goto done;
+    }
+    result = PyTuple_Pack(3, data, offsets, sizes);
+
+done:
+    Py_XDECREF(data);
+    Py_XDECREF(offsets);
+    Py_XDECREF(sizes);
+    return result;
+}
+
+static PyObject * py_unishox_compress_column(PyObject *self, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"data", "offsets", "offset_width", "codec", "threads", NULL};
+    Py_buffer data, offsets;
+    int width, threads = 1;
+    PyObject *codec = Py_None;
+    const usx_tables *tables;
+    PyObject *result = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*y*i|Oi:_compress_column", kwlist, &data, &offsets,
+                                     &width, &codec, &threads)) {
+        return NULL;
+    }
+    if (usx_codec_tables(usx_get_state(self), codec, &tables) < 0 || usx_check_threads(threads) < 0) {
+        goto done;
+    }
+    if ((width != 4 && width != 8) || offsets.len % width != 0 || offsets.len == 0) {
+        PyErr_SetString(PyExc_ValueError, "offsets must hold at least one int32 or int64");
+        goto done;
+    }
+    Py_ssize_t count = offsets.len / width - 1;
+    int64_t *values = usx_read_offsets(&offsets, width, count, data.len, INT_MAX / 8);
+    if (values == NULL) {
+        goto done;
+    }
+    usx_job *jobs = PyMem_New(usx_job, count ? count : 1);
+    if (jobs == NULL) {
+        PyMem_Free(values);
+        PyErr_NoMemory();
+        goto done;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        jobs[i].in = (const char *) data.buf + values[i];
+        jobs[i].in_size = (int) (values[i + 1] - values[i]);
+    }
+    result = usx_compress_column_jobs(tables, jobs, count, threads);
+    PyMem_Free(jobs);
+    PyMem_Free(values);
+
+done:
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&offsets);
+    return result;
+}
+
+/*
+ * Appends a code point to `out` as UTF-8, returning how many bytes it takes. Only counts them
+ * if `out` is NULL.
+ */
+static int usx_utf8_encode(uint32_t code_point, char *out) {
+    if (code_point < 0x80) {
+        if (out != NULL) {
+            out[0] = (char) code_point;
+        }
+        return 1;
+    }
+    if (code_point < 0x800) {
+        if (out != NULL) {
+            out[0] = (char) (0xC0 | (code_point >> 6));
+            out[1] = (char) (0x80 | (code_point & 0x3F));
+        }
+        return 2;
+    }
+    if (code_point < 0x10000) {
+        if (out != NULL) {
+            out[0] = (char) (0xE0 | (code_point >> 12));
+            out[1] = (char) (0x80 | ((code_point >> 6) & 0x3F));
+            out[2] = (char) (0x80 | (code_point & 0x3F));
+        }
+        return 3;
+    }
+    if (out != NULL) {
+        out[0] = (char) (0xF0 | (code_point >> 18));
+        out[1] = (char) (0x80 | ((code_point >> 12) & 0x3F));
+        out[2] = (char) (0x80 | ((code_point >> 6) & 0x3F));
+        out[3] = (char) (0x80 | (code_point & 0x3F));
+    }
+    return 4;
+}
+
+/*
+ * Compresses a fixed-width UCS-4 column, the layout of NumPy's "U" arrays: each row is
+ * `width` code points, padded at the end with NULs. Rows are transcoded to UTF-8 first.
+ */
+static PyObject * py_unishox_compress_ucs4(PyObject *self, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"data", "width", "codec", "threads", NULL};
+    Py_buffer data;
+    Py_ssize_t width;
+    int threads = 1;
+    PyObject *codec = Py_None;
+    const usx_tables *tables;
+    PyObject *result = NULL;
+    usx_job *jobs = NULL;
+    char *utf8 = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*n|Oi:_compress_ucs4", kwlist, &data, &width,
+                                     &codec, &threads)) {
+        return NULL;
+    }
+    if (usx_codec_tables(usx_get_state(self), codec, &tables) < 0 || usx_check_threads(threads) < 0) {
+        goto done;
+    }
+    if (width < 1 || width > PY_SSIZE_T_MAX / 4 || data.len % (width * 4) != 0 || (uintptr_t) data.buf % 4 != 0) {
+        PyErr_SetString(PyExc_ValueError, "data must be aligned rows of width UCS-4 code points");
+        goto done;
+    }
+    Py_ssize_t count = data.len / (width * 4);
+    const uint32_t *code_points = (const uint32_t *) data.buf;
+    jobs = PyMem_New(usx_job, count ? count : 1);
+    if (jobs == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    /*
+     * First count the UTF-8 bytes of every row, then transcode them all into one arena. Until
+     * the rows are compressed, each job's out_len holds its row's length in code points.
      */
-    char *output_buffer = (char *) malloc(original_data_size + 1);
-    int decompressed_size = unishox2_decompress_simple(compressed_data, compressed_data_size, output_buffer);
+    Py_ssize_t utf8_size = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+        const uint32_t *row = code_points + i * width;
+        Py_ssize_t length = width, row_size = 0;
+        while (length > 0 && row[length - 1] == 0) {
+            length--;
+        }
+        for (Py_ssize_t j = 0; j < length; j++) {
+            if (row[j] > 0x10FFFF || (row[j] >= 0xD800 && row[j] <= 0xDFFF)) {
+                PyErr_Format(PyExc_ValueError, "row %zd holds an invalid code point U+%04X", i, row[j]);
+                goto done;
+            }
+            row_size += usx_utf8_encode(row[j], NULL);
+        }
+        if (row_size > INT_MAX / 8) {
+            PyErr_Format(PyExc_OverflowError, "item %zd is too large", i);
+            goto done;
+        }
+        jobs[i].in_size = (int) row_size;
+        jobs[i].out_len = (int) length;
+        utf8_size += row_size;
+    }
+    utf8 = (char *) PyMem_Malloc(utf8_size ? utf8_size : 1);
+    if (utf8 == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    utf8_size = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+        const uint32_t *row = code_points + i * width;
+        jobs[i].in = utf8 + utf8_size;
+        for (Py_ssize_t j = 0; j < jobs[i].out_len; j++) {
+            utf8_size += usx_utf8_encode(row[j], utf8 + utf8_size);
+        }
+    }
+    result = usx_compress_column_jobs(tables, jobs, count, threads);
 
-    PyObject *py_string_object = Py_BuildValue("s#", output_buffer, decompressed_size);
-    free(output_buffer);
-    return py_string_object;
+done:
+    PyMem_Free(utf8);
+    PyMem_Free(jobs);
+    PyBuffer_Release(&data);
+    return result;
+}
+
+static PyObject * py_unishox_compress_strings(PyObject *self, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"strings", "codec", "threads", NULL};
+    PyObject *strings;
+    int threads = 1;
+    PyObject *codec = Py_None;
+    const usx_tables *tables;
+    PyObject *result = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|Oi:_compress_strings", kwlist, &strings, &codec, &threads)) {
+        return NULL;
+    }
+    if (usx_codec_tables(usx_get_state(self), codec, &tables) < 0 || usx_check_threads(threads) < 0) {
+        return NULL;
+    }
+    PyObject *items = PySequence_Tuple(strings);
+    if (items == NULL) {
+        return NULL;
+    }
+    Py_ssize_t count = PyTuple_GET_SIZE(items);
+    usx_job *jobs = PyMem_New(usx_job, count ? count : 1);
+    if (jobs == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        if (usx_set_string_job(PyTuple_GET_ITEM(items, i), &jobs[i], "_compress_strings") < 0) {
+            goto done;
+        }
+    }
+    result = usx_compress_column_jobs(tables, jobs, count, threads);
+
+done:
+    PyMem_Free(jobs);
+    Py_DECREF(items);
+    return result;
+}
+
+static PyObject * py_unishox_decompress_column(PyObject *self, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"data", "offsets", "sizes", "large", "codec", "threads", NULL};
+    Py_buffer data, offsets, sizes;
+    int large = 0, threads = 1;
+    Py_ssize_t too_small = -1;
+    PyObject *codec = Py_None;
+    const usx_tables *tables;
+    PyObject *result = NULL, *out_data = NULL, *out_offsets = NULL;
+    int64_t *values = NULL;
+    usx_job *jobs = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*y*y*|iOi:_decompress_column", kwlist, &data, &offsets,
+                                     &sizes, &large, &codec, &threads)) {
+        return NULL;
+    }
+    if (usx_codec_tables(usx_get_state(self), codec, &tables) < 0 || usx_check_threads(threads) < 0) {
+        goto done;
+    }
+    Py_ssize_t count = sizes.len / (Py_ssize_t) sizeof(int64_t);
+    if (sizes.len % sizeof(int64_t) != 0 || offsets.len != (count + 1) * (Py_ssize_t) sizeof(int64_t)) {
+        PyErr_SetString(PyExc_ValueError, "offsets and sizes must hold n + 1 and n int64s");
+        goto done;
+    }
+    values = usx_read_offsets(&offsets, 8, count, data.len, INT_MAX);
+    jobs = PyMem_New(usx_job, count ? count : 1);
+    if (values == NULL || jobs == NULL) {
+        if (values != NULL) {
+            PyErr_NoMemory();
+        }
+        goto done;
+    }
+    Py_ssize_t arena_size = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+        int64_t size;
+        memcpy(&size, (const char *) sizes.buf + i * sizeof(int64_t), sizeof(int64_t));
+        if (size < 0 || size > INT_MAX) {
+            PyErr_Format(PyExc_ValueError, "original size of item %zd is out of range", i);
+            goto done;
+        }
+        if (arena_size > PY_SSIZE_T_MAX - size) {
+            PyErr_NoMemory();
+            goto done;
+        }
+        jobs[i].in = (const char *) data.buf + values[i];
+        jobs[i].in_size = (int) (values[i + 1] - values[i]);
+        jobs[i].out_len = (int) size;
+        arena_size += size;
+    }
+
+    /* A large of -1 picks 64-bit offsets only if the original sizes add up to more than 2 GiB. */
+    if (large < 0) {
+        large = arena_size > INT32_MAX;
+    }
+    Py_ssize_t width = large ? sizeof(int64_t) : sizeof(int32_t);
+    out_data = PyBytes_FromStringAndSize(NULL, arena_size);
+    out_offsets = PyBytes_FromStringAndSize(NULL, (count + 1) * width);
+    if (out_data == NULL || out_offsets == NULL) {
+        goto done;
+    }
+    char *out = PyBytes_AS_STRING(out_data);
+    char *out_offset = PyBytes_AS_STRING(out_offsets);
+    arena_size = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+        jobs[i].out = out + arena_size;
+        arena_size += jobs[i].out_len;
+    }
+
+    int64_t position = 0;
+    Py_BEGIN_ALLOW_THREADS
+    usx_run_jobs(usx_decompress, tables, jobs, count, threads);
+    /* Every job is done, so the outputs can be packed together in place. */
+    for (Py_ssize_t i = 0; i <= count; i++) {
+        if (large) {
+            memcpy(out_offset + i * width, &position, sizeof(int64_t));
+        } else {
+            int32_t narrow = (int32_t) position;
+            memcpy(out_offset + i * width, &narrow, sizeof(int32_t));
+        }
+        if (i == count) {
+            break;
+        }
+        if (jobs[i].out_size > jobs[i].out_len) {
+            too_small = i;
+            break;
+        }
+        memmove(out + position, jobs[i].out, jobs[i].out_size);
+        position += jobs[i].out_size;
+        if (!large && position > INT32_MAX) {
+            break;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (too_small >= 0) {
+        PyErr_Format(PyExc_ValueError, "original size of item %zd is too small for the decompressed string", too_small);
+        goto done;
+    }
+    if (position > INT32_MAX && !large) {
+        PyErr_SetString(PyExc_OverflowError, "decompressed column needs 64-bit offsets, pass large=True");
+        goto done;
+    }
+    if (_PyBytes_Resize(&out_data, (Py_ssize_t) position) < 0) {
+        out_data = NULL;
+        goto done;
+    }
+    result = PyTuple_Pack(2, out_offsets, out_data);
+
+done:
+    Py_XDECREF(out_data);
+    Py_XDECREF(out_offsets);
+    PyMem_Free(jobs);
+    PyMem_Free(values);
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&offsets);
+    PyBuffer_Release(&sizes);
+    return result;
+}
+
+static PyObject * py_unishox_compress(PyObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_compress_object(&usx_get_state(self)->stats, &usx_default_tables, args, nargs);
+}
+
+static PyObject * py_unishox_decompress(PyObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    usx_state *state = usx_get_state(self);
+    DecompressCacheObject *cache = usx_state_cache(state);
+    PyObject *result = usx_decompress_object(&state->stats, &usx_default_tables, cache, args, nargs);
+    Py_XDECREF(cache);
+    return result;
+}
+
+static PyObject * py_unishox_set_decompress_cache(PyObject *self, PyObject *cache) {
+    usx_state *state = usx_get_state(self);
+    if (cache != Py_None && !PyObject_TypeCheck(cache, state->DecompressCacheType)) {
+        PyErr_Format(PyExc_TypeError, "cache must be a unishox2.DecompressCache or None, not %.200s",
+                     Py_TYPE(cache)->tp_name);
+        return NULL;
+    }
+    if (cache == Py_None) {
+        cache = NULL;
+    }
+    Py_XINCREF(cache);
+    USX_LOCK(state);
+    DecompressCacheObject *previous = state->cache;
+    state->cache = (DecompressCacheObject *) cache;
+    USX_UNLOCK(state);
+    Py_XDECREF(previous);
+    Py_RETURN_NONE;
+}
+
+static PyObject * py_unishox_get_decompress_cache(PyObject *self, PyObject *ignored) {
+    DecompressCacheObject *cache = usx_state_cache(usx_get_state(self));
+    if (cache == NULL) {
+        Py_RETURN_NONE;
+    }
+    return (PyObject *) cache;
+}
+
+static PyObject * py_unishox_stats(PyObject *self, PyObject *ignored) {
+    usx_stats *stats = &usx_get_state(self)->stats;
+    usx_op_stats compress_stats, decompress_stats;
+    int enabled = USX_LOAD_FLAG(stats->enabled);
+    USX_LOCK(stats);
+    compress_stats = stats->compress;
+    decompress_stats = stats->decompress;
+    USX_UNLOCK(stats);
+
+    PyObject *compress = usx_op_stats_dict(&compress_stats);
+    if (compress == NULL) {
+        return NULL;
+    }
+    PyObject *decompress = usx_op_stats_dict(&decompress_stats);
+    if (decompress == NULL) {
+        Py_DECREF(compress);
+        return NULL;
+    }
+    return Py_BuildValue("{sOsNsN}", "enabled", enabled ? Py_True : Py_False,
+                         "compress", compress, "decompress", decompress);
+}
+
+static PyObject * py_unishox_reset_stats(PyObject *self, PyObject *ignored) {
+    usx_stats *stats = &usx_get_state(self)->stats;
+    USX_LOCK(stats);
+    memset(&stats->compress, 0, sizeof(stats->compress));
+    memset(&stats->decompress, 0, sizeof(stats->decompress));
+    USX_UNLOCK(stats);
+    Py_RETURN_NONE;
+}
+
+static PyObject * py_unishox_set_stats_enabled(PyObject *self, PyObject *enabled) {
+    int value = PyObject_IsTrue(enabled);
+    if (value < 0) {
+        return NULL;
+    }
+    usx_stats *stats = &usx_get_state(self)->stats;
+    USX_STORE_FLAG(stats->enabled, value);
+    Py_RETURN_NONE;
+}
+
+static PyObject * py_unishox_set_slow_call_hook(PyObject *self, PyObject *args, PyObject *kwargs) {
+    static char *kwlist[] = {"hook", "threshold", NULL};
+    usx_stats *stats = &usx_get_state(self)->stats;
+    PyObject *hook;
+    double threshold = 0.001;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|d:set_slow_call_hook", kwlist, &hook, &threshold)) {
+        return NULL;
+    }
+    if (hook != Py_None && !PyCallable_Check(hook)) {
+        PyErr_Format(PyExc_TypeError, "hook must be callable or None, not %.200s", Py_TYPE(hook)->tp_name);
+        return NULL;
+    }
+    if (!(threshold >= 0 && threshold < 1e9)) {
+        PyErr_SetString(PyExc_ValueError, "threshold must be a non-negative number of seconds");
+        return NULL;
+    }
+    if (hook == Py_None) {
+        hook = NULL;
+    }
+    Py_XINCREF(hook);
+    USX_LOCK(stats);
+    PyObject *previous = stats->slow_hook;
+    stats->slow_hook = hook;
+    stats->slow_ns = (int64_t) (threshold * 1e9);
+    USX_UNLOCK(stats);
+    Py_XDECREF(previous);
+    Py_RETURN_NONE;
+}
+
+static PyObject * py_unishox_compress_bound(PyObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_compress_bound_object(&usx_default_tables, args, nargs);
+}
+
+static PyObject * py_unishox_compress_into(PyObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_compress_into_object(&usx_get_state(self)->stats, &usx_default_tables, args, nargs);
+}
+
+static PyObject * py_unishox_decompress_into(PyObject *self, USX_FASTCALL_PARAMS) {
+    USX_FASTCALL_UNPACK
+    return usx_decompress_into_object(&usx_get_state(self)->stats, &usx_default_tables, args, nargs);
+}
+
+static PyObject * py_unishox_compress_many(PyObject *self, PyObject *args, PyObject *kwargs) {
+    return usx_compress_many_object(&usx_get_state(self)->stats, &usx_default_tables, args, kwargs);
+}
+
+static PyObject * py_unishox_decompress_many(PyObject *self, PyObject *args, PyObject *kwargs) {
+    return usx_decompress_many_object(&usx_get_state(self)->stats, &usx_default_tables, args, kwargs);
 }
 
 // Which methods are exposed to the python world, including their docstrings.
 static PyMethodDef UnishoxMethods[] = {
-    {"compress", py_unishox_compress, METH_VARARGS,
+    {"compress", (PyCFunction)(void(*)(void)) py_unishox_compress, USX_METH_FASTCALL,
      "Compresses a string using unishox2 compression.\n\nArgs:\n    string: An input string.\nReturns:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output."},
-    {"decompress", py_unishox_decompress, METH_VARARGS,
-     "Decompresses a unishox2 compressed string.\n\nArgs:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output.\nReturns:\n    string: The decompressed, near-original string."},
+    {"decompress", (PyCFunction)(void(*)(void)) py_unishox_decompress, USX_METH_FASTCALL,
+     "Decompresses a unishox2 compressed string.\n\nArgs:\n    bytes: A unishox2-compressed array of bytes.\n    int: The number of bytes to allocate for output.\nReturns:\n    string: The decompressed, near-original string.\nRaises:\n    ValueError: If the number of bytes is too small for the output."},
+    {"set_decompress_cache", py_unishox_set_decompress_cache, METH_O,
+     "Sets the cache the module-level decompress() uses.\n\nArgs:\n    cache: A DecompressCache, or None to stop caching.\n\nCodecs only use the cache they were created with."},
+    {"get_decompress_cache", py_unishox_get_decompress_cache, METH_NOARGS,
+     "Returns the cache the module-level decompress() uses, or None."},
+    {"stats", py_unishox_stats, METH_NOARGS,
+     "Returns a snapshot of the statistics counted since the last reset_stats().\n\nReturns:\n    dict: Whether statistics are enabled, plus a dict each for \"compress\" and\n    \"decompress\", counting every call to them and their *_into and *_many variants:\n    calls (one per string), bytes_in, bytes_out, expansions (strings which compressed\n    larger than they were), seconds (total wall time), max_allocation (the largest\n    output buffer allocated, in bytes), cache_hits (decompress calls answered from a\n    decompression cache), latency (a histogram of single-string calls in\n    seconds) and ratio (a histogram of compressed over original size). Histograms are\n    tuples of (upper_bound, count) pairs, the last with an upper bound of infinity."},
+    {"reset_stats", py_unishox_reset_stats, METH_NOARGS,
+     "Resets every statistics counter to zero."},
+    {"set_stats_enabled", py_unishox_set_stats_enabled, METH_O,
+     "Turns counting statistics on or off. They are off by default.\n\nArgs:\n    enabled: Whether to count statistics."},
+    {"set_slow_call_hook", (PyCFunction)(void(*)(void)) py_unishox_set_slow_call_hook, METH_VARARGS | METH_KEYWORDS,
+     "Sets a function to call after any call which took at least `threshold` seconds.\n\nArgs:\n    hook: Called as hook(function, seconds, bytes_in, bytes_out), or None to remove it.\n        Exceptions it raises are printed and then ignored.\n    threshold: The least number of seconds a call has to take (default 0.001).\n\nCalls are only timed while statistics are enabled."},
+    {"compress_bound", (PyCFunction)(void(*)(void)) py_unishox_compress_bound, USX_METH_FASTCALL,
+     "Returns the largest possible compressed size of an input.\n\nArgs:\n    int: The size of the input, in UTF-8 bytes.\nReturns:\n    int: The worst-case number of bytes compress() can produce for it."},
+    {"compress_into", (PyCFunction)(void(*)(void)) py_unishox_compress_into, USX_METH_FASTCALL,
+     "Compresses a string into a writable buffer using unishox2 compression.\n\nArgs:\n    string: An input string, or any bytes-like object holding UTF-8.\n    buffer: Any writable bytes-like object to write the compressed bytes into.\nReturns:\n    int: The number of bytes written.\nRaises:\n    ValueError: If the buffer is too small (compress_bound() is always enough)."},
+    {"decompress_into", (PyCFunction)(void(*)(void)) py_unishox_decompress_into, USX_METH_FASTCALL,
+     "Decompresses a unishox2 compressed string into a writable buffer.\n\nArgs:\n    bytes: Any bytes-like object holding unishox2-compressed data.\n    buffer: Any writable bytes-like object to write the UTF-8 output into.\nReturns:\n    int: The number of bytes written.\nRaises:\n    ValueError: If the buffer is too small for the decompressed string."},
+    {"compress_many", (PyCFunction)(void(*)(void)) py_unishox_compress_many, METH_VARARGS | METH_KEYWORDS,
+     "Compresses a sequence of strings using unishox2 compression.\n\nThe whole batch is compressed with the GIL released.\n\nArgs:\n    strings: A sequence of strings (or UTF-8 bytes).\n    threads: The number of native threads to split the batch across (default 1).\nReturns:\n    list: A (bytes, int) tuple for each string, as returned by compress()."},
+    {"decompress_many", (PyCFunction)(void(*)(void)) py_unishox_decompress_many, METH_VARARGS | METH_KEYWORDS,
+     "Decompresses a sequence of unishox2 compressed strings.\n\nThe whole batch is decompressed with the GIL released.\n\nArgs:\n    items: A sequence of (bytes, int) tuples, as returned by compress().\n    threads: The number of native threads to split the batch across (default 1).\nReturns:\n    list: The decompressed strings, in order."},
+    {"_compress_column", (PyCFunction)(void(*)(void)) py_unishox_compress_column, METH_VARARGS | METH_KEYWORDS,
+     "Compresses a column given as UTF-8 data and int32 or int64 offsets, see unishox2.columnar."},
+    {"_compress_ucs4", (PyCFunction)(void(*)(void)) py_unishox_compress_ucs4, METH_VARARGS | METH_KEYWORDS,
+     "Compresses a column of fixed-width UCS-4 rows, see unishox2.columnar."},
+    {"_compress_strings", (PyCFunction)(void(*)(void)) py_unishox_compress_strings, METH_VARARGS | METH_KEYWORDS,
+     "Compresses a sequence of strings into a column, see unishox2.columnar."},
+    {"_decompress_column", (PyCFunction)(void(*)(void)) py_unishox_decompress_column, METH_VARARGS | METH_KEYWORDS,
+     "Decompresses a column into UTF-8 data and offsets, see unishox2.columnar."},
     {NULL, NULL, 0, NULL} /* Sentinel */
 };
 
+/*
+ * Unishox2 lazily builds a lookup table on first use, guarded by an unsynchronized flag. One
+ * tiny compression, run once per process before any module can be used, builds it so that
+ * threads (and interpreters) never race to initialize it.
+ */
+static void usx_init_coder(void) {
+    char warmup[8];
+    usx_default_tables.bits_per_byte = usx_max_bits_per_byte(&usx_default_tables);
+    usx_compress(&usx_default_tables, "", 0, warmup, sizeof(warmup));
+}
+
+#ifdef _WIN32
+static INIT_ONCE usx_init_once = INIT_ONCE_STATIC_INIT;
+
+static BOOL CALLBACK usx_init_coder_once(PINIT_ONCE once, PVOID parameter, PVOID *context) {
+    usx_init_coder();
+    return TRUE;
+}
+
+static int usx_init_coder_globals(void) {
+    return InitOnceExecuteOnce(&usx_init_once, usx_init_coder_once, NULL, NULL) ? 0 : -1;
+}
+#else
+static pthread_once_t usx_init_once = PTHREAD_ONCE_INIT;
+
+static int usx_init_coder_globals(void) {
+    return pthread_once(&usx_init_once, usx_init_coder) == 0 ? 0 : -1;
+}
+#endif
+
+static PyTypeObject * usx_new_type(PyObject *module, PyType_Spec *spec) {
+#if USX_PER_MODULE_STATE
+    return (PyTypeObject *) PyType_FromModuleAndSpec(module, spec, NULL);
+#else
+    return (PyTypeObject *) PyType_FromSpec(spec);
+#endif
+}
+
+static int usx_add_type(PyObject *module, const char *name, PyTypeObject *type) {
+    Py_INCREF(type);
+    if (PyModule_AddObject(module, name, (PyObject *) type) < 0) {
+        Py_DECREF(type);
+        return -1;
+    }
+    return 0;
+}
+
+static int usx_exec(PyObject *module) {
+    usx_state *state = usx_get_state(module);
+
+    if (usx_init_coder_globals() < 0) {
+        PyErr_SetString(PyExc_RuntimeError, "could not initialize unishox2");
+        return -1;
+    }
+    /* Before Python 3.9 the state is shared, so only the first import creates the types. */
+    if (state->CacheEntryType == NULL) {
+        state->CacheEntryType = usx_new_type(module, &CacheEntry_spec);
+        if (state->CacheEntryType == NULL) {
+            return -1;
+        }
+        state->DecompressCacheType = usx_new_type(module, &DecompressCache_spec);
+        if (state->DecompressCacheType == NULL) {
+            return -1;
+        }
+        state->CodecType = usx_new_type(module, &Codec_spec);
+        if (state->CodecType == NULL) {
+            return -1;
+        }
+        state->LineContextType = usx_new_type(module, &LineContext_spec);
+        if (state->LineContextType == NULL) {
+            return -1;
+        }
+    }
+
+    Py_ssize_t preset_count = sizeof(usx_presets) / sizeof(usx_presets[0]) - 1;
+    PyObject *presets = PyTuple_New(preset_count);
+    if (presets == NULL) {
+        return -1;
+    }
+    for (Py_ssize_t i = 0; i < preset_count; i++) {
+        PyObject *name = PyUnicode_FromString(usx_presets[i].name);
+        if (name == NULL) {
+            Py_DECREF(presets);
+            return -1;
+        }
+        PyTuple_SET_ITEM(presets, i, name);
+    }
+    if (PyModule_AddObject(module, "PRESETS", presets) < 0) {
+        Py_DECREF(presets);
+        return -1;
+    }
+
+    if (usx_add_type(module, "Codec", state->CodecType) < 0 ||
+        usx_add_type(module, "DecompressCache", state->DecompressCacheType) < 0 ||
+        usx_add_type(module, "LineContext", state->LineContextType) < 0) {
+        return -1;
+    }
+    return 0;
+}
+
+#if USX_PER_MODULE_STATE
+static int usx_traverse(PyObject *module, visitproc visit, void *arg) {
+    usx_state *state = usx_get_state(module);
+    if (state == NULL) {
+        return 0;
+    }
+    Py_VISIT(state->CacheEntryType);
+    Py_VISIT(state->DecompressCacheType);
+    Py_VISIT(state->CodecType);
+    Py_VISIT(state->LineContextType);
+    Py_VISIT(state->cache);
+    Py_VISIT(state->stats.slow_hook);
+    return 0;
+}
+
+static int usx_clear(PyObject *module) {
+    usx_state *state = usx_get_state(module);
+    if (state == NULL) {
+        return 0;
+    }
+    Py_CLEAR(state->CacheEntryType);
+    Py_CLEAR(state->DecompressCacheType);
+    Py_CLEAR(state->CodecType);
+    Py_CLEAR(state->LineContextType);
+    Py_CLEAR(state->cache);
+    Py_CLEAR(state->stats.slow_hook);
+    return 0;
+}
+
+static void usx_free(void *module) {
+    usx_clear((PyObject *) module);
+}
+#else
+#define usx_traverse NULL
+#define usx_clear NULL
+#define usx_free NULL
+#endif
+
+static PyModuleDef_Slot unishox2_slots[] = {
+    {Py_mod_exec, (void *) usx_exec},
+#ifdef Py_mod_multiple_interpreters
+    {Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED},
+#endif
+#ifdef Py_mod_gil
+    {Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+    {0, NULL} /* Sentinel */
+};
+
 static struct PyModuleDef unishox2_module = {
     PyModuleDef_HEAD_INIT,
-    "unishox2",
+    "unishox2._unishox2",
     "String compression library using Unishox2",
-    0,
-    UnishoxMethods
+    USX_MODULE_STATE_SIZE,
+    UnishoxMethods,
+    unishox2_slots,
+    usx_traverse,
+    usx_clear,
+    usx_free,
 };
 
 PyMODINIT_FUNC
-PyInit_unishox2(void) {
-    return PyModule_Create(&unishox2_module);
-}
\ No newline at end of file
+PyInit__unishox2(void) {
+    return PyModuleDef_Init(&unishox2_module);
+}